@@ -0,0 +1,405 @@
+from array import array
+from bisect import bisect_right
+from collections import deque
+
+from twisted.internet import reactor
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def targetIndices(averages, margin, steps=4):
+    """Calculate the ADR target data rate indices for a batch of devices.
+
+    Each data rate step above DR0 requires an additional 3dB of SNR
+    above margin, up to DR(steps-1). Averages below the lowest threshold
+    map to DR0.
+
+    Args:
+        averages (list): Average SNR for each device
+        margin (float): Target margin in dB
+        steps (int): Number of upstream data rates
+
+    Returns:
+        List of data rate indices.
+    """
+    thresholds = [float(i) * 3.0 + margin for i in range(steps)]
+    if numpy is not None:
+        indices = numpy.searchsorted(thresholds, averages, side='right') - 1
+        return numpy.maximum(indices, 0).tolist()
+    return [max(0, bisect_right(thresholds, a) - 1) for a in averages]
+
+class SNRStore(object):
+    """Device SNR ring buffers.
+
+    Holds the most recent width SNR readings for each device as rows of
+    a float32 matrix, indexed by a slot allocated to each DevEUI, with
+    a running sum of the latest window readings. The average SNR is
+    available when a device has at least window readings. The arrays
+    are numpy arrays if numpy is installed, otherwise flat array module
+    arrays.
+
+    Attributes:
+        width (int): Number of readings held for each device
+        window (int): Number of readings averaged
+        capacity (int): Number of allocated slots
+        slots (dict): Slot indices, keyed by DevEUI
+        free (list): Released slot indices
+        samples: SNR readings, capacity rows of width float32 values
+        sums: Sum of the latest window readings for each slot
+        pos: Next write position for each slot
+        count: Number of readings for each slot
+    """
+
+    def __init__(self, width=11, window=6, capacity=1024):
+        """SNRStore initialisation method.
+
+        Args:
+            width (int): Number of readings held for each device
+            window (int): Number of readings averaged
+            capacity (int): Initial number of slots
+        """
+        self.width = width
+        self.window = window
+        self.capacity = 0
+        self.slots = {}
+        self.free = []
+        if numpy is not None:
+            self.samples = numpy.zeros(0, numpy.float32)
+            self.sums = numpy.zeros(0, numpy.float64)
+            self.pos = numpy.zeros(0, numpy.uint8)
+            self.count = numpy.zeros(0, numpy.uint8)
+        else:
+            self.samples = array('f')
+            self.sums = array('d')
+            self.pos = array('B')
+            self.count = array('B')
+        self._grow(capacity)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _grow(self, capacity):
+        """Extend the arrays to capacity slots"""
+        n = capacity - self.capacity
+        if numpy is not None:
+            self.samples = numpy.concatenate(
+                (self.samples, numpy.zeros(n * self.width, numpy.float32)))
+            self.sums = numpy.concatenate(
+                (self.sums, numpy.zeros(n, numpy.float64)))
+            self.pos = numpy.concatenate((self.pos, numpy.zeros(n, numpy.uint8)))
+            self.count = numpy.concatenate(
+                (self.count, numpy.zeros(n, numpy.uint8)))
+        else:
+            self.samples.extend(array('f', [0.0]) * (n * self.width))
+            self.sums.extend(array('d', [0.0]) * n)
+            self.pos.extend(array('B', [0]) * n)
+            self.count.extend(array('B', [0]) * n)
+        self.capacity = capacity
+
+    def _slot(self, deveui):
+        """Get or allocate the slot for deveui"""
+        slot = self.slots.get(deveui)
+        if slot is None:
+            if self.free:
+                slot = self.free.pop()
+            else:
+                slot = len(self.slots)
+                if slot >= self.capacity:
+                    self._grow(max(1024, self.capacity * 2))
+            self.slots[deveui] = slot
+        return slot
+
+    def nbytes(self):
+        """Size of the arrays in bytes"""
+        return sum(len(a) * a.itemsize for a in
+                   (self.samples, self.sums, self.pos, self.count))
+
+    def add(self, deveui, lsnr):
+        """Add a SNR reading.
+
+        Args:
+            deveui (int): Device DevEUI
+            lsnr (float): Latest link SNR measure
+
+        Returns:
+            The average SNR, or None if there are too few readings.
+        """
+        slot = self._slot(deveui)
+        base = slot * self.width
+        p = int(self.pos[slot])
+        n = int(self.count[slot])
+        # Remove the reading leaving the window
+        if n >= self.window:
+            self.sums[slot] -= self.samples[base + (p - self.window) % self.width]
+        self.samples[base + p] = lsnr
+        self.sums[slot] += self.samples[base + p]
+        self.pos[slot] = (p + 1) % self.width
+        if n < self.width:
+            self.count[slot] = n + 1
+        return self.average(deveui)
+
+    def load(self, deveui, readings):
+        """Replace a device's readings.
+
+        Args:
+            deveui (int): Device DevEUI
+            readings (list): SNR readings, oldest first
+        """
+        self.remove(deveui)
+        for lsnr in (readings or [])[-self.width:]:
+            self.add(deveui, lsnr)
+
+    def average(self, deveui):
+        """Get the average of a device's latest window readings.
+
+        Args:
+            deveui (int): Device DevEUI
+
+        Returns:
+            The average SNR, or None if there are too few readings.
+        """
+        slot = self.slots.get(deveui)
+        if slot is None or self.count[slot] < self.window:
+            return None
+        return round(float(self.sums[slot]) / self.window, 4)
+
+    def averages(self, deveuis):
+        """Get the average SNR for a batch of devices.
+
+        Args:
+            deveuis (list): Device DevEUIs
+
+        Returns:
+            A tuple of the DevEUIs that have an average, and their
+            averages as a numpy array or a list.
+        """
+        deveuis = [d for d in deveuis if d in self.slots]
+        if numpy is not None:
+            slots = numpy.fromiter((self.slots[d] for d in deveuis),
+                                   numpy.intp, len(deveuis))
+            mask = self.count[slots] >= self.window
+            deveuis = [d for (d, m) in zip(deveuis, mask.tolist()) if m]
+            return (deveuis, numpy.round(self.sums[slots[mask]] /
+                                         self.window, 4))
+        deveuis = [d for d in deveuis
+                   if self.count[self.slots[d]] >= self.window]
+        return (deveuis, [round(self.sums[self.slots[d]] / self.window, 4)
+                          for d in deveuis])
+
+    def readings(self, deveui):
+        """Get a device's readings, oldest first.
+
+        Args:
+            deveui (int): Device DevEUI
+
+        Returns:
+            List of SNR readings.
+        """
+        slot = self.slots.get(deveui)
+        if slot is None:
+            return []
+        base = slot * self.width
+        p = int(self.pos[slot])
+        n = int(self.count[slot])
+        return [round(float(self.samples[base + (p - n + i) % self.width]), 4)
+                for i in range(n)]
+
+    def remove(self, deveui):
+        """Release a device's slot.
+
+        Args:
+            deveui (int): Device DevEUI
+        """
+        slot = self.slots.pop(deveui, None)
+        if slot is not None:
+            self.sums[slot] = 0.0
+            self.pos[slot] = 0
+            self.count[slot] = 0
+            self.free.append(slot)
+
+class ADREngine(object):
+    """Incremental adaptive data rate engine.
+
+    Uplink SNR readings are held in an SNRStore, and mark the device
+    dirty. Each ADR cycle calculates the target data rate for the dirty
+    devices as a single batch, and schedules a LinkADRReq only for
+    devices whose target differs from their current data rate. Requests
+    are sent from a queue for each gateway, at most one every
+    adrmessagetime seconds per gateway. Changed SNR readings are saved
+    to the devices table every adrsnapshottime seconds, and when the
+    server shuts down.
+
+    Attributes:
+        netserver (NetServer): The network server
+        snr (SNRStore): Device SNR readings
+        dirty (set): DevEUIs of devices with new SNR measures
+        changed (set): DevEUIs of devices with unsaved SNR measures
+        queues (dict): Deques of DevEUIs to send, keyed by gateway address
+        queued (set): DevEUIs in the gateway queues
+        calls (dict): Scheduled gateway sends, keyed by gateway address
+        last (dict): Last send time, keyed by gateway address
+        sent (int): Number of LinkADRReq messages sent or queued
+    """
+
+    def __init__(self, netserver):
+        """ADREngine initialisation method.
+
+        Args:
+            netserver (NetServer): The network server
+        """
+        self.netserver = netserver
+        self.snr = SNRStore()
+        self.dirty = set()
+        self.changed = set()
+        self.queues = {}
+        self.queued = set()
+        self.calls = {}
+        self.last = {}
+        self.sent = 0
+
+    def updateSNR(self, device, lsnr):
+        """Add a SNR reading, and mark the device for ADR processing.
+
+        Args:
+            device (Device): The device
+            lsnr (float): Latest link SNR measure
+        """
+        if lsnr is None:
+            return
+        device.snr_average = self.snr.add(device.deveui, lsnr)
+        self.dirty.add(device.deveui)
+        self.changed.add(device.deveui)
+
+    def load(self):
+        """Load the cached devices' saved SNR readings, and mark every
+        device for ADR processing."""
+        for device in self.netserver.devices.values():
+            self.snr.load(device.deveui, getattr(device, 'snr', None))
+            self.dirty.add(device.deveui)
+
+    def remove(self, deveui):
+        """Remove a device's SNR readings and pending requests.
+
+        Args:
+            deveui (int): Device DevEUI
+        """
+        self.snr.remove(deveui)
+        self.dirty.discard(deveui)
+        self.changed.discard(deveui)
+        self.queued.discard(deveui)
+
+    def snapshot(self):
+        """Save the changed SNR readings.
+
+        Returns:
+            Number of devices saved.
+        """
+        devices = self.netserver.devices
+        saved = 0
+        for deveui in self.changed:
+            device = devices.getByEUI(deveui)
+            if device is not None:
+                devices.update(device, snr=self.snr.readings(deveui),
+                               snr_average=self.snr.average(deveui))
+                saved += 1
+        self.changed = set()
+        return saved
+
+    def process(self):
+        """Process the dirty devices.
+
+        Returns:
+            Number of devices that require a data rate change.
+        """
+        server = self.netserver
+        deveuis = [d.deveui for d in (server.devices.getByEUI(deveui)
+                                      for deveui in self.dirty)
+                   if d is not None and d.enabled and d.adr]
+        self.dirty = set()
+        (deveuis, averages) = self.snr.averages(deveuis)
+        if not deveuis:
+            return 0
+
+        band = server.band
+        indices = targetIndices(averages, server.config.adrmargin)
+        changed = 0
+        for (deveui, index) in zip(deveuis, indices):
+            device = server.devices.getByEUI(deveui)
+            target = band.datarate[index]
+            if device.adr_datr != target:
+                server.devices.update(device, adr_datr=target)
+            if device.tx_datr == target:
+                continue
+            changed += 1
+            if server.config.macqueueing:
+                # Replace any existing request
+                command = server._createLinkADRRequest(device)
+                server._dequeueMACCommand(device.deveui, command)
+                server._queueMACCommand(device.deveui, command)
+                self.sent += 1
+            else:
+                self._schedule(device)
+        return changed
+
+    def _schedule(self, device):
+        """Add a device to its gateway's send queue"""
+        if device.deveui in self.queued:
+            return
+        gw_addr = device.gw_addr
+        queue = self.queues.get(gw_addr)
+        if queue is None:
+            queue = self.queues[gw_addr] = deque()
+        queue.append(device.deveui)
+        self.queued.add(device.deveui)
+        if gw_addr not in self.calls:
+            delay = 0
+            if gw_addr in self.last:
+                delay = max(0, self.last[gw_addr] - reactor.seconds() +
+                            self.netserver.config.adrmessagetime)
+            self.calls[gw_addr] = reactor.callLater(delay, self._send, gw_addr)
+
+    def _send(self, gw_addr):
+        """Send the next LinkADRReq queued for a gateway"""
+        del self.calls[gw_addr]
+        server = self.netserver
+        queue = self.queues.get(gw_addr)
+        while queue:
+            deveui = queue.popleft()
+            self.queued.discard(deveui)
+            # Check the request is still required
+            device = server.devices.getByEUI(deveui)
+            if device is None or not device.enabled or \
+                    device.adr_datr is None or \
+                    device.tx_datr == device.adr_datr:
+                continue
+            server._sendLinkADRRequest(device,
+                                       server._createLinkADRRequest(device))
+            self.last[gw_addr] = reactor.seconds()
+            self.sent += 1
+            break
+        if queue:
+            self.calls[gw_addr] = reactor.callLater(
+                server.config.adrmessagetime, self._send, gw_addr)
+        else:
+            self.queues.pop(gw_addr, None)
+
+    def stop(self):
+        """Cancel scheduled sends and clear the queues"""
+        for call in self.calls.values():
+            if call.active():
+                call.cancel()
+        self.calls.clear()
+        self.queues.clear()
+        self.queued.clear()
+        self.last.clear()
+
+    def stats(self):
+        """Get the engine statistics.
+
+        Returns:
+            Dict of dirty, queued, gateways and sent.
+        """
+        return {'dirty': len(self.dirty), 'queued': len(self.queued),
+                'gateways': len(self.queues), 'sent': self.sent}
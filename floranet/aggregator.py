@@ -0,0 +1,112 @@
+from twisted.internet import reactor
+
+class ReceptionAggregator(object):
+    """Uplink reception aggregation.
+
+    A frame heard by several gateways arrives once from each gateway.
+    The first reception opens a frame, keyed by the message (DevAddr,
+    FCnt, MIC), and receptions that arrive within period seconds are
+    collected with it. When the period ends the frame is closed, and
+    callback is called once with the message and the list of
+    receptions, best first.
+
+    Receptions are (request, gateway, rxpk) tuples, ranked by the rxpk
+    SNR and then RSSI. A frame holds one reception per gateway host: a
+    gateway that reports the frame more than once contributes its best
+    reception.
+
+    Attributes:
+        period (float): Aggregation period (seconds)
+        callback (callable): Called as callback(message, receptions)
+        frames (dict): Open frames as [message, receptions, call] lists,
+            keyed by message key
+        closed (int): Number of frames closed
+        receptions (int): Number of receptions in closed frames
+        maxgateways (int): Largest number of receptions in a frame
+    """
+
+    def __init__(self, period, callback):
+        """ReceptionAggregator initialisation method.
+
+        Args:
+            period (float): Aggregation period (seconds)
+            callback (callable): Closed frame handler
+        """
+        self.period = period
+        self.callback = callback
+        self.frames = {}
+        self.closed = 0
+        self.receptions = 0
+        self.maxgateways = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    @staticmethod
+    def rank(reception):
+        """Reception sort key: (lsnr, rssi) of the rxpk"""
+        rxpk = reception[2]
+        return (rxpk.lsnr, rxpk.rssi)
+
+    def collect(self, key, reception):
+        """Add a reception to an open frame.
+
+        Args:
+            key (tuple): Message key
+            reception (tuple): (request, gateway, rxpk)
+
+        Returns:
+            True if the frame is open, otherwise False.
+        """
+        frame = self.frames.get(key)
+        if frame is None:
+            return False
+        receptions = frame[1]
+        host = reception[1].host
+        for (i, r) in enumerate(receptions):
+            if r[1].host == host:
+                if self.rank(reception) > self.rank(r):
+                    receptions[i] = reception
+                return True
+        receptions.append(reception)
+        return True
+
+    def open(self, key, message, reception):
+        """Open a frame, to be closed after period seconds.
+
+        Args:
+            key (tuple): Message key
+            message (MACMessage): The received message
+            reception (tuple): (request, gateway, rxpk)
+        """
+        call = reactor.callLater(self.period, self._close, key)
+        self.frames[key] = [message, [reception], call]
+
+    def _close(self, key):
+        """Close a frame and pass the ranked receptions to callback"""
+        (message, receptions, call) = self.frames.pop(key)
+        receptions.sort(key=self.rank, reverse=True)
+        self.closed += 1
+        self.receptions += len(receptions)
+        self.maxgateways = max(self.maxgateways, len(receptions))
+        return self.callback(message, receptions)
+
+    def stop(self):
+        """Discard the open frames"""
+        for frame in self.frames.itervalues():
+            if frame[2].active():
+                frame[2].cancel()
+        self.frames.clear()
+
+    def stats(self):
+        """Get the aggregation statistics.
+
+        Returns:
+            Dict of open and closed frames, receptions, maxgateways
+            and meangateways.
+        """
+        return {'open': len(self.frames), 'closed': self.closed,
+                'receptions': self.receptions,
+                'maxgateways': self.maxgateways,
+                'meangateways': float(self.receptions) / self.closed
+                                if self.closed else 0.0}
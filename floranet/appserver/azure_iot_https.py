@@ -11,8 +11,8 @@ import requests
 
 from floranet.appserver.azure_iot import AzureIot
 from floranet.models.application import Application
-from floranet.models.appproperty import AppProperty
 from floranet.models.device import Device
+from floranet.cache import propertyCache
 from floranet.log import log
 
 class AzureIotHttps(AzureIot):
@@ -143,8 +143,7 @@ class AzureIotHttps(AzureIot):
         # Map the device name the Azure IOT deviceId
         devid = device.appname if device.appname else device.name
         
-        prop = yield AppProperty.find(where=['application_id = ? and port = ?',
-                               app.id, port], limit=1)
+        prop = yield propertyCache.get(app.id, port)
         
         # If the property is not found, send the data as is.
         if prop is None:
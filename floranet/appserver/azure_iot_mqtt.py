@@ -11,8 +11,8 @@ from flask_restful import fields, marshal
 
 from floranet.appserver.azure_iot import AzureIot
 from floranet.models.application import Application
-from floranet.models.appproperty import AppProperty
 from floranet.models.device import Device
+from floranet.cache import propertyCache
 from floranet.log import log
         
 class AzureIotMqtt(AzureIot):
@@ -119,8 +119,7 @@ class AzureIotMqtt(AzureIot):
         # Map the device name the Azure IOT deviceId
         devid = device.appname if device.appname else device.name
         
-        prop = yield AppProperty.find(where=['application_id = ? and port = ?',
-                               app.id, port], limit=1)
+        prop = yield propertyCache.get(app.id, port)
         
         # If the property is not found, send the data as is.
         if prop is None:
@@ -0,0 +1,522 @@
+import time
+from collections import deque
+
+from twisted.internet.defer import inlineCallbacks, returnValue
+
+from floranet.models.device import Device
+from floranet.models.application import Application
+from floranet.models.appproperty import AppProperty
+from floranet.models.model import updateBuffer
+
+class DuplicateCache(object):
+    """Uplink message de-duplication cache.
+
+    Entries are held in a dict keyed by the message (DevAddr, FCnt, MIC)
+    for constant time lookup, and in a time ordered deque used to expire
+    entries incrementally from the oldest end. When the cache holds
+    maxsize entries, the oldest entry is evicted.
+
+    Attributes:
+        period (int): De-duplication period (seconds)
+        maxsize (int): Maximum number of cached entries
+        entries (dict): Entry timestamps, keyed by message key
+        queue (deque): (timestamp, key) tuples, oldest first
+        hits (int): Number of duplicates found
+        misses (int): Number of messages added
+        evictions (int): Number of entries evicted at maxsize
+    """
+
+    def __init__(self, period, maxsize=1000000):
+        """DuplicateCache initialisation method.
+
+        Args:
+            period (int): De-duplication period (seconds)
+            maxsize (int): Maximum number of cached entries
+        """
+        self.period = period
+        self.maxsize = maxsize
+        self.entries = {}
+        self.queue = deque()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _pop(self):
+        """Remove the oldest entry"""
+        (mark, key) = self.queue.popleft()
+        if self.entries.get(key) == mark:
+            del self.entries[key]
+
+    def expire(self, mark=None):
+        """Remove the entries that are older than period.
+
+        Args:
+            mark (float): Current time, defaults to time.time()
+        """
+        if mark is None:
+            mark = time.time()
+        queue = self.queue
+        while queue and queue[0][0] + self.period <= mark:
+            self._pop()
+
+    def check(self, key, mark=None):
+        """Check for a duplicate, adding key to the cache if not found.
+
+        Args:
+            key (tuple): Message (DevAddr, FCnt, MIC)
+            mark (float): Arrival time, defaults to time.time()
+
+        Returns:
+            True if key was added within period, otherwise False.
+        """
+        if mark is None:
+            mark = time.time()
+        self.expire(mark)
+        if key in self.entries:
+            self.hits += 1
+            return True
+        self.misses += 1
+        if len(self.queue) >= self.maxsize:
+            self._pop()
+            self.evictions += 1
+        self.entries[key] = mark
+        self.queue.append((mark, key))
+        return False
+
+    def clear(self):
+        """Remove all entries and reset the counters"""
+        self.entries.clear()
+        self.queue.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        """Get the cache statistics.
+
+        Returns:
+            Dict of size, hits, misses, evictions and hitrate.
+        """
+        total = self.hits + self.misses
+        return {'size': len(self.entries), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'hitrate': float(self.hits) / total if total else 0.0}
+
+class NegativeCache(object):
+    """Time limited cache of failed lookups.
+
+    Records keys that were recently looked up and not found, so that
+    repeated lookups can be rejected without repeating the work. Entries
+    expire ttl seconds after they are added, and are held in a dict for
+    constant time lookup and a time ordered deque for incremental
+    expiry. Writers that create a key must discard it.
+
+    Attributes:
+        ttl (int): Entry lifetime (seconds)
+        entries (dict): Entry expiry times, keyed by key
+        queue (deque): (expiry, key) tuples, oldest first
+        hits (int): Number of lookups found in the cache
+    """
+
+    def __init__(self, ttl):
+        """NegativeCache initialisation method.
+
+        Args:
+            ttl (int): Entry lifetime (seconds)
+        """
+        self.ttl = ttl
+        self.entries = {}
+        self.queue = deque()
+        self.hits = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        expiry = self.entries.get(key)
+        if expiry is None:
+            return False
+        if expiry <= time.time():
+            del self.entries[key]
+            return False
+        self.hits += 1
+        return True
+
+    def add(self, key, mark=None):
+        """Add a key that was not found.
+
+        Args:
+            key: The lookup key
+            mark (float): Lookup time, defaults to time.time()
+        """
+        if mark is None:
+            mark = time.time()
+        self.expire(mark)
+        expiry = mark + self.ttl
+        self.entries[key] = expiry
+        self.queue.append((expiry, key))
+
+    def discard(self, key):
+        """Remove a key, if present.
+
+        Args:
+            key: The lookup key
+        """
+        self.entries.pop(key, None)
+
+    def expire(self, mark=None):
+        """Remove the expired entries.
+
+        Args:
+            mark (float): Current time, defaults to time.time()
+        """
+        if mark is None:
+            mark = time.time()
+        queue = self.queue
+        while queue and queue[0][0] <= mark:
+            (expiry, key) = queue.popleft()
+            if self.entries.get(key) == expiry:
+                del self.entries[key]
+
+    def clear(self):
+        """Remove all entries and reset the counters"""
+        self.entries.clear()
+        self.queue.clear()
+        self.hits = 0
+
+class AddressPool(object):
+    """Over the Air Activation (OTAA) address allocator.
+
+    Tracks the allocated addresses in the range [start, end] without
+    materialising the range. Addresses above the cursor have never been
+    handed out, and released addresses below the cursor are kept in a
+    free-list, so that allocation takes amortised constant time and
+    memory is proportional to the number of allocated addresses.
+
+    Attributes:
+        start (int): First address in the range
+        end (int): Last address in the range
+        used (set): Allocated addresses within the range
+        cursor (int): Lowest address that has not been scanned
+        freed (deque): Released addresses below the cursor
+    """
+
+    def __init__(self, start, end):
+        """AddressPool initialisation method.
+
+        Args:
+            start (int): First address in the range
+            end (int): Last address in the range
+        """
+        self.start = start
+        self.end = end
+        self.used = set()
+        self.cursor = start
+        self.freed = deque()
+
+    def __len__(self):
+        """Number of free addresses"""
+        return max(0, self.end - self.start + 1 - len(self.used))
+
+    def __contains__(self, devaddr):
+        return self.start <= devaddr <= self.end
+
+    def reset(self, start, end, devaddrs=()):
+        """Set a new range and the allocated addresses.
+
+        Args:
+            start (int): First address in the range
+            end (int): Last address in the range
+            devaddrs: Allocated addresses. Addresses outside
+                the range are ignored.
+        """
+        self.start = start
+        self.end = end
+        self.used = set(a for a in devaddrs if start <= a <= end)
+        self.cursor = start
+        self.freed = deque()
+
+    def allocate(self):
+        """Allocate a free address.
+
+        Returns:
+            A 32 bit DevAddr, or None if the range is exhausted.
+        """
+        used = self.used
+        # Reuse released addresses, skipping any reserved since
+        while self.freed:
+            devaddr = self.freed.popleft()
+            if devaddr not in used:
+                used.add(devaddr)
+                return devaddr
+        while self.cursor <= self.end:
+            devaddr = self.cursor
+            self.cursor += 1
+            if devaddr not in used:
+                used.add(devaddr)
+                return devaddr
+        return None
+
+    def reserve(self, devaddr):
+        """Mark an address as allocated.
+
+        Args:
+            devaddr (int): Device DevAddr
+        """
+        if devaddr in self:
+            self.used.add(devaddr)
+
+    def release(self, devaddr):
+        """Return an allocated address to the pool.
+
+        Args:
+            devaddr (int): Device DevAddr
+        """
+        if devaddr in self.used:
+            self.used.remove(devaddr)
+            if devaddr < self.cursor:
+                self.freed.append(devaddr)
+
+class DeviceCache(object):
+    """In-memory device session table.
+
+    Holds every configured device, indexed by DevEUI and, for devices
+    that have an address, by DevAddr. The cached Device objects are
+    authoritative: the network server reads and updates device sessions
+    here, and changed attributes are written back to the devices table
+    by the model updateBuffer. Indexed addresses are reserved in the
+    OTAA address pool, if one is given.
+
+    Attributes:
+        devices (dict): Devices with an address, keyed by DevAddr
+        deveuis (dict): All devices, keyed by DevEUI
+        addresses (dict): Indexed DevAddr, keyed by DevEUI
+        pool (AddressPool): OTAA address pool
+    """
+
+    def __init__(self, pool=None):
+        """DeviceCache initialisation method.
+
+        Args:
+            pool (AddressPool): OTAA address pool
+        """
+        self.devices = {}
+        self.deveuis = {}
+        self.addresses = {}
+        self.pool = pool
+
+    def __len__(self):
+        return len(self.deveuis)
+
+    @inlineCallbacks
+    def load(self):
+        """Load all devices from the database.
+
+        Returns:
+            Number of devices loaded.
+        """
+        devices = yield Device.all()
+        self.devices = {}
+        self.deveuis = {}
+        self.addresses = {}
+        if self.pool is not None:
+            self.pool.reset(self.pool.start, self.pool.end)
+        for device in devices or []:
+            self.add(device)
+        returnValue(len(self.deveuis))
+
+    @inlineCallbacks
+    def reload(self, deveui):
+        """Load a single device from the database.
+
+        Used when a device is created outside the cache.
+
+        Args:
+            deveui (int): Device DevEUI
+
+        Returns:
+            Device object if found, otherwise None.
+        """
+        device = yield Device.find(where=['deveui = ?', deveui], limit=1)
+        if device is None:
+            self.remove(deveui)
+        else:
+            self.add(device)
+        returnValue(device)
+
+    def _index(self, device):
+        """Index device by its current DevAddr"""
+        devaddr = self.addresses.get(device.deveui)
+        if devaddr is not None and devaddr == device.devaddr and \
+                self.devices.get(devaddr) is device:
+            return
+        self.addresses.pop(device.deveui, None)
+        if devaddr is not None and self.devices.get(devaddr) is device:
+            del self.devices[devaddr]
+            self._release(devaddr)
+        if device.devaddr is not None:
+            self.devices[device.devaddr] = device
+            self.addresses[device.deveui] = device.devaddr
+            if self.pool is not None:
+                self.pool.reserve(device.devaddr)
+
+    def _release(self, devaddr):
+        """Return devaddr to the address pool"""
+        if self.pool is not None:
+            self.pool.release(devaddr)
+
+    def add(self, device):
+        """Add or replace a device.
+
+        Args:
+            device (Device): The device to add
+        """
+        self.remove(device.deveui)
+        self.deveuis[device.deveui] = device
+        self._index(device)
+
+    def remove(self, deveui):
+        """Remove a device.
+
+        Args:
+            deveui (int): Device DevEUI
+        """
+        device = self.deveuis.pop(deveui, None)
+        devaddr = self.addresses.pop(deveui, None)
+        if device is not None:
+            updateBuffer.discard(device)
+            if self.devices.get(devaddr) is device:
+                del self.devices[devaddr]
+                self._release(devaddr)
+
+    def get(self, devaddr):
+        """Get the device with address devaddr.
+
+        Args:
+            devaddr (int): Device DevAddr
+
+        Returns:
+            Device object if found, otherwise None.
+        """
+        return self.devices.get(devaddr)
+
+    def getByEUI(self, deveui):
+        """Get the device with DevEUI deveui.
+
+        Args:
+            deveui (int): Device DevEUI
+
+        Returns:
+            Device object if found, otherwise None.
+        """
+        return self.deveuis.get(deveui)
+
+    def values(self):
+        """Get all cached devices.
+
+        Returns:
+            List of Device objects.
+        """
+        return self.deveuis.values()
+
+    def update(self, device, **kwargs):
+        """Update device attributes, and schedule them to be saved.
+
+        Args:
+            device (Device): The device to update
+            kwargs: Attribute values
+        """
+        device.queueUpdate(**kwargs)
+        if 'devaddr' in kwargs:
+            self._index(device)
+
+    def refresh(self, deveui, **kwargs):
+        """Apply attributes saved outside the cache to a cached device.
+
+        Args:
+            deveui (int): DevEUI of the cached device
+            kwargs: Updated attribute values
+        """
+        device = self.deveuis.pop(deveui, None)
+        if device is None:
+            return
+        # The saved values replace any queued for the same attributes
+        updateBuffer.discard(device, *kwargs)
+        for attr, v in kwargs.iteritems():
+            setattr(device, attr, v)
+        self.deveuis[device.deveui] = device
+        if deveui in self.addresses:
+            self.addresses[device.deveui] = self.addresses.pop(deveui)
+        self._index(device)
+
+class FindCache(object):
+    """Read-through cache of single row model queries.
+
+    Caches the object found by model.find(where=[where, key...], limit=1),
+    keyed by the tuple of query values. Rows that are not found are not
+    cached. Writers must invalidate the entries they change.
+
+    Attributes:
+        model (Model): The model class
+        where (str): Query condition, with a placeholder for each key value
+        entries (dict): Cached objects, keyed by query values
+        hits (int): Number of cache hits
+        misses (int): Number of cache misses
+    """
+
+    def __init__(self, model, where):
+        """FindCache initialisation method.
+
+        Args:
+            model (Model): The model class
+            where (str): Query condition
+        """
+        self.model = model
+        self.where = where
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @inlineCallbacks
+    def get(self, *key):
+        """Get the object for the query values key.
+
+        Args:
+            key: Query values
+
+        Returns:
+            Model object if found, otherwise None.
+        """
+        obj = self.entries.get(key)
+        if obj is not None:
+            self.hits += 1
+            returnValue(obj)
+        self.misses += 1
+        obj = yield self.model.find(where=[self.where] + list(key), limit=1)
+        if obj is not None:
+            self.entries[key] = obj
+        returnValue(obj)
+
+    def invalidate(self, *key):
+        """Remove the object for the query values key.
+
+        Args:
+            key: Query values
+        """
+        self.entries.pop(key, None)
+
+    def clear(self):
+        """Remove all entries"""
+        self.entries.clear()
+
+"""Applications keyed by AppEUI"""
+applicationCache = FindCache(Application, 'appeui = ?')
+
+"""Application properties keyed by (application_id, port)"""
+propertyCache = FindCache(AppProperty, 'application_id = ? AND port = ?')
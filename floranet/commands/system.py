@@ -35,6 +35,8 @@ def show(ctx):
     click.echo('{}Frequency band: {}'.format(indent, c['freqband']))
     click.echo('{}Network ID: 0x{}'.format(indent,
                                 intHexString(c['netid'], 3, sep=2)))
+    click.echo('{}Gateway aggregation period: {} ms'.format(indent,
+                                    c['aggregationperiod']))
     click.echo('{}OTAA Address Range: 0x{} - 0x{}'.format(indent,
             devaddrString(c['otaastart']), devaddrString(c['otaaend'])))
     t = 'Yes' if c['adrenable'] else 'No'
@@ -44,6 +46,8 @@ def show(ctx):
         click.echo('{}ADR cycle time: {} s'.format(indent, c['adrcycletime']))
         click.echo('{}ADR message time: {} s'.format(indent,
                                     c['adrmessagetime']))
+        click.echo('{}ADR snapshot time: {} s'.format(indent,
+                                    c['adrsnapshottime']))
     t = 'Yes' if c['fcrelaxed'] else 'No'
     click.echo('{}Relaxed frame count: {}'.format(indent, t))
     t = 'Yes' if c['macqueueing'] else 'No'
@@ -70,9 +74,10 @@ def set(ctx):
     
     # Check for valid args
     valid = {'name', 'listen', 'port', 'webport', 'apitoken', 'freqband',
-             'netid', 'duplicateperiod', 'fcrelaxed', 'otaastart', 'otaaend',
-             'macqueueing', 'macqueuelimit', 'adrenable', 'adrmargin',
-             'adrcycletime', 'adrmessagetime'}
+             'netid', 'duplicateperiod', 'aggregationperiod', 'fcrelaxed',
+             'otaastart', 'otaaend', 'macqueueing', 'macqueuelimit',
+             'adrenable', 'adrmargin', 'adrcycletime', 'adrmessagetime',
+             'adrsnapshottime'}
     bool_args = {'fcrelaxed', 'adrenable', 'macqueueing'}
     for arg,param in args.items():
         if not arg in valid:
@@ -0,0 +1,25 @@
+"""Add config aggregation period
+
+Revision ID: a3c1f27be9d4
+Revises: d5ed30f62f76
+Create Date: 2026-10-17 10:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c1f27be9d4'
+down_revision = 'd5ed30f62f76'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('config',
+        sa.Column('aggregationperiod', sa.Integer(), nullable=False,
+                  server_default='200'))
+
+
+def downgrade():
+    op.drop_column('config', 'aggregationperiod')
@@ -0,0 +1,25 @@
+"""Add config ADR snapshot time
+
+Revision ID: c8e2d4a91f37
+Revises: a3c1f27be9d4
+Create Date: 2026-10-17 14:36:05.902417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8e2d4a91f37'
+down_revision = 'a3c1f27be9d4'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('config',
+        sa.Column('adrsnapshottime', sa.Integer(), nullable=False,
+                  server_default='300'))
+
+
+def downgrade():
+    op.drop_column('config', 'adrsnapshottime')
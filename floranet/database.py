@@ -6,6 +6,7 @@ import psycopg2
 from twisted.enterprise import adbapi
 from twistar.registry import Registry
 
+from floranet.models.model import updateBuffer
 from floranet.models.application import Application
 from floranet.models.appinterface import AppInterface
 from floranet.models.appproperty import AppProperty
@@ -42,6 +43,8 @@ class Database(object):
         parser (SafeConfigParser): parser object
         path (str): Path to this module
         username (str): 
+        flushinterval (int): Device update flush interval (seconds)
+        flushbatch (int): Number of dirty rows that triggers a flush
         
     """    
     def __init__(self):
@@ -52,6 +55,8 @@ class Database(object):
         self.user = ''
         self.password = ''
         self.database = ''
+        self.flushinterval = updateBuffer.interval
+        self.flushbatch = updateBuffer.batchsize
 
     def test(self):
         """Perform a database connection test
@@ -75,6 +80,8 @@ class Database(object):
         Registry.DBPOOL = adbapi.ConnectionPool('psycopg2', host=self.host,
                   user=self.user, password=self.password,
                   database=self.database)
+        updateBuffer.interval = self.flushinterval
+        updateBuffer.batchsize = self.flushbatch
         
     def register(self):
         """Register class relationships
@@ -218,6 +225,17 @@ class Database(object):
         for option in options:
             if not self._getOption('database', option, self):
                 return False
+        
+        # Optional update buffer options
+        options = [
+            Option('flushinterval', 'int', default=False),
+            Option('flushbatch', 'int', default=False),
+            ]
+        for option in options:
+            if not self.parser.has_option('database', option.name):
+                continue
+            if not self._getOption('database', option, self):
+                return False
             
         return True
         
@@ -0,0 +1,98 @@
+from bisect import bisect_right
+
+from twisted.internet import reactor
+
+class DownlinkBudget(object):
+    """Receive window deadline tracking.
+
+    A class A downlink must reach the gateway before the device's RX1 or
+    RX2 receive window opens: the uplink arrival time plus the window's
+    receive delay. The slack is the time remaining to that deadline, less
+    a guard time for the gateway to schedule the transmission. A window
+    with negative slack is unreachable, and its txpk is not sent.
+
+    Slack is recorded for each gateway and window in a histogram with
+    bucket lower bounds given by bins. The first bucket counts missed
+    windows.
+
+    Attributes:
+        guard (float): Gateway scheduling guard time (seconds)
+        bins (tuple): Histogram bucket lower bounds (seconds)
+        gateways (dict): Statistics dicts, keyed by gateway host
+    """
+
+    def __init__(self, guard=0.1, bins=(0.0, 0.1, 0.25, 0.5, 1.0, 2.0)):
+        """DownlinkBudget initialisation method.
+
+        Args:
+            guard (float): Gateway scheduling guard time (seconds)
+            bins (tuple): Histogram bucket lower bounds (seconds)
+        """
+        self.guard = guard
+        self.bins = bins
+        self.gateways = {}
+
+    def _gateway(self, host):
+        """Get or create the statistics for a gateway"""
+        stats = self.gateways.get(host)
+        if stats is None:
+            buckets = len(self.bins) + 1
+            stats = self.gateways[host] = {
+                'sent': 0, 'rx2only': 0, 'missed': 0,
+                'rx1': [0] * buckets, 'rx2': [0] * buckets}
+        return stats
+
+    def windows(self, host, arrival, rx, now=None):
+        """Get the receive windows that can still be reached.
+
+        Args:
+            host (str): Gateway host address
+            arrival (float): Uplink arrival time. If None, both windows
+                are returned and no statistics are recorded.
+            rx (dict): RX1 and RX2 parameter dicts, with delays
+            now (float): Current time, defaults to reactor.seconds()
+
+        Returns:
+            List of reachable window numbers: [1, 2], [2] or [].
+        """
+        if arrival is None:
+            return [1, 2]
+        if now is None:
+            now = reactor.seconds()
+        stats = self._gateway(host)
+        windows = []
+        for i in (1, 2):
+            slack = arrival + rx[i]['delay'] - now - self.guard
+            stats['rx%d' % i][bisect_right(self.bins, slack)] += 1
+            if slack >= 0:
+                windows.append(i)
+        if not windows:
+            stats['missed'] += 1
+        else:
+            stats['sent'] += 1
+            if windows[0] == 2:
+                stats['rx2only'] += 1
+        return windows
+
+    def clear(self):
+        """Remove all statistics"""
+        self.gateways.clear()
+
+    def stats(self, host):
+        """Get a gateway's statistics.
+
+        Args:
+            host (str): Gateway host address
+
+        Returns:
+            Dict of sent, rx2only and missed counts, and rx1 and rx2
+            slack histograms as lists of (bucket, count) tuples. The
+            bucket is the lower bound in seconds, or None for missed
+            windows.
+        """
+        stats = self._gateway(host)
+        bounds = (None,) + self.bins
+        result = dict(stats)
+        for w in ('rx1', 'rx2'):
+            result[w] = zip(bounds, stats[w])
+        return result
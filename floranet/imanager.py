@@ -1,3 +1,5 @@
+from collections import OrderedDict
+
 from twisted.internet.defer import inlineCallbacks, returnValue
 
 from floranet.models.appinterface import AppInterface
@@ -7,14 +9,47 @@ from floranet.log import log
 class InterfaceManager(object):
     """Manages the server's application interfaces
     
+    Interfaces are indexed by application interface id. Uplink routing
+    entries map an application's AppEUI to its interface. They are
+    resolved once, and removed when the application changes or when any
+    interface is added, updated or removed.
+    
     Attribues:
-        interfaces (list): List of interfaces
+        appinterfaces (OrderedDict): Interfaces keyed by appinterface id
+        routes (dict): Interfaces keyed by AppEUI
         netserver (NetServer): The network server
     """
     
     def __init__(self):
-        self.interfaces = []
+        self.appinterfaces = OrderedDict()
+        self.routes = {}
         self.netserver = None
+    
+    @property
+    def interfaces(self):
+        """List of interfaces"""
+        return self.appinterfaces.values()
+    
+    @interfaces.setter
+    def interfaces(self, interfaces):
+        self.appinterfaces.clear()
+        self.routes.clear()
+        for interface in interfaces:
+            self._add(interface)
+    
+    def _add(self, interface):
+        """Index interface by its application interface id"""
+        self.appinterfaces[interface.appinterface.id] = interface
+        self.routes.clear()
+    
+    def _remove(self, appinterface_id):
+        """Remove the interface indexed by appinterface_id.
+        
+        Returns:
+            The removed interface, or None if not found.
+        """
+        self.routes.clear()
+        return self.appinterfaces.pop(appinterface_id, None)
         
     @inlineCallbacks
     def start(self, netserver):
@@ -33,7 +68,7 @@ class InterfaceManager(object):
             interface = yield appinterface.interfaces.get()
             if interface:
                 interface.appinterface = appinterface
-                self.interfaces.append(interface)
+                self._add(interface)
         
         # Start the interfaces
         for interface in self.interfaces:
@@ -49,11 +84,40 @@ class InterfaceManager(object):
         
         Args:
             appinterface_id (int): Application interface id
+        
+        Returns:
+            The interface if found, otherwise None.
         """
+        try:
+            return self.appinterfaces.get(int(appinterface_id))
+        except (TypeError, ValueError):
+            return None
+    
+    def getAppInterface(self, app):
+        """Retrieve the interface that routes an application's uplinks
+        
+        Args:
+            app (Application): The application
         
-        interface = next((i for i in self.interfaces if
-                i.appinterface.id == int(appinterface_id)), None)
-        return(interface)
+        Returns:
+            The interface if found, otherwise None.
+        """
+        appeui = app.appeui
+        interface = self.routes.get(appeui)
+        if interface is None:
+            interface = self.getInterface(app.appinterface_id)
+            if interface is not None:
+                self.routes[appeui] = interface
+        return interface
+    
+    def removeRoute(self, *appeuis):
+        """Remove the routing entries for applications
+        
+        Args:
+            appeuis (int): Application EUIs
+        """
+        for appeui in appeuis:
+            self.routes.pop(appeui, None)
     
     def getAllInterfaces(self):
         """Retrieve all interfaces"""
@@ -97,9 +161,9 @@ class InterfaceManager(object):
         yield appinterface.save()
         yield interface.appinterfaces.set([appinterface])
         
-        # Add the new interface to the list
+        # Add the new interface
         interface.appinterface = appinterface
-        self.interfaces.append(interface)
+        self._add(interface)
         
         # Start the interface
         interface.start(self.netserver)
@@ -121,19 +185,13 @@ class InterfaceManager(object):
         yield interface.save()
         interface.appinterface = yield interface.appinterfaces.get()
         
-        # Retrieve the current running interface and its index
-        (index, current) = next (((i,iface) for i,iface in
-                enumerate(self.interfaces) if
-                iface.appinterface.id == interface.appinterface.id),
-                (None, None))
-        
-        # Stop and remove the current interface
+        # Stop and remove the current running interface
+        current = self._remove(interface.appinterface.id)
         if current:
             current.stop()
-            del self.interfaces[index]
         
-        # Append the new interface and start
-        self.interfaces.append(interface)
+        # Add the new interface and start
+        self._add(interface)
         interface.start(self.netserver)
         if not interface.started:
                 log.error("Could not start application interface "
@@ -147,11 +205,8 @@ class InterfaceManager(object):
             interface: The concrete application interface
         """
         
-        # Find the interface in the list, and remove
-        index = next ((i for i,iface in enumerate(self.interfaces) if
-                iface.appinterface.id == interface.appinterface.id), None)
-        if index:
-            del self.interfaces[index]
+        # Remove the interface
+        self._remove(interface.appinterface.id)
         
         # Delete the interface and appinterface records
         exists = interface.exists(where=['id = ?', interface.id])
@@ -1,6 +1,8 @@
 
 import os
 import sys
+import time
+from collections import OrderedDict
 
 from twisted.logger import (Logger, LogLevel, LogLevelFilterPredicate,
                             FilteringLogObserver,
@@ -13,11 +15,73 @@ class Log(Logger):
     """Log class
     
     Netserver logging - subclass of twisted.logger.Logger
+    
+    Attributes:
+        interval (int): Rate limited logging interval (seconds)
+        maxkeys (int): Maximum number of rate limiting keys. The oldest
+                       key is flushed when a new key would exceed it.
+        limits (OrderedDict): [start time, suppressed count, level,
+                       format, fields] lists of the last suppressed
+                       event, keyed by rate limiting key, oldest first
     """
     
     def __init__(self):
         """Initialize a Log object."""
         super(Log, self).__init__('Floranet')
+        self.interval = 60
+        self.maxkeys = 10000
+        self.limits = OrderedDict()
+    
+    def limited(self, level, key, format, **kwargs):
+        """Emit a log event at most once per interval for key.
+        
+        The first event for key is emitted, and further events within
+        interval seconds are suppressed and counted. When the interval
+        ends, one summary line reporting the number suppressed is
+        emitted for the last suppressed event.
+        
+        Args:
+            level (LogLevel): Log level
+            key: Rate limiting key, for example (message, address)
+            format (str): Log message format
+            kwargs: Log message fields
+        """
+        now = time.time()
+        self.flush(now)
+        entry = self.limits.get(key)
+        if entry is not None:
+            entry[1] += 1
+            entry[2:] = [level, format, kwargs]
+            return
+        if len(self.limits) >= self.maxkeys:
+            self._summarise(self.limits.popitem(last=False)[1])
+        self.limits[key] = [now, 0, level, format, kwargs]
+        self.emit(level, format, **kwargs)
+    
+    def flush(self, now=None):
+        """Emit the summaries for keys whose interval has ended.
+        
+        Called for each rate limited event, and periodically so that
+        the counts for keys that go quiet are reported.
+        
+        Args:
+            now (float): Current time, defaults to time.time()
+        """
+        if now is None:
+            now = time.time()
+        limits = self.limits
+        while limits:
+            entry = next(limits.itervalues())
+            if now - entry[0] < self.interval:
+                break
+            self._summarise(limits.popitem(last=False)[1])
+    
+    def _summarise(self, entry):
+        """Emit the summary line for a key's suppressed events"""
+        (start, suppressed, level, format, kwargs) = entry
+        if suppressed:
+            self.emit(level, format + " ({suppressed} similar messages "
+                      "suppressed)", suppressed=suppressed, **kwargs)
 
     def start(self, console, logfile, debug):
         """Configure and start logging based on user preferences
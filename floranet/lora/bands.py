@@ -1,9 +1,43 @@
 
 
 class LoraBand(object):
-    """Base class for Lora radio bands."""
+    """Base class for Lora radio bands.
+    
+    Receive window parameters depend only on the transmit channel, transmit
+    data rate, join flag and the band's RX1DROffset. Concrete bands call
+    compile() at the end of initialisation to build lookup tables for every
+    upstream channel and data rate, and the tables are rebuilt when
+    rx1droffset is changed. The parameter dicts returned by rxparams() are
+    shared, and must not be modified.
+    """
     
     BANDS = {'AU915', 'US915', 'EU868'}
+    
+    @property
+    def rx1droffset(self):
+        """RX1 data rate offset"""
+        return self._rx1droffset
+    
+    @rx1droffset.setter
+    def rx1droffset(self, offset):
+        self._rx1droffset = offset
+        if hasattr(self, '_rxtable'):
+            self.compile()
+    
+    def compile(self):
+        """Build the receive window and payload length lookup tables.
+        
+        The receive window table holds the RX1 and RX2 parameters,
+        keyed by (tx_chan, tx_datr, join).
+        """
+        self._rxtable = {}
+        for txch in range(len(self.upstream)):
+            for txdr in self.datarate_rev:
+                for join in (False, True):
+                    self._rxtable[(txch, txdr, join)] = \
+                        self._rxparams(txch, txdr, join)
+        self._maxappdatalen = {datr: self.maxappdatalen[index]
+                               for (datr, index) in self.datarate_rev.items()}
         
     def _rx1receive(self, txch, txdr, rx1droffset):
         """Get first receive window parameters
@@ -46,6 +80,14 @@ class LoraBand(object):
         Retrurns:
             Dict of RX1 and RX2 parameter dicts {freq, datarate, drindex, delay}
         """
+        key = (tx_chan, tx_datr, bool(join))
+        rx = self._rxtable.get(key)
+        if rx is None:
+            rx = self._rxtable[key] = self._rxparams(tx_chan, tx_datr, join)
+        return rx
+    
+    def _rxparams(self, tx_chan, tx_datr, join):
+        """Calculate RX1 and RX2 receive window parameters"""
         rx1 = self._rx1receive(tx_chan, tx_datr, self.rx1droffset)
         rx2 = self._rx2receive()
         if join:
@@ -64,7 +106,7 @@ class LoraBand(object):
             datarate: (str) Datarate code
             length (int): Length of payload
         """
-        return self.maxappdatalen[self.datarate_rev[datarate]] >= length
+        return self._maxappdatalen[datarate] >= length
     
 class US915(LoraBand):
     """US 902-928 ISM Band
@@ -168,6 +210,7 @@ class US915(LoraBand):
             11: 242,
             12: 242,
             13: 242 }
+        self.compile()
 
 class AU915(US915):
     """Australian 915-928 ISM Band
@@ -184,6 +227,7 @@ class AU915(US915):
             self.upstream.append((9152 + 2.0 * i)/10)
         for i in range(0, 8):
             self.upstream.append((9159 + 16.0 * i)/10)
+        self.compile()
    
 class EU868(LoraBand):
     """ EUROPEAN 863-870 ISM Band 
@@ -239,6 +283,7 @@ class EU868(LoraBand):
             6:242,
             7:242
         }
+        self.compile()
 
     def _rx2receive(self):
         """Get second receive window parameters
@@ -1,33 +1,403 @@
-from CryptoPlus.Cipher import python_AES
+"""AES-128 crypto backends.
+
+The native backend uses the OpenSSL bindings provided by the cryptography
+package. If cryptography is not installed we fall back to the pure Python
+AES implementation provided by CryptoPlus. The selected backend is
+available as the module attribute backend.
+"""
+import struct
+from collections import OrderedDict
+
+from floranet.util import intPackBytes
+
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    from cryptography.hazmat.primitives.cmac import CMAC
+except ImportError:
+    default_backend = None
+
+try:
+    from CryptoPlus.Cipher import python_AES
+except ImportError:
+    python_AES = None
+
+ZERO_BLOCK = '\x00' * 16
+
+def xorBlock(a, b):
+    """XOR two 16 byte blocks.
+
+    Args:
+        a (str): packed 16 byte block
+        b (str): packed 16 byte block
+
+    Returns:
+        Packed 16 byte block
+    """
+    (a1, a2) = struct.unpack('>QQ', a)
+    (b1, b2) = struct.unpack('>QQ', b)
+    return struct.pack('>QQ', a1 ^ b1, a2 ^ b2)
+
+class CryptographyBackend(object):
+    """OpenSSL AES backend using the cryptography package.
+
+    Attributes:
+        name (str): Backend name
+    """
+
+    name = 'cryptography'
+
+    def __init__(self):
+        """CryptographyBackend initialisation method.
+
+        """
+        self.backend = default_backend()
+
+    def encrypt(self, key, data, mode=None):
+        """AES encryption function
+
+        Args:
+            key (str): packed 128 bit key
+            data (str): packed plain text data
+            mode (str): Optional mode specification (CMAC)
+
+        Returns:
+            Packed encrypted data string
+        """
+        if mode == 'CMAC':
+            c = CMAC(algorithms.AES(key), backend=self.backend)
+            c.update(data)
+            return c.finalize()
+        encryptor = Cipher(algorithms.AES(key), modes.ECB(),
+                           backend=self.backend).encryptor()
+        return encryptor.update(data) + encryptor.finalize()
+
+    def decrypt(self, key, data):
+        """AES decryption function
+
+        Args:
+            key (str): packed 128 bit key
+            data (str): packed encrypted data
+
+        Returns:
+            Packed decrypted data string
+        """
+        decryptor = Cipher(algorithms.AES(key), modes.ECB(),
+                           backend=self.backend).decryptor()
+        return decryptor.update(data) + decryptor.finalize()
+
+    def new(self, key):
+        """Create a prepared cipher for key.
+
+        Args:
+            key (str): packed 128 bit key
+
+        Returns:
+            CryptographyCipher object.
+        """
+        return CryptographyCipher(key, self.backend)
+
+class CryptographyCipher(object):
+    """Prepared AES cipher using the cryptography package.
+
+    Attributes:
+        ecb (Cipher): AES-ECB cipher
+        cbc (Cipher): AES-CBC cipher with a zero IV, used for CBC-MAC
+    """
+
+    def __init__(self, key, backend):
+        """CryptographyCipher initialisation method.
+
+        """
+        algorithm = algorithms.AES(key)
+        self.ecb = Cipher(algorithm, modes.ECB(), backend=backend)
+        self.cbc = Cipher(algorithm, modes.CBC(ZERO_BLOCK), backend=backend)
+
+    def encrypt(self, data):
+        """AES-ECB encrypt data, a multiple of 16 bytes"""
+        encryptor = self.ecb.encryptor()
+        return encryptor.update(data) + encryptor.finalize()
+
+    def decrypt(self, data):
+        """AES-ECB decrypt data, a multiple of 16 bytes"""
+        decryptor = self.ecb.decryptor()
+        return decryptor.update(data) + decryptor.finalize()
+
+    def cbcmac(self, *chunks):
+        """Return the last AES-CBC block of the concatenated chunks.
+        
+        Each chunk is a string or buffer of a multiple of 16 bytes, and
+        the final chunk is a single block.
+        """
+        encryptor = self.cbc.encryptor()
+        for chunk in chunks:
+            block = encryptor.update(chunk)
+        encryptor.finalize()
+        return block
+
+class CryptoPlusBackend(object):
+    """Pure Python AES backend using CryptoPlus.
+
+    Attributes:
+        name (str): Backend name
+    """
+
+    name = 'CryptoPlus'
+
+    def encrypt(self, key, data, mode=None):
+        """AES encryption function
+
+        Args:
+            key (str): packed 128 bit key
+            data (str): packed plain text data
+            mode (str): Optional mode specification (CMAC)
+
+        Returns:
+            Packed encrypted data string
+        """
+        if mode == 'CMAC':
+            # Create AES cipher using key argument, and encrypt data
+            cipher = python_AES.new(key, python_AES.MODE_CMAC)
+        else:
+            cipher = python_AES.new(key)
+        return cipher.encrypt(data)
+
+    def decrypt(self, key, data):
+        """AES decryption function
+
+        Args:
+            key (str): packed 128 bit key
+            data (str): packed encrypted data
+
+        Returns:
+            Packed decrypted data string
+        """
+        cipher = python_AES.new(key)
+        return cipher.decrypt(data)
+
+    def new(self, key):
+        """Create a prepared cipher for key.
+
+        Args:
+            key (str): packed 128 bit key
+
+        Returns:
+            CryptoPlusCipher object.
+        """
+        return CryptoPlusCipher(key)
+
+class CryptoPlusCipher(object):
+    """Prepared AES cipher using CryptoPlus.
+
+    The expanded key is held by the ECB cipher object, which is reused
+    for every operation.
+
+    Attributes:
+        ecb: CryptoPlus AES-ECB cipher
+    """
+
+    def __init__(self, key):
+        """CryptoPlusCipher initialisation method.
+
+        """
+        self.ecb = python_AES.new(key)
+
+    def encrypt(self, data):
+        """AES-ECB encrypt data, a multiple of 16 bytes"""
+        return self.ecb.encrypt(data)
+
+    def decrypt(self, data):
+        """AES-ECB decrypt data, a multiple of 16 bytes"""
+        return self.ecb.decrypt(data)
+
+    def cbcmac(self, *chunks):
+        """Return the last AES-CBC block of the concatenated chunks.
+        
+        Each chunk is a string or buffer of a multiple of 16 bytes, and
+        the final chunk is a single block.
+        """
+        block = ZERO_BLOCK
+        for chunk in chunks:
+            for i in range(0, len(chunk), 16):
+                block = self.ecb.encrypt(xorBlock(block, chunk[i:i+16]))
+        return block
+
+def availableBackends():
+    """Get the installed crypto backends, in order of preference.
+
+    Returns:
+        A list of backend objects.
+    """
+    backends = []
+    if default_backend is not None:
+        backends.append(CryptographyBackend())
+    if python_AES is not None:
+        backends.append(CryptoPlusBackend())
+    return backends
+
+_backends = availableBackends()
+if not _backends:
+    raise ImportError("No AES crypto backend available: install "
+                      "cryptography or CryptoPlus")
+backend = _backends[0]
 
 def aesEncrypt(key, data, mode=None):
     """AES encryption function
-    
+
     Args:
         key (str): packed 128 bit key
         data (str): packed plain text data
         mode (str): Optional mode specification (CMAC)
-        
+
     Returns:
         Packed encrypted data string
     """
-    if mode == 'CMAC':
-        # Create AES cipher using key argument, and encrypt data
-        cipher = python_AES.new(key, python_AES.MODE_CMAC)
-    elif mode == None:
-        cipher = python_AES.new(key)
-    return cipher.encrypt(data)
+    return backend.encrypt(key, data, mode)
 
 def aesDecrypt(key, data):
     """AES decryption fucnction
-    
+
     Args:
         key (str): packed 128 bit key
         data (str): packed encrypted data
-        
+
     Returns:
         Packed decrypted data string
     """
-    cipher = python_AES.new(key)
-    return cipher.decrypt(data)
+    return backend.decrypt(key, data)
+
+class SessionCipher(object):
+    """AES cipher context prepared for a single key.
+
+    Holds the packed key, the backend cipher with its expanded key, and
+    the AES-CMAC subkeys K1 and K2 (RFC 4493 Section 2.3), so that
+    repeated MIC and payload operations with the same key do not repeat
+    the key preparation.
+
+    Attributes:
+        key (str): packed 128 bit key
+        cipher: Prepared backend cipher
+        k1 (str): CMAC subkey K1
+        k2 (str): CMAC subkey K2
+    """
+
+    def __init__(self, key, cbackend=None):
+        """SessionCipher initialisation method.
+
+        Args:
+            key (str): packed 128 bit key
+            cbackend: Crypto backend, defaults to the selected backend
+        """
+        self.key = key
+        self.cipher = (cbackend or backend).new(key)
+        # Derive the CMAC subkeys from L = AES(K, 0^128)
+        (l1, l2) = struct.unpack('>QQ', self.cipher.encrypt(ZERO_BLOCK))
+        self.k1 = self._subkey((l1 << 64) | l2)
+        (k1, k2) = struct.unpack('>QQ', self.k1)
+        self.k2 = self._subkey((k1 << 64) | k2)
+
+    @staticmethod
+    def _subkey(n):
+        """Left shift a 128 bit integer, conditionally XOR with Rb"""
+        shifted = (n << 1) & ((1 << 128) - 1)
+        if n >> 127:
+            shifted ^= 0x87
+        return struct.pack('>QQ', shifted >> 64, shifted & 0xFFFFFFFFFFFFFFFF)
+
+    def encrypt(self, data):
+        """AES-ECB encrypt data, a multiple of 16 bytes"""
+        return self.cipher.encrypt(data)
+
+    def decrypt(self, data):
+        """AES-ECB decrypt data, a multiple of 16 bytes"""
+        return self.cipher.decrypt(data)
+
+    def cmac(self, data, b0=None):
+        """Calculate the AES-CMAC of data.
+        
+        Args:
+            data (str): packed data, or a buffer over packed data
+            b0 (str): Optional 16 byte block prepended to data
+        
+        Returns:
+            Packed 16 byte CMAC
+        """
+        n = len(data)
+        if b0 is not None and n == 0:
+            return self.cmac(b0)
+        chunks = [] if b0 is None else [b0]
+        r = n % 16
+        if n > 0 and r == 0:
+            chunks += [data[:n-16], xorBlock(data[n-16:], self.k1)]
+        else:
+            pad = data[n-r:].tobytes() if isinstance(data, memoryview) \
+                  else data[n-r:]
+            pad += '\x80' + '\x00' * (15 - r)
+            chunks += [data[:n-r], xorBlock(pad, self.k2)]
+        return self.cipher.cbcmac(*chunks)
+
+class CipherCache(object):
+    """Bounded LRU cache of session ciphers.
+
+    Caches SessionCipher objects keyed by the integer session key
+    (NwkSKey, AppSKey or AppKey). The least recently used entry is
+    evicted when the cache is full.
+
+    Attributes:
+        maxsize (int): Maximum number of cached ciphers
+        hits (int): Number of cache hits
+        misses (int): Number of cache misses
+        ciphers (OrderedDict): Cached ciphers, least recently used first
+    """
+
+    def __init__(self, maxsize=10000):
+        """CipherCache initialisation method.
+
+        Args:
+            maxsize (int): Maximum number of cached ciphers
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.ciphers = OrderedDict()
+
+    def __len__(self):
+        return len(self.ciphers)
+
+    def get(self, key):
+        """Get the cipher for key, creating it if required.
+
+        Args:
+            key (int): 128 bit key
+
+        Returns:
+            SessionCipher object.
+        """
+        cipher = self.ciphers.pop(key, None)
+        if cipher is None:
+            self.misses += 1
+            cipher = SessionCipher(intPackBytes(key, 16))
+            if len(self.ciphers) >= self.maxsize:
+                self.ciphers.popitem(last=False)
+        else:
+            self.hits += 1
+        self.ciphers[key] = cipher
+        return cipher
+
+    def evict(self, *keys):
+        """Remove the ciphers for keys from the cache.
+
+        Args:
+            keys (int): 128 bit keys. None values are ignored.
+        """
+        for key in keys:
+            if key is not None:
+                self.ciphers.pop(key, None)
+
+    def clear(self):
+        """Remove all ciphers and reset the counters"""
+        self.ciphers.clear()
+        self.hits = 0
+        self.misses = 0
 
+cipherCache = CipherCache()
@@ -1,8 +1,7 @@
 
-import math
 import struct
 
-from floranet.lora.crypto import aesEncrypt, aesDecrypt
+from floranet.lora.crypto import cipherCache
 from floranet.util import intPackBytes
 from floranet.error import DecodeError
 
@@ -34,6 +33,25 @@ RXTIMINGSETUPANS = 8
 """Major version of data message (Major bit field)"""
 LORAWAN_R1 = 0
 
+"""Payload encryption block Ai, excluding the block counter i"""
+AI_PREFIX = struct.Struct('<BLBLLB')
+
+"""MIC calculation block B0"""
+MIC_B0 = struct.Struct('<BLBLLBB')
+
+"""Frame header devaddr, fctrl and fcnt fields"""
+FHDR = struct.Struct('<LBH')
+
+"""Message integrity code"""
+MIC = struct.Struct('<L')
+
+"""Single octet fields: MAC header, fport"""
+OCTET = struct.Struct('B')
+
+"""Join request appeui, deveui, devnonce and MIC fields"""
+JOIN_REQUEST_FIELDS = struct.Struct('<QQHL')
+JOIN_REQUEST_MIC_FIELDS = struct.Struct('<QQH')
+
 class MACHeader(object):
     """LoRa Message MAC Header.
     
@@ -47,6 +65,7 @@ class MACHeader(object):
         major (int): Major version.
         
     """
+    __slots__ = ('mtype', 'major')
 
     def __init__(self, mtype, major):
         """MACHeader initialisation method.
@@ -70,7 +89,7 @@ class MACHeader(object):
             MACHeader object on success, None otherwise.
             
         """
-        h = struct.unpack('B', data)[0]
+        h = OCTET.unpack_from(data)[0]
         # Bits 7-5 define the message type
         mtype = (h & 224) >> 5
         # Bits 1-0 define the major version
@@ -86,7 +105,7 @@ class MACHeader(object):
         
         """
         b = 0 | self.mtype << 5 | self.major
-        data = struct.pack('B', b)
+        data = OCTET.pack(b)
         return data
     
 class FrameHeader(object):
@@ -110,6 +129,8 @@ class FrameHeader(object):
         length (int): Length of the frameheader
         
     """
+    __slots__ = ('devaddr', 'adr', 'adrackreq', 'ack', 'fpending',
+                 'foptslen', 'fcnt', 'fopts', 'fdir', 'length')
     
     def __init__(self, devaddr, adr, adrackreq, ack,
                  foptslen, fcnt, fopts, fpending=0, fdir='up'):
@@ -141,7 +162,7 @@ class FrameHeader(object):
         # FrameHeader must be at least 7 bytes
         if len(data) < 7:
             raise DecodeError()
-        (devaddr, fctrl, fcnt) = struct.unpack('<LBH', data[:7])
+        (devaddr, fctrl, fcnt) = FHDR.unpack_from(data)
         # Decode fctrl field
         # ADR is bit 7
         adr = (fctrl & 128) >> 7
@@ -167,7 +188,7 @@ class FrameHeader(object):
         fctrl = 0 | (self.adr << 7) | (self.adrackreq << 6) \
                   | (self.ack << 5) | (self.fpending << 4) \
                   | (self.foptslen & 15)
-        data = struct.pack('<LBH', self.devaddr, fctrl, self.fcnt) + self.fopts
+        data = FHDR.pack(self.devaddr, fctrl, self.fcnt) + self.fopts
         return data
     
 class MACPayload(object):
@@ -182,6 +203,7 @@ class MACPayload(object):
         fport (int): Frame port
         frmpayload (str): Frame payload.
     """
+    __slots__ = ('fhdr', 'fport', 'frmpayload')
     
     def __init__(self, fhdr, fport, frmpayload):
         """MACPayload initialisation method.
@@ -212,7 +234,7 @@ class MACPayload(object):
         fport = None
         frmpayload = None
         if dlen > fhdr.length:
-            fport = struct.unpack('B', data[fhdr.length])[0]
+            fport = OCTET.unpack_from(data, fhdr.length)[0]
         # Decode frmpayload
         if dlen > fhdr.length + 1:
             frmpayload = data[fhdr.length+1:]
@@ -226,20 +248,25 @@ class MACPayload(object):
             String of packed data.
         
         """
-        data = self.fhdr.encode() + struct.pack('B', self.fport) + \
-                self.frmpayload
+        data = self.fhdr.encode()
+        if self.fport is not None:
+            data += OCTET.pack(self.fport) + (self.frmpayload or '')
         return data
 
 class MACMessage(object):
     """A LoRa MAC message.
     
-    """        
+    """
+    __slots__ = ()
+    
     @classmethod
-    def decode(cls, data):
+    def decode(cls, data, lazy=False):
         """Decode the message type.
         
         Args:
             data (str): UDP packet data.
+            lazy (bool): Defer decoding of data message payloads until
+                         first accessed.
         
         Returns:
             MACJoinMessage or MACDataMessage on success, None otherwise.
@@ -249,12 +276,12 @@ class MACMessage(object):
         if len(data) < 1:
             raise DecodeError()
         # Decode the MAC Header
-        mhdr = MACHeader.decode(data[0])
+        mhdr = MACHeader.decode(data)
         # Decode the Message
         if mhdr.mtype == JOIN_REQUEST:
             return JoinRequestMessage.decode(mhdr, data)
         elif mhdr.mtype == UN_DATA_UP or mhdr.mtype == CO_DATA_UP:
-            return MACDataUplinkMessage.decode(mhdr, data)
+            return MACDataUplinkMessage.decode(mhdr, data, lazy=lazy)
         else:
             return None
 
@@ -343,7 +370,7 @@ class JoinRequestMessage(MACMessage):
         # Message (PHYPayload) must be 23 bytes
         if len(data) != 23:
             raise DecodeError()
-        (appeui, deveui, devnonce, mic) = struct.unpack('<QQHL', data[1:])
+        (appeui, deveui, devnonce, mic) = JOIN_REQUEST_FIELDS.unpack_from(data, 1)
         m = JoinRequestMessage(mhdr, appeui, deveui, devnonce, mic)
         return m
     
@@ -360,10 +387,10 @@ class JoinRequestMessage(MACMessage):
         Returns:
             True on success, False otherwise.
         """
-        data = self.mhdr.encode() + struct.pack('<QQH', self.appeui,
+        data = self.mhdr.encode() + JOIN_REQUEST_MIC_FIELDS.pack(self.appeui,
                                                 self.deveui, self.devnonce)
-        aesdata = aesEncrypt(intPackBytes(appkey, 16), data, mode='CMAC')
-        mic = struct.unpack('<L', aesdata[:4])[0]
+        aesdata = cipherCache.get(appkey).cmac(data)
+        mic = MIC.unpack_from(aesdata)[0]
         return mic == self.mic
 
 class JoinAcceptMessage(MACMessage):
@@ -430,11 +457,11 @@ class JoinAcceptMessage(MACMessage):
         if self.cflist:
             pass
         # Create the MIC over the entire message
-        self.mic = aesEncrypt(intPackBytes(self.appkey, 16), header + msg,
-                              mode='CMAC')[0:4]
+        cipher = cipherCache.get(self.appkey)
+        self.mic = cipher.cmac(header + msg)[0:4]
         msg += self.mic
         # Add the header and encrypt the message using AES-128 decrypt
-        data = header + aesDecrypt(intPackBytes(self.appkey, 16), msg)
+        data = header + cipher.decrypt(msg)
         return data
         
 class MACDataMessage(MACMessage):
@@ -451,6 +478,8 @@ class MACDataMessage(MACMessage):
         mic (str): Message integrity code.
     
     """
+    __slots__ = ('mhdr', 'payload', 'mic')
+    
     def __init__(self):
         self.mhdr = None
         self.payload = None
@@ -470,11 +499,13 @@ class MACDataMessage(MACMessage):
           
         Encryption and decryption of the payload is done by
         truncating (pld | pad16) xor S to the first len(pld) octets.
-        i.e. pad pld to a 16 byte boundary, then xor with S, and
-        truncate to the original length.
+        All blocks Ai are built at once and encrypted with a single
+        multi-block ECB call. The XOR is performed as one long integer
+        operation over S truncated to len(pld), which is equivalent to
+        padding pld.
         
         Args:
-            key (int): AES encryption key - device NwkSKey or AppSkey
+            key (int): AES encryption key - device NwkSkey or AppSkey
             dir (int): Direction - 0 for uplink and 1 for downlink
         
         """
@@ -483,32 +514,19 @@ class MACDataMessage(MACMessage):
         plen = len(self.payload.frmpayload)
         if plen == 0:
             return
-        k = int(math.ceil(plen/16.0))
-        # Create the concatenated block S
-        S = ''
-        for i in range(k):
-            # Ai: [0x01 | 4 x 0x00 | dir | devaddr | Fcntup or FcntDown | 0x00 | i]
-            Ai = struct.pack('<BLBLLBB', 1, 0, dir, self.payload.fhdr.devaddr,
-                             self.payload.fhdr.fcnt, 0, i+1)
-            # Si = aes128_encrypt(K, Ai) 
-            S += aesEncrypt(intPackBytes(key, 16), Ai)
-
-        # Pad frmpayload to a byte multiple of 16
-        padlen = k * 16 - plen
-        padded = self.payload.frmpayload + intPackBytes(0, padlen)
-        
-        # Unpack S and padded payload into arrays of long long ints
-        ufmt = '{}Q'.format(k*2)
-        s = struct.unpack(ufmt, S)
-        p = struct.unpack(ufmt, padded)
-        
-        # Perform the XOR function over the data, and pack
-        pld = ''
-        for i in range (len(s)):
-            pld += struct.pack('Q', s[i] ^ p[i])
-            
-        # Truncate the result to the original length
-        self.payload.frmpayload = pld[:plen]
+        k = (plen + 15) // 16
+        # Create the concatenated blocks A. Each Ai has a common prefix:
+        # Ai: [0x01 | 4 x 0x00 | dir | devaddr | Fcntup or FcntDown | 0x00 | i]
+        prefix = AI_PREFIX.pack(1, 0, dir, self.payload.fhdr.devaddr,
+                                self.payload.fhdr.fcnt, 0)
+        A = ''.join([prefix + chr(i) for i in range(1, k+1)])
+        # S = aes128_encrypt(K, A1) | .. | aes128_encrypt(K, Ak)
+        S = cipherCache.get(key).encrypt(A)[:plen]
+        
+        # Perform the XOR function over the data and truncate
+        x = int(S.encode('hex'), 16) ^ \
+            int(self.payload.frmpayload.encode('hex'), 16)
+        self.payload.frmpayload = ('%0*x' % (plen * 2, x)).decode('hex')
 
     def decrypt(self, key, dir):
         """Decrypt FRMPayload
@@ -536,22 +554,48 @@ class MACDataUplinkMessage(MACDataMessage):
         commands (list): List of piggybacked MAC commands
         mic (int): Message integrity code
         confirmed (bool): True if Confirmed Data Up
+        raw (memoryview): View of the received PHYPayload, or None
+        devaddr (int): Device address
+        fcnt (int): Frame counter
     
     """
-    def __init__(self, mhdr, payload, commands, mic):
+    __slots__ = ('commands', 'confirmed', 'raw', 'devaddr', 'fcnt')
+    
+    def __init__(self, mhdr, payload, commands, mic, raw=None):
         self.mhdr = mhdr
-        self.payload = payload
-        self.commands = commands
         self.mic = mic
         self.confirmed = self.mhdr.mtype == CO_DATA_UP
+        self.raw = raw
+        # A lazily decoded message has no payload or commands until
+        # they are first accessed - see __getattr__
+        if payload is not None:
+            self.payload = payload
+            self.commands = commands
+            self.devaddr = payload.fhdr.devaddr
+            self.fcnt = payload.fhdr.fcnt
+    
+    def __getattr__(self, name):
+        """Decode the payload and commands of a lazily decoded message.
+        
+        Only called if the attribute has not been set.
+        """
+        if name in ('payload', 'commands') and self.raw is not None:
+            (self.payload, self.commands) = self._decodePayload(self.raw)
+            return getattr(self, name)
+        raise AttributeError(name)
     
     @classmethod
-    def decode(cls, mhdr, data):
+    def decode(cls, mhdr, data, lazy=False):
         """Create a MACMessage object from binary representation.
         
+        If lazy is set, only the devaddr, fcnt and MIC are decoded,
+        which is sufficient for duplicate and device checks. The
+        payload and commands are decoded on first access.
+        
         Args:
             mhdr (MACHeader): MAC header object.
             data (str): UDP packet data.
+            lazy (bool): Defer decoding of the payload.
         
         Returns:
             A MACDataUplinkMessage object.
@@ -559,26 +603,38 @@ class MACDataUplinkMessage(MACDataMessage):
         # Message (PHYPayload) must be at least 6 bytes
         if len(data) < 6:
             raise DecodeError()
+        raw = memoryview(data)
+        # Slice the MIC
+        mic = MIC.unpack_from(data, len(data)-4)[0]
+        
+        if lazy:
+            # MACPayload must be at least 8 bytes
+            if len(data) < 13:
+                raise DecodeError()
+            m = MACDataUplinkMessage(mhdr, None, None, mic, raw=raw)
+            (m.devaddr, fctrl, m.fcnt) = FHDR.unpack_from(data, 1)
+            return m
+        
+        (payload, commands) = cls._decodePayload(raw)
+        m = MACDataUplinkMessage(mhdr, payload, commands, mic, raw=raw)
+        return m
+    
+    @staticmethod
+    def _decodePayload(raw):
+        """Decode the MAC payload and fopts MAC commands.
+        
+        Args:
+            raw (memoryview): View of the PHYPayload
+        
+        Returns:
+            Tuple of (MACPayload, list of MACCommand)
+        """
         # Decode message payload
-        payload = MACPayload.decode(data[1:len(data)-4])
+        payload = MACPayload.decode(raw[1:len(raw)-4].tobytes())
         
         # Decode fopts MAC Commands
-        commands = []
-        p = 0
-        while p < payload.fhdr.foptslen:
-            c = MACCommand.decode(payload.fhdr.fopts[p:])
-            # We have no option except to break here if we fail to decode 
-            # a MAC command, as we have no way of advancing the pointer
-            if c is None:
-                break
-            commands.append(c)
-            p += c.length
-            
-        # Slice the MIC
-        mic = struct.unpack('<L', data[len(data)-4:])[0]
-        
-        m = MACDataUplinkMessage(mhdr, payload, commands, mic)
-        return m
+        commands = MACCommand.decodeAll(payload.fhdr.fopts)
+        return (payload, commands)
     
     def decrypt(self, key):
         """Decrypt the MAC Data Uplink Message
@@ -588,6 +644,27 @@ class MACDataUplinkMessage(MACDataMessage):
         """
         super(MACDataUplinkMessage, self).decrypt(key, dir=0)
     
+    def calculateMIC(self, key):
+        """Calculate the message integrity code
+        
+        The MIC is calculated as cmac = aes128_cmac(NwkSKey, B0 | msg).
+        If the message was decoded, msg is taken from a view of the
+        received PHYPayload, otherwise the message is encoded.
+        
+        Args:
+            key (int): NwkSkey
+        
+        Returns:
+            The MIC as an int
+        """
+        if self.raw is not None:
+            msg = self.raw[:len(self.raw)-4]
+        else:
+            msg = self.mhdr.encode() + self.payload.encode()
+        B0 = MIC_B0.pack(0x49, 0, 0, self.devaddr, self.fcnt, 0, len(msg))
+        aesdata = cipherCache.get(key).cmac(msg, b0=B0)
+        return MIC.unpack_from(aesdata)[0]
+    
     def checkMIC(self, key):
         """Check the message integrity code
         
@@ -597,17 +674,8 @@ class MACDataUplinkMessage(MACDataMessage):
         Returns:
             True on success, False otherwise
         """
-
-        # Calculate the MIC for this message using key
-        msg = self.mhdr.encode() + self.payload.encode()
-        B0 = struct.pack('<BLBLLBB',
-                         int('0x49', 16), 0, 0, self.payload.fhdr.devaddr,
-                         self.payload.fhdr.fcnt, 0, len(msg))
-        data = B0 + msg
-        aesdata = aesEncrypt(intPackBytes(key, 16), data, mode='CMAC')
-        mic = struct.unpack('<L', aesdata[:4])[0]
         # Compare to message MIC
-        return mic == self.mic
+        return self.calculateMIC(key) == self.mic
         
 class MACDataDownlinkMessage(MACDataMessage):
     """A LoRa MAC Data Uplink Message.
@@ -655,12 +723,10 @@ class MACDataDownlinkMessage(MACDataMessage):
         # 4 bytes devaddr | 4 bytes fcntup or fcntdown
         # 1 byte 0x00 | 1 bytes len
         msg = self.mhdr.encode() + self.payload.encode()
-        B0 = struct.pack('<BLBLLBB', int('0x49', 16), 0, 1,
-                         self.devaddr, self.payload.fhdr.fcnt, 0, len(msg))
-        data = B0 + msg
+        B0 = MIC_B0.pack(0x49, 0, 1, self.devaddr, self.payload.fhdr.fcnt,
+                         0, len(msg))
         # Create the MIC over the entire message
-        self.mic = aesEncrypt(intPackBytes(self.key, 16), data,
-                              mode='CMAC')[0:4]
+        self.mic = cipherCache.get(self.key).cmac(msg, b0=B0)[0:4]
         msg += self.mic
         return msg
 
@@ -673,41 +739,62 @@ class MACCommand(object):
     
     LoRa MAC commands consist of a command identifier (CID) of
     1 octect followed by a possibly empty command-specific sequence
-    of octets.
+    of octets. Uplink commands are decoded through the REGISTRY
+    table, keyed by CID.
     
+    Attributes:
+        cid (int): Command identifier
+        length (int): Command length including CID
+        fields (Struct): Codec for the command-specific octets
     """
+    fields = struct.Struct('')
+    
     @classmethod
-    def decode(cls, data):
+    def decode(cls, data, offset=0):
         """Create a MACCommand object from binary representation.
         
         Args:
             data (str): FRMpayload, or fopts.
+            offset (int): Offset of the command CID in data.
         
         Returns:
             MACCommand object on success, otherwise None.
             
         """
-        if len(data) == 0:
+        if len(data) <= offset:
             return None
-        cid = struct.unpack('B', data[0])[0]
-        if cid == LINKCHECKREQ:
-            return LinkCheckReq.decode(data)
-        elif cid == LINKADRANS:
-            return LinkADRAns.decode(data)
-        # TODO
-        #elif cid == DUTYCYCLEANS:
-        #    return DutyCycleReq.decode(data)
-        #elif cid == RXPARAMSETUPANS:
-        #    return RxParamSetupReq.decode(data)
-        #elif cid == DEVSTATUSANS:
-        #    return DevStatusReq.decode(data)
-        #elif cid == NEWCHANNELANS:
-        #    return NewChannelReq.decode(data)
-        #elif cid == RXTIMINGSETUPANS:
-        #    return RxTimingSetupReq.decode(data)
-        else:
+        command = REGISTRY.get(OCTET.unpack_from(data, offset)[0])
+        if command is None or len(data) < offset + command.length:
             return None
+        return command.fromFields(*command.fields.unpack_from(data, offset + 1))
     
+    @classmethod
+    def fromFields(cls, *fields):
+        """Create a MACCommand object from its unpacked fields"""
+        return cls(*fields)
+    
+    @classmethod
+    def decodeAll(cls, data):
+        """Decode a sequence of MAC commands in a single pass.
+        
+        Decoding stops at the first unknown or truncated command, as
+        there is no way of determining its length.
+        
+        Args:
+            data (str): FRMpayload, or fopts.
+        
+        Returns:
+            List of MACCommand objects.
+        """
+        commands = []
+        p = 0
+        while p < len(data):
+            c = MACCommand.decode(data, p)
+            if c is None:
+                break
+            commands.append(c)
+            p += c.length
+        return commands
         
     def isLinkCheckReq(self):
         """Check if the message is a LinkCheckReq MAC Command.
@@ -734,14 +821,11 @@ class LinkCheckReq(MACCommand):
         cid (int): Command identifier
         length (int): Command length including CID
     """
+    cid = LINKCHECKREQ
+    length = 1
     
     def __init__(self, margin=0, gwcnt=1):
-        self.cid = LINKCHECKREQ
-        self.length = 1
-        
-    @classmethod
-    def decode(cls, data):
-        return LinkCheckReq()
+        pass
 
 class LinkCheckAns(MACCommand):
     """Used by the network server to respond to a LinkCheckReq command
@@ -756,10 +840,11 @@ class LinkCheckAns(MACCommand):
                      the last LinkCheckReq command
         
     """
+    cid = LINKCHECKANS
+    fields = struct.Struct('BB')
     length = 3
     
     def __init__(self, margin=0, gwcnt=1):
-        self.cid = LINKCHECKANS
         self.margin = margin
         self.gwcnt = gwcnt
     
@@ -770,7 +855,7 @@ class LinkCheckAns(MACCommand):
             String of packed data.
         
         """
-        data = struct.pack('BBB', self.cid, self.margin, self.gwcnt)
+        data = OCTET.pack(self.cid) + self.fields.pack(self.margin, self.gwcnt)
         return data
 
 class LinkADRReq(MACCommand):
@@ -791,10 +876,11 @@ class LinkADRReq(MACCommand):
         nbrep (int): a 4-bit integer defining the number of repetitions
                       for each uplink message.
     """
+    cid = LINKADRREQ
+    fields = struct.Struct('<BHB')
     length = 5
     
     def __init__(self, datarate, txpower, chmask, chmaskcntl, nbrep):
-        self.cid = LINKADRREQ
         self.datarate = datarate
         self.txpower = txpower
         self.chmask = chmask
@@ -810,10 +896,27 @@ class LinkADRReq(MACCommand):
         """
         datarate_txpower = 0 | (self.datarate << 4) | self.txpower
         redundancy = 0 | (self.chmaskcntl << 4) | self.nbrep
-        data = struct.pack('<BBHB', self.cid, datarate_txpower, self.chmask, redundancy)
+        data = OCTET.pack(self.cid) + self.fields.pack(datarate_txpower,
+                                                        self.chmask, redundancy)
         return data
 
-class LinkADRAns(MACCommand):
+class StatusAns(MACCommand):
+    """Base class for answers carrying a single status octet.
+    
+    Attributes:
+        status (int): Status octet
+    """
+    fields = struct.Struct('B')
+    length = 2
+    
+    def __init__(self, status=0):
+        self.status = status
+    
+    def _bit(self, n):
+        """Get status bit n"""
+        return (self.status >> n) & 0x01
+
+class LinkADRAns(StatusAns):
     """Used by a device to respond to a LinkADRReq command
     
     Attributes:
@@ -824,37 +927,141 @@ class LinkADRAns(MACCommand):
         channelmask_ack (int): Channel mask ACK bit
     
     """
+    cid = LINKADRANS
+    
     def __init__(self, power_ack=0, datarate_ack=0, channelmask_ack=0):
-        self.cid = LINKADRANS
-        self.length = 2
-        self.power_ack = power_ack
-        self.datarate_ack = datarate_ack
-        self.channelmask_ack = channelmask_ack
+        # Power ACK is bit 2, Datarate ACK is bit 1, Channelmask ACK is bit 0
+        super(LinkADRAns, self).__init__(
+            (power_ack << 2) | (datarate_ack << 1) | channelmask_ack)
     
     @classmethod
-    def decode(cls, data):
-        """Create a LinkADRAns object from binary representation.
+    def fromFields(cls, status):
+        """Create a LinkADRAns object from the status octet"""
+        ans = cls()
+        ans.status = status
+        return ans
+    
+    @property
+    def power_ack(self):
+        return self._bit(2)
+    
+    @property
+    def datarate_ack(self):
+        return self._bit(1)
+    
+    @property
+    def channelmask_ack(self):
+        return self._bit(0)
+    
+    def successful(self):
+        """Test if the LinkADRAns message is successful.
         
-        Args:
-            data (str): MAC Command data
+        Returns:
+            True if all attributes are 1, otherwise False.
+        """
+        return (self.power_ack & self.datarate_ack & self.channelmask_ack) == 1
+
+class DutyCycleAns(MACCommand):
+    """Used by a device to acknowledge a DutyCycleReq command
+    
+    Attributes:
+        cid (int): Command identifier
+        length (int): Command length including CID
+    """
+    cid = DUTYCYCLEANS
+    length = 1
+
+class RxParamSetupAns(StatusAns):
+    """Used by a device to respond to a RxParamSetupReq command
+    
+    Attributes:
+        cid (int): Command identifier
+        length (int): Command length including CID
+        rx1droffset_ack (int): RX1DRoffset ACK bit
+        rx2datarate_ack (int): RX2 Data rate ACK bit
+        channel_ack (int): Channel ACK bit
+    """
+    cid = RXPARAMSETUPANS
+    
+    @property
+    def rx1droffset_ack(self):
+        return self._bit(2)
+    
+    @property
+    def rx2datarate_ack(self):
+        return self._bit(1)
+    
+    @property
+    def channel_ack(self):
+        return self._bit(0)
+    
+    def successful(self):
+        """Test if the RxParamSetupAns message is successful.
         
         Returns:
-            LinkADRAns object.
+            True if all ACK bits are 1, otherwise False.
         """
-        status = struct.unpack('B', data[1])[0]
-        # Power ACK is bit 2
-        power_ack = (status & 0x04) >> 2
-        # Datarate ACK is bit 1
-        datarate_ack = (status & 0x02) >> 1
-        # Channelmask ACK is bit 0
-        channelmask_ack = status & 0x01
-        return LinkADRAns(power_ack, datarate_ack, channelmask_ack)
+        return (self.status & 0x07) == 0x07
+
+class DevStatusAns(MACCommand):
+    """Used by a device to respond to a DevStatusReq command
+    
+    Attributes:
+        cid (int): Command identifier
+        length (int): Command length including CID
+        battery (int): Battery level: 0 for external power, 1..254 for
+                       the battery level, 255 if not measurable.
+        margin (int): Demodulation SNR margin of the last successfully
+                      received DevStatusReq command in dB, -32..31
+    """
+    cid = DEVSTATUSANS
+    fields = struct.Struct('BB')
+    length = 3
+    
+    def __init__(self, battery=255, margin=0):
+        self.battery = battery
+        # Margin is a 6-bit signed integer
+        margin &= 0x3F
+        self.margin = margin - 64 if margin & 0x20 else margin
+
+class NewChannelAns(StatusAns):
+    """Used by a device to respond to a NewChannelReq command
+    
+    Attributes:
+        cid (int): Command identifier
+        length (int): Command length including CID
+        datarate_ok (int): Data rate range ok bit
+        channelfreq_ok (int): Channel frequency ok bit
+    """
+    cid = NEWCHANNELANS
+    
+    @property
+    def datarate_ok(self):
+        return self._bit(1)
+    
+    @property
+    def channelfreq_ok(self):
+        return self._bit(0)
     
     def successful(self):
-        """Test if the LinkADRAns message is successful.
+        """Test if the NewChannelAns message is successful.
         
         Returns:
-            True if all attributes are 1, otherwise False.
+            True if both status bits are 1, otherwise False.
         """
-        return (self.power_ack & self.datarate_ack & self.channelmask_ack) == 1
+        return (self.status & 0x03) == 0x03
+
+class RxTimingSetupAns(MACCommand):
+    """Used by a device to acknowledge a RxTimingSetupReq command
     
+    Attributes:
+        cid (int): Command identifier
+        length (int): Command length including CID
+    """
+    cid = RXTIMINGSETUPANS
+    length = 1
+
+"""Uplink MAC command codecs, keyed by CID"""
+REGISTRY = {c.cid: c for c in (LinkCheckReq, LinkADRAns, DutyCycleAns,
+                               RxParamSetupAns, DevStatusAns, NewChannelAns,
+                               RxTimingSetupAns)}
@@ -1,11 +1,13 @@
 
+import re
+import math
 import struct
-import json
 import base64
-from collections import OrderedDict
+from json.encoder import encode_basestring_ascii
 
 from twisted.internet import reactor, protocol
 from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.logger import LogLevel
 
 from ..models.gateway import Gateway
 from ..models.device import Device
@@ -13,6 +15,21 @@ from ..models.device import Device
 from ..log import log
 from ..error import DecodeError, UnsupportedMethod
 
+"""JSON codec. Use the fastest available C parser, falling back to
+the standard library json module."""
+try:
+    import ujson as json
+    jsonBackend = 'ujson'
+except ImportError:
+    try:
+        import simplejson as json
+        jsonBackend = 'simplejson' if json._speedups else 'json'
+    except ImportError:
+        json = None
+    if json is None or jsonBackend == 'json':
+        import json
+        jsonBackend = 'json'
+
 """GWMP Identifiers"""
 PUSH_DATA = 0
 PUSH_ACK = 1
@@ -21,6 +38,49 @@ PULL_RESP = 3
 PULL_ACK = 4
 TX_ACK = 5
 
+"""GWMP header version, token and identifier fields"""
+GWMP_HEADER = struct.Struct('<BHB')
+"""GWMP gateway EUI field"""
+GWMP_EUI = struct.Struct('<Q')
+"""GWMP PULL_ACK message"""
+GWMP_PULL_ACK = struct.Struct('<BHBQ')
+
+"""Gateway tmst counter modulus"""
+TMST_MODULUS = 1 << 32
+
+"""LoRa datarate identifier"""
+LORA_DATR = re.compile(r'SF(\d+)BW(\d+)')
+
+def airtime(datr, size, codr='4/5', ncrc=False, preamble=8):
+    """Calculate the LoRa time on air of a frame.
+    
+    Uses the time on air formula given in Semtech application note
+    AN1200.13, with an explicit header. Low data rate optimisation is
+    enabled for SF11 and SF12 at 125 kHz.
+    
+    Args:
+        datr (str): Datarate identifier "SFnBWm"
+        size (int): Number of octets in the frame
+        codr (str): ECC code rate "4/n"
+        ncrc (bool): If true, the physical layer CRC is disabled
+        preamble (int): Number of preamble symbols
+    
+    Returns:
+        Time on air in microseconds.
+    """
+    (sf, bw) = (int(v) for v in LORA_DATR.match(datr).groups())
+    cr = int(codr.split('/')[1]) - 4
+    de = 1 if sf >= 11 and bw == 125 else 0
+    tsym = float(1 << sf) / bw * 1000
+    symbols = 8 + max(int(math.ceil(
+        (8.0 * size - 4 * sf + 28 + (0 if ncrc else 16)) /
+        (4 * (sf - 2 * de)))) * (cr + 4), 0)
+    return int((preamble + 4.25 + symbols) * tsym)
+
+def tmstDiff(a, b):
+    """Signed difference a - b of two gateway tmst counter values"""
+    return (a - b + TMST_MODULUS // 2) % TMST_MODULUS - TMST_MODULUS // 2
+
 class Stat(object):
     """A Gateway Stat (upstream) JSON object.
     
@@ -47,6 +107,8 @@ class Stat(object):
         txnb (int): Number of radio frames transmitted since gateway start.
     
     """
+    __slots__ = ('time', 'lati', 'long', 'alti', 'rxnb', 'rxok', 'rwfw',
+                 'ackr', 'dwnb', 'txnb')
     
     def __init__(self):
         """Stat initialisation method.
@@ -121,6 +183,8 @@ class Rxpk(object):
         size (int): Number of octects in the received frame.
     
     """
+    __slots__ = ('tmst', 'freq', 'chan', 'rfch', 'stat', 'modu', 'datr',
+                 'codr', 'rssi', 'lsnr', 'data', 'time', 'size')
     
     def __init__(self, tmst=None, freq=None, chan=None, rfch=None,
                  stat=None, modu=None, datr=None, codr=None, rssi=None,
@@ -221,6 +285,19 @@ class Txpk(object):
         ncrc (bool): If not false, disable physical layer CRC generation
                     by the transmitter.
     """
+    __slots__ = ('imme', 'tmst', 'time', 'freq', 'rfch', 'powe', 'modu',
+                 'datr', 'codr', 'ipol', 'size', 'data', 'ncrc')
+    # Attributes are encoded in slot order, using a precomputed JSON
+    # member prefix and value formatter for each key
+    _bool = lambda v: 'true' if v else 'false'
+    _int = lambda v: '%d' % v
+    _str = encode_basestring_ascii
+    _template = tuple((k, '"%s":' % k, f) for (k, f) in (
+        ('imme', _bool), ('tmst', _int), ('time', _str), ('freq', repr),
+        ('rfch', _int), ('powe', _int), ('modu', _str), ('datr', _str),
+        ('codr', _str), ('ipol', _bool), ('size', _int), ('data', _str),
+        ('ncrc', _bool)))
+    del _bool, _int, _str
     
     def __init__(self, imme=None, tmst=None, time=None, freq=None,
                  rfch=None, powe=None, modu=None, datr=None, codr=None,
@@ -241,9 +318,6 @@ class Txpk(object):
         self.size = size
         self.data = data
         self.ncrc = ncrc
-        self.keys = ['imme', 'tmst', 'time', 'freq', 'rfch',
-                    'powe', 'modu', 'datr', 'codr', 'ipol',
-                    'size', 'data', 'ncrc']
         # Base64 encode data, no padding
         if self.data is not None:
             self.size = len(self.data)
@@ -260,13 +334,13 @@ class Txpk(object):
         """Create a JSON string from Txpk object
         
         """
-        # Create dict from attributes. Maintain added order
-        jd = {'txpk': OrderedDict()}
-        for key in self.keys:
+        # Format each attribute using the key order template
+        members = []
+        for (key, prefix, fmt) in self._template:
             val = getattr(self, key)
             if val is not None:
-                jd['txpk'][key] = val
-        return json.dumps(jd, separators=(',', ':'))
+                members.append(prefix + fmt(val))
+        return '{"txpk":{' + ','.join(members) + '}}'
 
 class GatewayMessage(object):
     """A Gateway Message.
@@ -284,8 +358,11 @@ class GatewayMessage(object):
         payload (str): GWMP payload.
         remote (tuple): Gateway IP address and port.
         ptype (str): JSON protocol top-level object type.
+        arrival (float): Time the datagram was received.
 
     """
+    __slots__ = ('version', 'token', 'id', 'gatewayEUI', 'payload', 'ptype',
+                 'remote', 'rxpk', 'txpk', 'stat', 'arrival')
 
     def __init__(self, version=1, token=0, identifier=None,
                  gatewayEUI=None, txpk=None, remote=None,
@@ -316,6 +393,7 @@ class GatewayMessage(object):
         self.rxpk = None
         self.txpk = txpk
         self.stat = None
+        self.arrival = None
     
     @classmethod
     def decode(cls, data, remote):
@@ -333,7 +411,7 @@ class GatewayMessage(object):
         if len(data) < 4:
             raise DecodeError("Message too short.")
         # Decode header
-        (version, token, identifer) = struct.unpack('<BHB', data[:4])
+        (version, token, identifer) = GWMP_HEADER.unpack_from(data)
         m = GatewayMessage(version=version, token=token, identifier=identifer)
         m.remote = remote
         # Test versions (1 or 2) and supported message types
@@ -347,12 +425,12 @@ class GatewayMessage(object):
         if m.id == PUSH_DATA:
             if len(data) < 12:
                 raise DecodeError("PUSH_DATA message too short.")
-            m.gatewayEUI = struct.unpack('<Q', data[4:12])[0]
+            m.gatewayEUI = GWMP_EUI.unpack_from(data, 4)[0]
             m.payload = data[12:]
         elif m.id == PULL_DATA:
             if len(data) < 12:
                 raise DecodeError("PULL_DATA message too short.")
-            m.gatewayEUI = struct.unpack('<Q', data[4:12])[0]
+            m.gatewayEUI = GWMP_EUI.unpack_from(data, 4)[0]
         elif m.id == TX_ACK:
             m.payload = data[4:]
             
@@ -391,25 +469,237 @@ class GatewayMessage(object):
         """
         data = ''
         if self.id == PUSH_ACK:
-            data = struct.pack('<BHB', self.version, self.token, self.id)
+            data = GWMP_HEADER.pack(self.version, self.token, self.id)
         elif self.id == PULL_ACK:
-            data = struct.pack('<BHBQ', self.version, self.token, self.id,
-                               self.gatewayEUI)
+            data = GWMP_PULL_ACK.pack(self.version, self.token, self.id,
+                                      self.gatewayEUI)
         elif self.id == PULL_RESP:
             if self.version == 1:
                 self.token = 0
             self.payload = self.txpk.encode()
-            data = struct.pack('<BHB', self.version, self.token, self.id) + \
+            data = GWMP_HEADER.pack(self.version, self.token, self.id) + \
                     self.payload
         return data
 
+class DownlinkScheduler(object):
+    """Class A downlink transmit scheduler.
+    
+    Keeps a timeline of the transmissions committed to each gateway, as
+    (tmst, airtime) intervals in the gateway's tmst counter space. For
+    each downlink, the first receive window whose transmission does not
+    overlap a committed transmission is selected, and only that txpk
+    is sent. The PULL_RESP is dispatched lead seconds before the window
+    opens, so that the gateway's JIT queue holds only imminent frames.
+    
+    Immediate transmissions are placed on the timeline at the gateway's
+    estimated current tmst, extrapolated from the last uplink received
+    from the gateway.
+    
+    Attributes:
+        lora (LoraWAN): The gateway interface
+        lead (float): Time before the window opens to send the
+                      PULL_RESP (seconds)
+        horizon (int): Time after which committed transmissions are
+                       discarded (microseconds)
+        timelines (dict): Lists of (tmst, airtime), keyed by gateway host
+        gateways (dict): Statistics dicts, keyed by gateway host
+        calls (set): Pending PULL_RESP dispatches
+        clocks (dict): (tmst, local time) of the last uplink, keyed by
+                       gateway host
+    """
+    
+    def __init__(self, lora, lead=0.2, horizon=10000000):
+        """DownlinkScheduler initialisation method.
+        
+        Args:
+            lora (LoraWAN): The gateway interface
+            lead (float): PULL_RESP lead time (seconds)
+            horizon (int): Committed transmission lifetime (microseconds)
+        """
+        self.lora = lora
+        self.lead = lead
+        self.horizon = horizon
+        self.timelines = {}
+        self.gateways = {}
+        self.calls = set()
+        self.clocks = {}
+    
+    def _gateway(self, host):
+        """Get or create the statistics for a gateway"""
+        stats = self.gateways.get(host)
+        if stats is None:
+            stats = self.gateways[host] = {
+                'rx1': 0, 'rx2': 0, 'imme': 0, 'collisions': 0,
+                'airtime': 0,
+                'start': reactor.seconds()}
+        return stats
+    
+    def _free(self, timeline, tmst, duration):
+        """Check an interval does not overlap the timeline"""
+        for (t, d) in timeline:
+            if tmstDiff(tmst, t) < d and tmstDiff(t, tmst) < duration:
+                return False
+        return True
+    
+    def select(self, host, txpk, windows):
+        """Select the first receive window that is free.
+        
+        The transmission is not committed: the caller must commit it
+        once the downlink can be sent. A collision is counted if no
+        window is free.
+        
+        Args:
+            host (str): Gateway host address
+            txpk (dict): RX1 and RX2 Txpk objects, keyed by window
+            windows (list): Reachable window numbers, in order of
+                            preference
+        
+        Returns:
+            The free window number, or None if all windows collide.
+        """
+        timeline = self.timelines.get(host, ())
+        for i in windows:
+            duration = airtime(txpk[i].datr, txpk[i].size, txpk[i].codr,
+                               txpk[i].ncrc)
+            if self._free(timeline, txpk[i].tmst, duration):
+                return i
+        self._gateway(host)['collisions'] += 1
+        return None
+    
+    def commit(self, request, txpk, window, arrival=None, rx=None):
+        """Commit a class A downlink to a receive window and dispatch it.
+        
+        Args:
+            request (GatewayMessage): Gateway message with the remote
+                                      gateway address
+            txpk (Txpk): The window's Txpk object
+            window (int): Receive window number
+            arrival (float): Uplink arrival time. If None, the
+                             PULL_RESP is sent immediately.
+            rx (dict): RX1 and RX2 parameter dicts, with delays
+        """
+        host = request.remote[0]
+        stats = self._gateway(host)
+        duration = self._add(host, txpk.tmst, txpk)
+        stats['rx%d' % window] += 1
+        stats['airtime'] += duration
+        self._dispatch(request, txpk, None if arrival is None else
+                       arrival + rx[window]['delay'] - self.lead)
+    
+    def schedule(self, request, txpk, windows, arrival=None, rx=None):
+        """Schedule a class A downlink in one receive window.
+        
+        Args:
+            request (GatewayMessage): Gateway message with the remote
+                                      gateway address
+            txpk (dict): RX1 and RX2 Txpk objects, keyed by window
+            windows (list): Reachable window numbers, in order of
+                            preference
+            arrival (float): Uplink arrival time. If None, the
+                             PULL_RESP is sent immediately.
+            rx (dict): RX1 and RX2 parameter dicts, with delays
+        
+        Returns:
+            The scheduled window number, or None if all windows collide.
+        """
+        i = self.select(request.remote[0], txpk, windows)
+        if i is not None:
+            self.commit(request, txpk[i], i, arrival, rx)
+        return i
+    
+    def observe(self, host, tmst, arrival):
+        """Record a gateway's tmst counter at a local time.
+        
+        Args:
+            host (str): Gateway host address
+            tmst (int): Gateway tmst of a received uplink
+            arrival (float): Local arrival time of the uplink
+        """
+        self.clocks[host] = (tmst, arrival)
+    
+    def sendImmediate(self, request, txpk):
+        """Send an immediate downlink, committing its airtime.
+        
+        If the gateway's tmst counter has not been observed, the
+        airtime is counted but cannot be placed on the timeline.
+        
+        Args:
+            request (GatewayMessage): Gateway message with the remote
+                                      gateway address
+            txpk (Txpk): Txpk object with imme set
+        """
+        host = request.remote[0]
+        stats = self._gateway(host)
+        clock = self.clocks.get(host)
+        if clock is None:
+            duration = airtime(txpk.datr, txpk.size, txpk.codr, txpk.ncrc)
+        else:
+            tmst = (clock[0] + int((reactor.seconds() - clock[1]) * 1e6)) \
+                   % TMST_MODULUS
+            duration = self._add(host, tmst, txpk)
+        stats['imme'] += 1
+        stats['airtime'] += duration
+        self.lora.sendPullResponse(request, txpk)
+    
+    def _add(self, host, tmst, txpk):
+        """Add a transmission to a gateway timeline.
+        
+        Returns:
+            The transmission airtime (microseconds).
+        """
+        duration = airtime(txpk.datr, txpk.size, txpk.codr, txpk.ncrc)
+        timeline = self.timelines.setdefault(host, [])
+        # Discard expired entries
+        timeline[:] = [(t, d) for (t, d) in timeline
+                       if tmstDiff(tmst, t) < self.horizon]
+        timeline.append((tmst, duration))
+        return duration
+    
+    def _dispatch(self, request, txpk, when):
+        """Send a PULL_RESP now, or at the local time when"""
+        delay = 0 if when is None else when - reactor.seconds()
+        if delay <= 0:
+            self.lora.sendPullResponse(request, txpk)
+            return
+        def send():
+            self.calls.discard(call)
+            self.lora.sendPullResponse(request, txpk)
+        call = reactor.callLater(delay, send)
+        self.calls.add(call)
+    
+    def stop(self):
+        """Cancel the pending dispatches"""
+        for call in self.calls:
+            if call.active():
+                call.cancel()
+        self.calls.clear()
+    
+    def stats(self, host):
+        """Get a gateway's statistics.
+        
+        Args:
+            host (str): Gateway host address
+        
+        Returns:
+            Dict of rx1, rx2, imme and collision counts, committed airtime
+            (microseconds) and utilisation, the fraction of time since
+            the first downlink spent transmitting.
+        """
+        stats = dict(self._gateway(host))
+        elapsed = reactor.seconds() - stats.pop('start')
+        stats['utilisation'] = stats['airtime'] / (elapsed * 1e6) \
+                               if elapsed > 0 else 0.0
+        return stats
+
 class LoraWAN(protocol.DatagramProtocol):
     """LoRaWAN Gateway to Server Interface.
     
     Attributes:
         server (NetServer): The Lora Network Server
         port (Port): Twsited TCP port
-        gateways (list): List of configured Gateways 
+        gateways (dict): Configured Gateways, keyed by host address
+        euis (dict): Configured Gateways, keyed by gateway EUI
+        scheduler (DownlinkScheduler): Class A downlink scheduler
     
     """
         
@@ -421,12 +711,18 @@ class LoraWAN(protocol.DatagramProtocol):
         """
         self.server = server
         self.port = None
-        self.gateways = []
+        self.gateways = {}
+        self.euis = {}
+        self.scheduler = DownlinkScheduler(self)
     
     @inlineCallbacks  
     def start(self):
         """Start the gateway network interface"""
-        self.gateways = yield Gateway.all()
+        gateways = yield Gateway.all()
+        self.gateways = {}
+        self.euis = {}
+        for gateway in gateways or []:
+            self._index(gateway)
         self.port = reactor.listenUDP(self.server.config.port, self,
                           interface=self.server.config.listen)
         returnValue(True)
@@ -434,9 +730,24 @@ class LoraWAN(protocol.DatagramProtocol):
     @inlineCallbacks
     def restart(self):
         """Restart the gateway network interface"""
+        self.scheduler.stop()
         yield self.port.stopListening()
         self.port = reactor.listenUDP(self.server.config.port, self,
                           interface=self.server.config.listen)
+    
+    def _index(self, gateway):
+        """Add a gateway to the host and EUI indexes"""
+        self.gateways[gateway.host] = gateway
+        eui = getattr(gateway, 'eui', None)
+        if eui is not None:
+            self.euis[eui] = gateway
+    
+    def _unindex(self, gateway):
+        """Remove a gateway from the host and EUI indexes"""
+        self.gateways.pop(gateway.host, None)
+        eui = getattr(gateway, 'eui', None)
+        if eui is not None and self.euis.get(eui) is gateway:
+            del self.euis[eui]
         
     def addGateway(self, gateway):
         """Add a gateway to the active list
@@ -445,7 +756,7 @@ class LoraWAN(protocol.DatagramProtocol):
             gateway (Gateway): The gateway to add
         
         """
-        self.gateways.append(gateway)
+        self._index(gateway)
         log.info("Added gateway {host} to the active list", host=gateway.host)
 
     def updateGateway(self, host, gateway):
@@ -455,11 +766,12 @@ class LoraWAN(protocol.DatagramProtocol):
             host (str): The host id to update
             gateway (Gateway): The updated gateway        
         """
-        index = next((i for i,g in enumerate(self.gateways)
-                      if g.host == host), None)
-        if index is not None:
+        g = self.gateways.get(host)
+        if g is not None:
+            self._unindex(g)
             for a in {'host', 'name', 'enabled', 'power'}:
-                setattr(self.gateways[index], a, getattr(gateway, a))
+                setattr(g, a, getattr(gateway, a))
+            self._index(g)
             log.info("Updated gateway {host}", host=gateway.host)
 
     def deleteGateway(self, gateway):
@@ -469,23 +781,32 @@ class LoraWAN(protocol.DatagramProtocol):
             gateway (Gateway): The gateway to delete
         
         """
-        index = next((i for i,g in enumerate(self.gateways)
-                      if g.host == gateway.host), None)
-        if index is not None:
-            del(self.gateways[index])
+        g = self.gateways.get(gateway.host)
+        if g is not None:
+            self._unindex(g)
             log.info("Removed gateway {host} from the active list", host=gateway.host)
 
     def gateway(self, host):
-        """Get the enabled gateway for host address
+        """Get the gateway for host address
         
         Args:
             host (str): The host address
         
         Returns:
-            Gateway object if found abd enabled, None otherwise.
+            Gateway object if found, None otherwise.
+        """
+        return self.gateways.get(host)
+    
+    def gatewayByEUI(self, eui):
+        """Get the gateway for gateway EUI
+        
+        Args:
+            eui (int): The gateway EUI
+        
+        Returns:
+            Gateway object if found, None otherwise.
         """
-        gateway = next((g for g in self.gateways if g.host == host), None)
-        return gateway
+        return self.euis.get(eui)
     
     def datagramReceived(self, data, (host, port)):
         """Handle an inbound LoraWAN datagram.
@@ -499,14 +820,19 @@ class LoraWAN(protocol.DatagramProtocol):
             (host, port) (tuple): Gateway IP address and port.
         
         """
+        arrival = reactor.seconds()
         log.debug("Received {data} from {host}:{port}", data=repr(data),
                  host=host, port=port)
         gateway = self.gateway(host)
         if gateway is None:
-            log.error("Gateway message from unknown gateway {host}", host=host)
+            log.limited(LogLevel.error, ('unknown gateway', host),
+                        "Gateway message from unknown gateway {host}",
+                        host=host)
             return
         if not gateway.enabled:
-            log.error("Gateway message from disabled gateway {host}", host=host)
+            log.limited(LogLevel.error, ('disabled gateway', host),
+                        "Gateway message from disabled gateway {host}",
+                        host=host)
             return
         try:
             message = GatewayMessage.decode(data, (host, port))
@@ -518,13 +844,21 @@ class LoraWAN(protocol.DatagramProtocol):
                 log.error("Gateway message decode error "
                         "{errstr}", errstr=str(e))
             return
-        gateway.eui = message.gatewayEUI
+        # TX_ACK messages do not carry the gateway EUI
+        if (message.gatewayEUI is not None and
+            message.gatewayEUI != getattr(gateway, 'eui', None)):
+            self._unindex(gateway)
+            gateway.eui = message.gatewayEUI
+            self._index(gateway)
         if message.id == PULL_DATA:
             log.debug("Received PULL_DATA from %s:%d" % (host, port))
             gateway.port = port
             self._acknowledgePullData(message)
         elif message.id == PUSH_DATA:
             log.debug("Received PUSH_DATA from %s:%d" % (host, port))
+            message.arrival = arrival
+            if message.rxpk:
+                self.scheduler.observe(host, message.rxpk[-1].tmst, arrival)
             self._acknowledgePushData(message)
             self.server.processPushDataMessage(message, gateway)
         elif message.id == TX_ACK:
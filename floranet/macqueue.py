@@ -0,0 +1,164 @@
+import time
+import heapq
+from collections import deque
+
+class MACCommandQueue(object):
+    """Downlink MAC command queue.
+
+    Queued commands are held in a time ordered deque for each device,
+    keyed by DevEUI, so that queue operations only visit the commands
+    for a single device. A min-heap of (timestamp, DevEUI) entries
+    orders the devices for expiry: commands older than limit seconds
+    are removed from the oldest end of each device queue.
+
+    Attributes:
+        limit (int): Command lifetime (seconds)
+        queues (dict): Deques of (timestamp, command), keyed by DevEUI
+        heap (list): Min-heap of (timestamp, DevEUI) entries
+        count (int): Number of queued commands
+        expired (int): Number of commands expired
+    """
+
+    def __init__(self, limit):
+        """MACCommandQueue initialisation method.
+
+        Args:
+            limit (int): Command lifetime (seconds)
+        """
+        self.limit = limit
+        self.queues = {}
+        self.heap = []
+        self.count = 0
+        self.expired = 0
+
+    def __len__(self):
+        return self.count
+
+    def depth(self, deveui):
+        """Get the number of commands queued for a device.
+
+        Args:
+            deveui (int): Device DevEUI
+        """
+        queue = self.queues.get(deveui)
+        return len(queue) if queue else 0
+
+    def append(self, deveui, command, mark=None):
+        """Add a command to a device queue.
+
+        Args:
+            deveui (int): Device DevEUI
+            command (MACCommand): Command to add
+            mark (float): Queue time, defaults to time.time()
+        """
+        if mark is None:
+            mark = time.time()
+        queue = self.queues.get(deveui)
+        if queue is None:
+            queue = self.queues[deveui] = deque()
+        queue.append((mark, command))
+        heapq.heappush(self.heap, (mark, deveui))
+        self.count += 1
+
+    def remove(self, deveui, cid):
+        """Remove all commands of type cid from a device queue.
+
+        Args:
+            deveui (int): Device DevEUI
+            cid (int): MAC command identifier
+
+        Returns:
+            Number of commands removed.
+        """
+        queue = self.queues.get(deveui)
+        if not queue:
+            return 0
+        kept = deque(item for item in queue if item[1].cid != cid)
+        removed = len(queue) - len(kept)
+        if removed:
+            self._replace(deveui, kept)
+            self.count -= removed
+        return removed
+
+    def commands(self, deveui):
+        """Get the commands queued for a device, oldest first.
+
+        Args:
+            deveui (int): Device DevEUI
+
+        Returns:
+            List of MACCommand objects.
+        """
+        return [item[1] for item in self.queues.get(deveui, ())]
+
+    def popleft(self, deveui, n=1):
+        """Remove the n oldest commands from a device queue.
+
+        Args:
+            deveui (int): Device DevEUI
+            n (int): Number of commands to remove
+        """
+        queue = self.queues.get(deveui)
+        if not queue:
+            return
+        n = min(n, len(queue))
+        for i in xrange(n):
+            queue.popleft()
+        self.count -= n
+        if not queue:
+            del self.queues[deveui]
+
+    def _replace(self, deveui, queue):
+        """Set or delete a device queue"""
+        if queue:
+            self.queues[deveui] = queue
+        else:
+            del self.queues[deveui]
+
+    def expire(self, mark=None):
+        """Remove the commands that have been queued for longer than limit.
+
+        Args:
+            mark (float): Current time, defaults to time.time()
+
+        Returns:
+            Number of commands removed.
+        """
+        if mark is None:
+            mark = time.time()
+        heap = self.heap
+        expired = 0
+        while heap and heap[0][0] + self.limit < mark:
+            (t, deveui) = heapq.heappop(heap)
+            queue = self.queues.get(deveui)
+            # Entries for commands that have already been removed are
+            # ignored
+            while queue and queue[0][0] + self.limit < mark:
+                queue.popleft()
+                expired += 1
+            if queue is not None and not queue:
+                del self.queues[deveui]
+        self.count -= expired
+        self.expired += expired
+        return expired
+
+    def clear(self):
+        """Remove all commands and reset the counters"""
+        self.queues.clear()
+        del self.heap[:]
+        self.count = 0
+        self.expired = 0
+
+    def stats(self):
+        """Get the queue statistics.
+
+        Returns:
+            Dict of size, devices, maxdepth, meandepth and expired.
+        """
+        devices = len(self.queues)
+        maxdepth = max(len(q) for q in self.queues.itervalues()) \
+                   if devices else 0
+        return {'size': self.count, 'devices': devices,
+                'maxdepth': maxdepth,
+                'meandepth': float(self.count) / devices if devices else 0.0,
+                'expired': self.expired}
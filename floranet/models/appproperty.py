@@ -35,6 +35,8 @@ class AppProperty(Model):
              'double': 'd',
              'char[]': 's'
              }
+    # Precompiled codecs for each data type
+    STRUCTS = {t: struct.Struct(f) for (t, f) in TYPES.iteritems()}
     
     @inlineCallbacks
     def valid(self):
@@ -63,9 +65,7 @@ class AppProperty(Model):
         Args:
             data (str): application data
         """
-        
-        fmt = self.TYPES[self.type]
         try:
-            return struct.unpack(fmt, data)[0]
+            return self.STRUCTS[self.type].unpack(data)[0]
         except struct.error:
             return None
@@ -19,6 +19,8 @@ class Config(Model):
         freqband (str): Frequency band
         netid (int): Network ID
         duplicateperiod (int): Period (seconds) used to check for duplicate messages
+        aggregationperiod (int): Period (milliseconds) used to collect receptions
+            of a message from different gateways
         fcrelaxed (bool): Relaxed frame count mode
         otaastart (int): OTAA range start address
         otaaend (int): OTAA range end address
@@ -28,6 +30,7 @@ class Config(Model):
         adrmargin (int): SNR margin added to the calculation of adaptive data rate steps
         adrcycletime (int): Period (seconds) for ADR control cycle
         adrmessagetime (int): Minimum inter-ADR message time (seconds)
+        adrsnapshottime (int): Period (seconds) for saving device SNR readings
     """
     
     TABLENAME = 'config'
@@ -78,6 +81,9 @@ class Config(Model):
         if self.duplicateperiod < 1 or self.duplicateperiod > 60:
             messages['netid'] = 'Invalid duplicate period'
         
+        if self.aggregationperiod < 0 or self.aggregationperiod > 500:
+            messages['aggregationperiod'] = 'Invalid aggregation period'
+        
         if self.otaastart < 1 or self.otaastart > int('0xFFFFFFFF', 16):
             messages['otaastart'] = 'Invalid OTAA start address'
         elif self.otaaend < 1 or self.otaaend > int('0xFFFFFFFF', 16) \
@@ -95,6 +101,9 @@ class Config(Model):
             
         if self.adrmessagetime < 1:
             messages['adrmessagetime'] = 'Invalid ADR message time'
+        
+        if self.adrsnapshottime < 60:
+            messages['adrsnapshottime'] = 'Invalid ADR snapshot time'
  
         valid = not any(messages)
         return valid, messages
@@ -111,6 +120,7 @@ class Config(Model):
         self.freqband = 'US915'
         self.netid = int('0x010203', 16)
         self.duplicateperiod = 10
+        self.aggregationperiod = 200
         self.fcrelaxed = True        
         self.otaastart = int('0x06000001', 16)
         self.otaaend = int('0x060FFFFF', 16)
@@ -120,6 +130,7 @@ class Config(Model):
         self.adrmargin = 0.0
         self.adrcycletime = 9000
         self.adrmessagetime = 10
+        self.adrsnapshottime = 300
     
     def valid(self):
         pass
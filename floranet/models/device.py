@@ -146,63 +146,3 @@ class Device(Model):
             self.fcnterror = False
         
         return not self.fcnterror
-
-    def updateSNR(self, lsnr):
-        """Update Device SNR measures
-        
-        Updates the most recent received device SNR measure.
-        We keep 11 samples for each device, and use the
-        snr_pointer attribute to maintain the current sample
-        index.
-        
-        Args:
-            lsnr (float): Latest link SNR measure.
-        
-        """
-        # Check we have a SNR measure
-        if lsnr is None:
-            return
-        
-        # Check if this is the first SNR reading
-        if self.snr is None:
-            self.snr = []
-            
-        # Update the current SNR reading
-        if len(self.snr) == 11:
-            self.snr.pop(0)
-        self.snr.append(lsnr)
-        
-        # Update the average SNR, ensure we have at least 6 readings
-        if len(self.snr) >= 6:
-            self.snr_average = sum(self.snr[-6:])/6.0
-
-    def getADRDatarate(self, band, margin):
-        """Determine the optimal datarate that will achieve the
-        objective margin in the given band.
-        
-        We assume each increase in datarate step (e.g. DR0 to DR1) requires
-        an additional 3dB in SNR.
-        
-        Args:
-            band (Band): Band in use
-            margin (float): Target margin in dB
-        
-        Returns:
-            Optimal datarate as a string on success, otherwise None.
-        """
-        if not hasattr(self, 'snr_average') or self.snr_average is None:
-            return None
-        
-        # Target thresholds that the average must exceed. Note range(0,4)
-        # refers to the first four (upstream) indices of the band.datarate
-        # list. These are DR0, DR1, DR2, DR3
-        thresholds = [float(i) * 3.0 + margin for i in range(0,4)]
-
-        # If we have an average SNR less than the lowest threshold,
-        # return the lowest DR
-        if self.snr_average < thresholds[0]:
-            return band.datarate[0]
-        
-        # Find the index of lowest threshold that the SNR average just exceeds
-        i = [n for n,v in enumerate(thresholds) if self.snr_average >= v][-1]
-        return band.datarate[i]
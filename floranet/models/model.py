@@ -1,8 +1,13 @@
 from twistar.dbobject import DBObject
 import datetime
+import time
 import pytz
+from collections import OrderedDict
 
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet import reactor, task
+from twisted.internet.defer import inlineCallbacks, returnValue, succeed, Deferred, DeferredList
+
+from floranet.log import log
 
 class Model(DBObject):
     """Model base class
@@ -49,4 +54,248 @@ class Model(DBObject):
             setattr(self, attr, v)
         return self._config.runInteraction(_doupdate).addCallback(lambda _: self)
 
-    
\ No newline at end of file
+    
+
+    def queueUpdate(self, **kwargs):
+        """Updates the object attributes, and queues them to be saved.
+        
+        Attributes are saved by the next updateBuffer flush.
+        
+        """
+        for attr,v in kwargs.iteritems():
+            setattr(self, attr, v)
+        updateBuffer.add(self, **kwargs)
+
+class UpdateBuffer(object):
+    """Write-coalescing buffer for model updates.
+    
+    Queued attribute updates are merged per row. Dirty rows are saved
+    every interval seconds, or when batchsize rows are dirty. Each flush
+    runs in a single transaction, with one executemany UPDATE for each
+    table and set of columns.
+    
+    If a flush fails, each of its rows is retried in its own transaction.
+    Rows that fail are requeued, and dropped after maxretries consecutive
+    failures, so a bad row cannot block the rows queued behind it.
+    
+    Attributes:
+        interval (int): Flush interval (seconds)
+        batchsize (int): Number of dirty rows that triggers a flush
+        maxretries (int): Failures after which a row is dropped
+        pending (OrderedDict): (object, attributes) keyed by (table, id)
+        failures (dict): Consecutive failures of requeued rows, keyed by
+            (table, id)
+        flushing (Deferred): The flush in progress, otherwise None
+        flushes (int): Number of completed flushes
+        rows (int): Number of rows saved
+        errors (int): Number of failed flushes
+        dropped (int): Number of rows dropped after maxretries failures
+        batch (int): Rows saved by the last flush
+        maxbatch (int): Largest number of rows saved by a flush
+        latency (float): Duration of the last flush (seconds)
+        maxlatency (float): Longest flush duration (seconds)
+        totallatency (float): Sum of flush durations (seconds)
+    """
+    
+    def __init__(self, interval=1, batchsize=500, maxretries=3):
+        """UpdateBuffer initialisation method.
+        
+        Args:
+            interval (int): Flush interval (seconds)
+            batchsize (int): Number of dirty rows that triggers a flush
+            maxretries (int): Failures after which a row is dropped
+        """
+        self.interval = interval
+        self.batchsize = batchsize
+        self.maxretries = maxretries
+        self.pending = OrderedDict()
+        self.failures = {}
+        self.flushing = None
+        self.task = None
+        self.flushes = 0
+        self.rows = 0
+        self.errors = 0
+        self.dropped = 0
+        self.batch = 0
+        self.maxbatch = 0
+        self.latency = 0.0
+        self.maxlatency = 0.0
+        self.totallatency = 0.0
+    
+    def __len__(self):
+        return len(self.pending)
+    
+    def start(self):
+        """Start the periodic flush, and flush on reactor shutdown."""
+        if self.task is not None and self.task.running:
+            return
+        self.task = task.LoopingCall(self.flush)
+        self.task.start(self.interval, now=False)
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+    
+    def stop(self):
+        """Stop the periodic flush and save all pending rows.
+        
+        Returns:
+            Deferred that fires when the pending rows are saved.
+        """
+        if self.task is not None and self.task.running:
+            self.task.stop()
+        if self.flushing is None:
+            return self.flush()
+        # Flush again when the flush in progress completes
+        d = Deferred()
+        def _flushAgain(result):
+            self.flush().chainDeferred(d)
+            return result
+        self.flushing.addBoth(_flushAgain)
+        return d
+    
+    def add(self, obj, **kwargs):
+        """Queue attribute values to be saved.
+        
+        Args:
+            obj (Model): The object to update
+            kwargs: Attribute values
+        """
+        if not kwargs:
+            return
+        key = (obj.TABLENAME, obj.id)
+        if key in self.pending:
+            self.pending[key][1].update(kwargs)
+        else:
+            self.pending[key] = (obj, dict(kwargs))
+        if len(self.pending) >= self.batchsize and self.flushing is None:
+            self.flush()
+    
+    def discard(self, obj, *attrs):
+        """Remove queued attribute values for obj.
+        
+        Args:
+            obj (Model): The object
+            attrs: Attributes to remove. All are removed if none are given.
+        """
+        key = (obj.TABLENAME, obj.id)
+        if attrs and key in self.pending:
+            queued = self.pending[key][1]
+            for attr in attrs:
+                queued.pop(attr, None)
+            if queued:
+                return
+        self.pending.pop(key, None)
+        self.failures.pop(key, None)
+    
+    @staticmethod
+    def _save(rows):
+        """Save rows in a single transaction.
+        
+        Args:
+            rows (list): (object, attributes) tuples
+        
+        Returns:
+            Deferred that fires when the transaction completes.
+        """
+        # Group the rows by table and set of columns
+        groups = OrderedDict()
+        for (obj, attrs) in rows:
+            obj.beforeSave()
+            cols = tuple(sorted(attrs))
+            groups.setdefault((obj.TABLENAME, cols), []).append(
+                [attrs[c] for c in cols] + [obj.id])
+        config = obj._config
+        
+        def _doflush(txn):
+            for ((table, cols), values) in groups.iteritems():
+                (setstring, _) = config.updateArgsToString(
+                    OrderedDict.fromkeys(cols))
+                (wherestring, _) = config.whereToString(['id = ?'])
+                txn.executemany("UPDATE %s SET %s WHERE %s" %
+                                (table, setstring, wherestring), values)
+        
+        return config.runInteraction(_doflush)
+    
+    def flush(self):
+        """Save all pending rows in a single transaction.
+        
+        Returns:
+            Deferred returning the number of rows saved.
+        """
+        if self.flushing is not None or not self.pending:
+            return succeed(0)
+        (pending, self.pending) = (self.pending, OrderedDict())
+        
+        def _saved(_):
+            for key in pending:
+                self.failures.pop(key, None)
+            return len(pending)
+        
+        def _failed(failure):
+            # Retry each row on its own, so one bad row cannot fail the rest
+            self.errors += 1
+            log.error("Error saving {count} rows: {error}", count=len(pending),
+                      error=failure.getErrorMessage())
+            d = DeferredList([self._save([row]) for row in pending.itervalues()],
+                             consumeErrors=True)
+            return d.addCallback(_retried)
+        
+        def _retried(results):
+            saved = 0
+            for ((key, (obj, attrs)), (success, result)) in \
+                    zip(pending.iteritems(), results):
+                if success:
+                    saved += 1
+                    self.failures.pop(key, None)
+                    continue
+                failures = self.failures.get(key, 0) + 1
+                if failures >= self.maxretries:
+                    self.failures.pop(key, None)
+                    self.dropped += 1
+                    log.error("Dropped update of {table} row {id} after "
+                              "{failures} failures: {error}", table=key[0],
+                              id=key[1], failures=failures,
+                              error=result.getErrorMessage())
+                    continue
+                # Requeue the row, keeping any newer values
+                self.failures[key] = failures
+                if key in self.pending:
+                    attrs.update(self.pending[key][1])
+                self.pending[key] = (obj, attrs)
+            return saved
+        
+        def _flushed(saved):
+            latency = time.time() - start
+            self.flushing = None
+            self.flushes += 1
+            self.rows += saved
+            self.batch = saved
+            self.maxbatch = max(self.maxbatch, self.batch)
+            self.latency = latency
+            self.maxlatency = max(self.maxlatency, latency)
+            self.totallatency += latency
+            return saved
+        
+        start = time.time()
+        d = self._save(pending.values())
+        d.addCallbacks(_saved, _failed)
+        d.addCallback(_flushed)
+        if not d.called:
+            self.flushing = d
+        return d
+    
+    def stats(self):
+        """Get the flush metrics.
+        
+        Returns:
+            Dict of pending rows, flushes, rows, errors, dropped rows, last
+            and maximum batch size, and last, maximum and mean flush
+            latency.
+        """
+        return {'pending': len(self.pending), 'flushes': self.flushes,
+                'rows': self.rows, 'errors': self.errors,
+                'dropped': self.dropped,
+                'batch': self.batch, 'maxbatch': self.maxbatch,
+                'latency': self.latency, 'maxlatency': self.maxlatency,
+                'meanlatency': self.totallatency / self.flushes
+                               if self.flushes else 0.0}
+
+updateBuffer = UpdateBuffer()
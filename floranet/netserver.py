@@ -1,38 +1,66 @@
 import struct
 import imp
 import os
-import time
 
 from twisted.internet import reactor, task, protocol
 from twisted.internet.error import CannotListenError
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import inlineCallbacks, returnValue, \
+     DeferredList, DeferredSemaphore
 from twisted.enterprise import adbapi
+from twisted.logger import LogLevel
 from twistar.registry import Registry
 
 from floranet.models.config import Config
 from floranet.models.device import Device
-from floranet.models.application import Application
+from floranet.models.model import updateBuffer
 from floranet.imanager import interfaceManager
+from floranet.cache import DuplicateCache, DeviceCache, AddressPool, \
+     NegativeCache, applicationCache
+from floranet.macqueue import MACCommandQueue
+from floranet.adr import ADREngine
+from floranet.deadline import DownlinkBudget
+from floranet.aggregator import ReceptionAggregator
 
 from floranet.lora.wan import LoraWAN, GatewayMessage, Txpk
 from floranet.lora.mac import (MACMessage, MACDataDownlinkMessage, JoinAcceptMessage,
-      MACCommand, LinkCheckAns, LinkADRReq)
+      MACCommand, LinkCheckAns, LinkADRReq, DevStatusAns)
 from floranet.lora.bands import AU915, US915, EU868
-from floranet.lora.crypto import aesEncrypt
+from floranet.lora.crypto import cipherCache
 from floranet.web.webserver import WebServer
-from floranet.util import txsleep, euiString, devaddrString, intPackBytes, intUnpackBytes
+from floranet.util import euiString, devaddrString, intPackBytes, intUnpackBytes
 from floranet.log import log
 
+"""Maximum number of rxpk objects processed concurrently"""
+RXPK_CONCURRENCY = 16
+
+"""Rxpk processing results. Pending frames are held for aggregation,
+and counted when the aggregation period closes."""
+RXPK_RESULTS = ('accepted', 'duplicate', 'rejected', 'pending')
+
+"""Uplink pre-filter drop reasons"""
+FILTER_REASONS = ('crc', 'netid', 'unknown')
+
+"""Lifetime (seconds) of unknown DevAddr and DevEUI cache entries"""
+UNKNOWN_TTL = 60
+
 class NetServer(object):
     """LoRa network server
     
     Attributes:
         config (Configuration): Configuration object
-        message_cache (list): Timestamped MICs used for de-duplication
-        otagrange (set): Collection set of OTA addresses
+        message_cache (DuplicateCache): Uplink message de-duplication cache
+        devices (DeviceCache): Device session table
+        otaapool (AddressPool): OTAA address allocator
         task (dict): Dictionary of scheduled tasks
-        commands (dict): Dictionary of queued downlink MAC Commands
-        adrprocessing (bool): ADR processing flag
+        commands (MACCommandQueue): Queued downlink MAC Commands
+        adr (ADREngine): Adaptive data rate engine
+        budget (DownlinkBudget): Receive window deadline tracking
+        receptions (ReceptionAggregator): Uplink reception aggregation
+        rxpklimit (DeferredSemaphore): Concurrent rxpk processing limit
+        rxpkstats (dict): Counts of PUSH_DATA datagrams and rxpk results
+        unknownaddrs (NegativeCache): Recently seen unregistered DevAddrs
+        unknowneuis (NegativeCache): Recently seen unregistered DevEUIs
+        dropped (dict): Counts of pre-filtered rxpk, keyed by reason
         band (Band): Frequency band object
 
     """
@@ -44,15 +72,24 @@ class NetServer(object):
         
         """
         log.info("Initialising the server")
-        self.message_cache = []
         self.task = {}
-        self.commands = []
-        self.adrprocessing = False
         
         self.config = config
-        self.otarange = set(xrange(self.config.otaastart,
-                                   self.config.otaaend + 1))
+        self.commands = MACCommandQueue(self.config.macqueuelimit)
+        self.message_cache = DuplicateCache(self.config.duplicateperiod)
+        self.otaapool = AddressPool(self.config.otaastart,
+                                    self.config.otaaend)
+        self.devices = DeviceCache(self.otaapool)
         self.band = eval(self.config.freqband)()
+        self.adr = ADREngine(self)
+        self.budget = DownlinkBudget()
+        self.receptions = ReceptionAggregator(
+            self.config.aggregationperiod / 1000.0, self._processFrame)
+        self.rxpklimit = DeferredSemaphore(RXPK_CONCURRENCY)
+        self.rxpkstats = dict.fromkeys(('datagrams',) + RXPK_RESULTS[:3], 0)
+        self.unknownaddrs = NegativeCache(UNKNOWN_TTL)
+        self.unknowneuis = NegativeCache(UNKNOWN_TTL)
+        self.dropped = dict.fromkeys(FILTER_REASONS, 0)
 
     def reload(self, config):
         """Reload a new system configuration
@@ -92,10 +129,17 @@ class NetServer(object):
             else:
                 if self.task['processADRRequests'].running:
                     self.task['processADRRequests'].stop()
+                self.adr.stop()
+            
+        elif changed('adrsnapshottime'):
+            if self.task['saveSNRSnapshots'].running:
+                self.task['saveSNRSnapshots'].stop()
+            self.task['saveSNRSnapshots'].start(config.adrsnapshottime,
+                                                now=False)
             
         elif changed('otaastart', 'otaaend'):
-            self.otarange = set(xrange(config.otaastart,
-                                   config.otaaend + 1))
+            self.otaapool.reset(config.otaastart, config.otaaend,
+                                self.devices.devices)
         
         elif changed('macqueueing', 'macqueuelimit'):
             if config.macqueueing:
@@ -110,19 +154,28 @@ class NetServer(object):
         elif changed('freqband'):
             self.band = eval(config.freqband)()
             
+        self.message_cache.period = config.duplicateperiod
+        self.receptions.period = config.aggregationperiod / 1000.0
+        self.commands.limit = config.macqueuelimit
         self.config = config
         
         return(True, '')
         
         
+    @inlineCallbacks
     def start(self):
         """Start the netserver.
         
-        Sets up scheduled tasks and start listening on the required
-        interfaces.
+        Loads the device session table, sets up scheduled tasks and
+        start listening on the required interfaces.
         """
         log.info("Starting the server")
         
+        # Load the device session table
+        count = yield self.devices.load()
+        log.info("Loaded {count} devices", count=count)
+        self.adr.load()
+        
         # Setup scheduled tasks
         # 1. ADR Requests
         self.task['processADRRequests'] = task.LoopingCall(
@@ -131,19 +184,39 @@ class NetServer(object):
             self.task['processADRRequests'].start(
                 self.config.adrcycletime)
         
-        # 2. Message cache
+        # 2. ADR SNR snapshots. The final snapshot is taken on shutdown,
+        # before the update buffer saves the remaining changes.
+        self.task['saveSNRSnapshots'] = task.LoopingCall(self.adr.snapshot)
+        self.task['saveSNRSnapshots'].start(self.config.adrsnapshottime,
+                                            now=False)
+        reactor.addSystemEventTrigger('before', 'shutdown', self.adr.snapshot)
+        
+        # 3. Message cache
         self.task['cleanMessageCache'] = task.LoopingCall(
             self._cleanMessageCache)
         self.task['cleanMessageCache'].start(
             max(10, self.config.duplicateperiod*2))
 
-        # 3. MAC Command queue
+        # 4. Device session write-behind. The update buffer saves the
+        # remaining changes on shutdown.
+        updateBuffer.start()
+
+        # 5. MAC Command queue
         self.task['manageMACCommandQueue'] = task.LoopingCall(
                 self._manageMACCommandQueue)
         if self.config.macqueueing:
             self.task['manageMACCommandQueue'].start(
                 self.config.macqueuelimit/2)
 
+        # 6. Downlink deadline statistics
+        self.task['logDownlinkBudget'] = task.LoopingCall(
+            self._logDownlinkBudget)
+        self.task['logDownlinkBudget'].start(300, now=False)
+
+        # 7. Rate limited log summaries
+        self.task['flushLogLimits'] = task.LoopingCall(log.flush)
+        self.task['flushLogLimits'].start(log.interval, now=False)
+
         # Start the web server
         log.info("Starting the web server")
         self.webserver = WebServer(self)
@@ -173,40 +246,53 @@ class NetServer(object):
         y = self.config.netid & 0x7F
         return x == y
     
-    @inlineCallbacks
+    def _filterMessage(self, message):
+        """Check an uplink message can be for this network.
+        
+        Data messages are dropped if the DevAddr NwkID does not match
+        the network and the address is outside the OTAA range, or if
+        the DevAddr was recently found to be unregistered. Join
+        requests are dropped if the DevEUI was recently found to be
+        unregistered.
+        
+        Args:
+            message (MACMessage): LoRa MAC message object
+        
+        Returns:
+            The drop reason, or None if the message passes.
+        """
+        if message.isJoinRequest():
+            if message.deveui in self.unknowneuis:
+                return 'unknown'
+            return None
+        devaddr = message.devaddr
+        if not (self.checkDevaddr(devaddr) or
+                self.config.otaastart <= devaddr <= self.config.otaaend):
+            return 'netid'
+        if devaddr in self.unknownaddrs:
+            return 'unknown'
+        return None
+    
     def _getOTAADevAddrs(self):
         """Get all devaddrs for currently assigned Over the Air Activation (OTAA) devices.
         
         Returns:
             A list of devaddrs.
         """
-        devices = yield Device.find(where=['devaddr >= ? AND devaddr <= ?',
-                                           self.config.otaastart, self.config.otaaend],
-                                    orderby='devaddr')
-        if devices is None:
-            returnValue([])
-        devaddrs = [d.devaddr for d in devices]
-        returnValue(devaddrs)
+        return sorted(a for a in self.devices.devices if
+                      self.config.otaastart <= a <= self.config.otaaend)
     
-    @inlineCallbacks
     def _getFreeOTAAddress(self):
         """Get the next free Over the Air Activation (OTAA) address.
         
+        The address is allocated from the OTAA address pool, which is
+        updated as devices are added, re-addressed and removed.
+        
         Returns:
             A 32 bit end device network address (DevAddr) on success, None otherwise.
         """
-        # Get all active OTAA device addresses
-        devaddrs = yield self._getOTAADevAddrs()
-        
-        # Return None if no addresses available
-        if len(devaddrs) == len(self.otarange):
-            returnValue(None)
-        
-        # Find the set difference between the two lists, return lowest free address
-        diff = self.otarange.difference(devaddrs)
-        returnValue(diff.pop())
+        return self.otaapool.allocate()
 
-    @inlineCallbacks
     def _getActiveDevice(self, devaddr):
         """Searches active devices for the given devaddr.
         
@@ -216,9 +302,8 @@ class NetServer(object):
         Returns:
             A device object if successful, None otherwise.
         """
-        # Search active device for devaddr
-        device = yield Device.find(where=['devaddr = ?', devaddr], limit=1)
-        returnValue(device)
+        # Search the device session table for devaddr
+        return self.devices.get(devaddr)
         
     def _checkDuplicateMessage(self, message):
         """Checks for duplicate gateway messages.
@@ -226,8 +311,8 @@ class NetServer(object):
         We check for duplicate messages that may have been sent from
         different gateways that heard the same LoRa PHY payload. The
         period to check is defined by the config parameter duplicateperod.
-        Filtering uses the arrival time and MIC as cache entries -
-        duplicate frames will have the same MIC.
+        Filtering uses the arrival time and the DevAddr, FCnt and MIC as
+        cache entries - duplicate frames will have the same MIC.
 
         Args:
             message (MACMessage): LoRa MAC message object
@@ -235,98 +320,85 @@ class NetServer(object):
         Returns:
             True if a duplicate is found, otherwise False.
         """
-        # Search the cache for matching MIC entries within
-        # self.config.duplicateperiod. Each entry in the
-        # cache list is a tuple (mic, timestamp)
         if self.config.duplicateperiod == 0:
             return False
-        mark = time.time()
-        duplicate = next((True for e in self.message_cache if
-                      e[0] == message.mic and 
-                      e[1] + self.config.duplicateperiod > mark
-                      ), False)
-        if not duplicate:
-            self.message_cache.append((message.mic, mark))
-        return duplicate
+        return self.message_cache.check(self._messageKey(message))
+    
+    def _messageKey(self, message):
+        """Get the key identifying a frame received by several gateways.
+        
+        Data messages are keyed by (DevAddr, FCnt, MIC). Other
+        messages are keyed by MIC only.
+        
+        Args:
+            message (MACMessage): LoRa MAC message object
+        
+        Returns:
+            A (DevAddr, FCnt, MIC) tuple.
+        """
+        return (getattr(message, 'devaddr', None),
+                getattr(message, 'fcnt', None), message.mic)
     
     def _cleanMessageCache(self):
         """Removes stale entries from the message cache.
         
-        This method is periodically called to limit the growth of
-        the message_cache list.
+        This method is periodically called to expire entries from
+        the message cache between uplinks.
         """
-        mark = time.time()
-        self.message_cache = [x for x in self.message_cache if not
-                              (x[1] + self.config.duplicateperiod) < mark]
+        self.message_cache.expire()
+        self.unknownaddrs.expire()
+        self.unknowneuis.expire()
+        log.debug("Message cache {size} entries, hit rate {hitrate:.2f}, "
+                  "{evictions} evictions", **self.message_cache.stats())
+        log.debug("Aggregated {receptions} receptions of {closed} frames, "
+                  "mean {meangateways:.2f} and max {maxgateways} gateways "
+                  "per frame", **self.receptions.stats())
+        log.debug("Received {datagrams} PUSH_DATA datagrams, rxpk "
+                  "{accepted} accepted, {duplicate} duplicate, {rejected} "
+                  "rejected", **self.rxpkstats)
+        log.debug("Dropped {crc} rxpk with CRC errors, {netid} for other "
+                  "networks and {unknown} from unknown devices",
+                  **self.dropped)
+        log.debug("Update buffer {pending} pending, {rows} rows in {flushes} "
+                  "flushes, {errors} errors, {dropped} dropped, batch "
+                  "{batch} (max {maxbatch}), latency {latency:.3f}s (mean "
+                  "{meanlatency:.3f}s, max {maxlatency:.3f}s)",
+                  **updateBuffer.stats())
+
+    def _logDownlinkBudget(self):
+        """Logs the receive window slack and downlink scheduling
+        statistics for each gateway."""
+        for host in sorted(self.budget.gateways):
+            log.debug("Gateway {host} downlinks {sent} sent, {rx2only} RX2 "
+                      "only, {missed} missed. RX1 slack {rx1}, RX2 slack "
+                      "{rx2}", host=host, **self.budget.stats(host))
+        for host in sorted(self.lora.scheduler.gateways):
+            log.debug("Gateway {host} scheduled {rx1} RX1, {rx2} RX2, "
+                      "{imme} immediate, {collisions} collisions, utilisation "
+                      "{utilisation:.4f}", host=host,
+                      **self.lora.scheduler.stats(host))
 
     def _manageMACCommandQueue(self):
         """Removes expired MAC Commands from the queue.
         
         This method is periodically called to limit the queue size.
         """
-        mark = time.time()
-        self.commands = [x for x in self.commands if not
-                              (x[0] + self.config.macqueuelimit) < mark]
+        self.commands.expire()
+        log.debug("MAC command queue {size} commands for {devices} devices, "
+                  "max depth {maxdepth}, {expired} expired",
+                  **self.commands.stats())
         
-    @inlineCallbacks
     def _processADRRequests(self):
-        """Updates devices with target data rate, and sends ADR requests.
+        """Calculates target data rates, and schedules ADR requests.
         
         This method is called every adrcycletime seconds as a looping task.
-        
-        """        
-        # If we are running, return
-        if self.adrprocessing is True:
-            returnValue(None)
-        
-        self.adrprocessing = True
-        
-        devices = yield Device.all()
-        sendtime = time.time()
-        
-        for device in devices:
-            # Check this device is enabled
-            if not device.enabled:
-                continue
-            
-            # Check ADR is enabled
-            if not device.adr:
-                continue
-            
-            # Set the target data rate 
-            target = device.getADRDatarate(self.band, self.config.adrmargin)
-            
-            # If no target, or the current data rate is the target, continue
-            if target is None:
-                continue
-            
-            # Set the device adr_datr
-            yield device.update(adr_datr=target)
-            
-            # Only send a request if we need to change
-            if device.tx_datr == device.adr_datr:
-                continue
-            
-            # If we are queueing commands, create the command and add to the queue.
-            # Replace any existing requests.
-            if self.config.macqueueing:
-                log.info("Queuing ADR MAC Command")
-                command = self._createLinkADRRequest(device)
-                self._dequeueMACCommand(device.deveui, command)
-                self._queueMACCommand(device.deveui, command)
-                continue
-
-            # Check we have reached the next scheduled ADR message time
-            scheduled = sendtime + self.config.adrmessagetime
-            current = time.time()
-            if current < scheduled:
-                yield txsleep(scheduled - current)            
-
-            # Refresh and send the LinkADRRequest
-            sendtime = time.time()    
-            yield self._sendLinkADRRequest(device)
-            
-        self.adrprocessing = False
+        Only devices with SNR measures received since the last cycle are
+        processed.
+        """
+        changed = self.adr.process()
+        log.debug("ADR processed, {changed} devices require a data rate "
+                  "change. {queued} requests queued for {gateways} gateways",
+                  changed=changed, **self.adr.stats())
     
     def _createSessionKey(self, pre, app, msg):
         """Create a NwkSKey or AppSKey
@@ -348,7 +420,7 @@ class NetServer(object):
                intPackBytes(app.appnonce, 3, endian='little') + \
                intPackBytes(self.config.netid, 3, endian='little') + \
                struct.pack('<H', msg.devnonce) + intPackBytes(0, 7)
-        aesdata = aesEncrypt(intPackBytes(app.appkey, 16), data)
+        aesdata = cipherCache.get(app.appkey).encrypt(data)
         key = intUnpackBytes(aesdata)
         return key
     
@@ -360,8 +432,7 @@ class NetServer(object):
             command: (Device): Command to add
         
         """
-        item = (int(time.time()), int(deveui), command)
-        self.commands.append(item)
+        self.commands.append(int(deveui), command)
 
     def _dequeueMACCommand(self, deveui, command):
         """Remove MAC command(s) from the queue.
@@ -374,9 +445,7 @@ class NetServer(object):
             command: (Device): Command to add
         
         """
-        ids = [i for i,c in enumerate(self.commands) if (deveui == c[1] and c[2].cid == command.cid)]
-        for i in ids:
-            del self.commands[i]
+        self.commands.remove(deveui, command.cid)
         
     def _scheduleDownlinkTime(self, tmst, offset):
         """Calculate the timestamp for downlink transmission
@@ -431,174 +500,294 @@ class NetServer(object):
             request (GatewayMessage): the received gateway message object
             gateway (Gateway): the gateway that sent the message
         
+        Each rxpk is processed independently. Up to RXPK_CONCURRENCY
+        rxpk objects, across all datagrams, are processed concurrently.
+        
+        Returns:
+            Dict of accepted, duplicate, rejected and pending rxpk counts.
+        """
+        results = yield DeferredList(
+            [self.rxpklimit.run(self._processRxpk, request, gateway, rxpk)
+             for rxpk in request.rxpk], consumeErrors=True)
+        
+        summary = dict.fromkeys(RXPK_RESULTS, 0)
+        for (success, result) in results:
+            if not success:
+                result = self._rxpkError(result, gateway)
+            summary[result] += 1
+            self._countRxpk(result)
+        self.rxpkstats['datagrams'] += 1
+        returnValue(summary)
+    
+    def _rxpkError(self, failure, gateway):
+        """Log an rxpk processing error.
+        
+        Returns:
+            'rejected'
+        """
+        log.error("Error processing message from gateway {gateway}: "
+                  "{error}", gateway=gateway.host,
+                  error=failure.getErrorMessage())
+        return 'rejected'
+    
+    def _countRxpk(self, result):
+        """Count an rxpk result. Pending results are not counted."""
+        if result != 'pending':
+            self.rxpkstats[result] += 1
+        return result
+    
+    def _processFrame(self, message, receptions):
+        """Process a frame when its aggregation period closes.
+        
+        The frame is processed within the rxpk concurrency limit, and
+        its result is counted.
+        
+        Args:
+            message (MACMessage): The decoded message
+            receptions (list): (request, gateway, rxpk) tuples, best first
+        
+        Returns:
+            Deferred that fires with the frame result.
+        """
+        d = self.rxpklimit.run(self._processUplink, message, receptions)
+        d.addCallback(lambda result: 'accepted' if result else 'rejected')
+        d.addErrback(self._rxpkError, receptions[0][1])
+        d.addCallback(self._countRxpk)
+        return d
+    
+    @inlineCallbacks
+    def _processRxpk(self, request, gateway, rxpk):
+        """Process a single rxpk from a PUSH_DATA message
+        
+        Args:
+            request (GatewayMessage): the received gateway message object
+            gateway (Gateway): the gateway that sent the message
+            rxpk (Rxpk): the received packet
+        
+        Returns:
+            'accepted', 'duplicate', 'rejected', or 'pending' if the
+            frame is held for aggregation.
+        """
+        # Drop frames that failed the CRC check
+        if rxpk.stat is not None and rxpk.stat != 1:
+            self.dropped['crc'] += 1
+            returnValue('rejected')
+        
+        # Decode the MAC message
+        message = MACMessage.decode(rxpk.data, lazy=True)
+        if message is None:
+            log.info("MAC message decode error for gateway {gateway}: message "                        
+                    "timestamp {timestamp}", gateway=gateway.host,
+                    timestamp=str(rxpk.time))
+            returnValue('rejected')
+        
+        # Drop frames for other networks and unknown devices
+        reason = self._filterMessage(message)
+        if reason is not None:
+            self.dropped[reason] += 1
+            returnValue('rejected')
+        
+        # Collect receptions of a frame heard by several gateways
+        key = self._messageKey(message)
+        reception = (request, gateway, rxpk)
+        if self.receptions.collect(key, reception):
+            returnValue('duplicate')
+        
+        # Check if thisis a duplicate message
+        if self._checkDuplicateMessage(message):
+            returnValue('duplicate')
+        
+        # Process the frame once the aggregation period has closed,
+        # otherwise process the first reception now
+        if self.config.aggregationperiod:
+            self.receptions.open(key, message, reception)
+            returnValue('pending')
+        result = yield self._processUplink(message, [reception])
+        returnValue('accepted' if result else 'rejected')
+    
+    @inlineCallbacks
+    def _processUplink(self, message, receptions):
+        """Process an uplink frame.
+        
+        The frame is processed using the best reception: downlinks are
+        routed through its gateway, and its SNR is used for ADR. The
+        number of receptions is reported to LinkCheckReq requests.
+        
+        Args:
+            message (MACMessage): The decoded message
+            receptions (list): (request, gateway, rxpk) tuples, best first
+        
         Returns:
             True on success, otherwise False
         """
-        for rxpk in request.rxpk:        
-            # Decode the MAC message
-            message = MACMessage.decode(rxpk.data)
-            if message is None:
-                log.info("MAC message decode error for gateway {gateway}: message "                        
-                        "timestamp {timestamp}", gateway=gateway.host,
-                        timestamp=str(rxpk.time))
-                returnValue(False)
-            
-            # Check if thisis a duplicate message
-            if self._checkDuplicateMessage(message):
+        (request, gateway, rxpk) = receptions[0]
+        # Join Request
+        if message.isJoinRequest():                
+            # Get the application using appeui
+            app = yield applicationCache.get(message.appeui)
+            #app = next((a for a in self.applications if
+            #            a.appeui == message.appeui), None)
+            if app is None:
+                log.limited(LogLevel.info, ('unknown appeui', message.appeui),
+                    "Message from {deveui} - AppEUI {appeui} "
+                    "does not match any configured applications.",
+                    deveui=euiString(message.deveui),
+                                     appeui=message.appeui)
+                self.unknowneuis.add(message.deveui)
                 returnValue(False)
-            
-            # Join Request
-            if message.isJoinRequest():                
-                # Get the application using appeui
-                app = yield Application.find(where=['appeui = ?', message.appeui], limit=1)
-                #app = next((a for a in self.applications if
-                #            a.appeui == message.appeui), None)
-                if app is None:
-                    log.info("Message from {deveui} - AppEUI {appeui} "
-                        "does not match any configured applications.",
-                        deveui=euiString(message.deveui),
-                                         appeui=message.appeui)
-                    returnValue(False)
-                    
-                # Find the Device
-                device = yield Device.find(where=['deveui = ?', message.deveui], limit=1)
-                if device is None:
-                    log.info("Message from unregistered device {deveui}",
-                         deveui=euiString(message.deveui))
-                    returnValue(False)
-                    
-                # Check the device is enabled
-                if not device.enabled:
-                    log.info("Join request for disabled device {deveui}.",
-                         deveui=euiString(device.deveui))
-                    returnValue(False)
                 
-                # Process join request
-                joined = yield self._processJoinRequest(message, app, device)
-                if joined:
-                    # Update the ADR measures
-                    if self.config.adrenable:
-                        device.updateSNR(rxpk.lsnr)
-
-                    yield device.update(tx_chan=rxpk.chan, tx_datr=rxpk.datr,
-                                        devaddr=device.devaddr, nwkskey=device.nwkskey,
-                                        appskey=device.appskey,
-                                        time=rxpk.time, tmst=rxpk.tmst,
-                                        gw_addr=gateway.host,
-                                        fcntup=0, fcntdown=0,
-                                        fcnterror=False,
-                                        devnonce=device.devnonce,
-                                        snr=device.snr,
-                                        snr_average=device.snr_average)
-
-                    log.info("Successful Join request from DevEUI {deveui} "
-                            "for AppEUI {appeui} | Assigned address {devaddr}",
-                            deveui=euiString(device.deveui),
-                            appeui=euiString(app.appeui),
-                            devaddr=devaddrString(device.devaddr))
-                    
-                    # Send the join response
-                    self._sendJoinResponse(request, rxpk, gateway, app, device)
-                    returnValue(True)
-                else:
-                    log.info("Could not process join request from device "
-                          "{deveui}.", deveui=euiString(device.deveui))
-                    returnValue(False)
-            
-            # LoRa message. Check this is a registered device                
-            device = yield self._getActiveDevice(message.payload.fhdr.devaddr)
+            # Find the Device
+            device = self.devices.getByEUI(message.deveui)
             if device is None:
-                log.info("Message from device using unregistered address "
-                         "{devaddr}",
-                         devaddr=devaddrString(message.payload.fhdr.devaddr))
+                log.limited(LogLevel.info, ('unknown deveui', message.deveui),
+                     "Message from unregistered device {deveui}",
+                     deveui=euiString(message.deveui))
+                self.unknowneuis.add(message.deveui)
                 returnValue(False)
                 
             # Check the device is enabled
             if not device.enabled:
-                log.info("Message from disabled device {devaddr}",
-                         devaddr=devaddrString(message.payload.fhdr.devaddr))
+                log.limited(LogLevel.info, ('disabled deveui', device.deveui),
+                     "Join request for disabled device {deveui}.",
+                     deveui=euiString(device.deveui))
                 returnValue(False)
+            
+            # Process join request
+            joined = yield self._processJoinRequest(message, app, device)
+            if joined:
+                # Update the ADR measures
+                if self.config.adrenable:
+                    self.adr.updateSNR(device, rxpk.lsnr)
 
-            # Check frame counter
-            if not device.checkFrameCount(message.payload.fhdr.fcnt, self.band.max_fcnt_gap,
-                                         self.config.fcrelaxed):
-                log.info("Message from {devaddr} failed frame count check.",
-                        devaddr=devaddrString(message.payload.fhdr.devaddr))
-                log.debug("Received frame count {fcnt}, device frame count {dfcnt}",
-                          fcnt=message.payload.fhdr.fcnt, dfcnt=device.fcntup)
-                yield device.update(fcntup=device.fcntup, fcntdown=device.fcntdown,
-                                    fcnterror=device.fcnterror)
-                returnValue(False)
+                self.devices.update(device, tx_chan=rxpk.chan, tx_datr=rxpk.datr,
+                                    devaddr=device.devaddr, nwkskey=device.nwkskey,
+                                    appskey=device.appskey,
+                                    time=rxpk.time, tmst=rxpk.tmst,
+                                    gw_addr=gateway.host,
+                                    fcntup=0, fcntdown=0,
+                                    fcnterror=False,
+                                    devnonce=device.devnonce)
 
-            # Perform message integrity check.
-            if not message.checkMIC(device.nwkskey):
-                log.info("Message from {devaddr} failed message "
-                        "integrity check.",
-                        devaddr=devaddrString(message.payload.fhdr.devaddr))
+                log.info("Successful Join request from DevEUI {deveui} "
+                        "for AppEUI {appeui} | Assigned address {devaddr}",
+                        deveui=euiString(device.deveui),
+                        appeui=euiString(app.appeui),
+                        devaddr=devaddrString(device.devaddr))
+                
+                # Send the join response
+                self._sendJoinResponse(request, rxpk, gateway, app, device)
+                returnValue(True)
+            else:
+                log.info("Could not process join request from device "
+                      "{deveui}.", deveui=euiString(device.deveui))
                 returnValue(False)
+        
+        # LoRa message. Check this is a registered device                
+        device = self._getActiveDevice(message.devaddr)
+        if device is None:
+            log.limited(LogLevel.info, ('unknown devaddr', message.devaddr),
+                     "Message from device using unregistered address "
+                     "{devaddr}",
+                     devaddr=devaddrString(message.devaddr))
+            self.unknownaddrs.add(message.devaddr)
+            returnValue(False)
+            
+        # Check the device is enabled
+        if not device.enabled:
+            log.limited(LogLevel.info, ('disabled devaddr', message.devaddr),
+                     "Message from disabled device {devaddr}",
+                     devaddr=devaddrString(message.devaddr))
+            returnValue(False)
 
-            # Update SNR reading and device
-            device.updateSNR(rxpk.lsnr)
-            yield device.update(tx_chan=rxpk.chan, tx_datr=rxpk.datr,
-                                fcntup=device.fcntup, fcntdown=device.fcntdown,
-                                fcnterror=device.fcnterror,
-                                time=rxpk.time, tmst=rxpk.tmst,
-                                adr=bool(message.payload.fhdr.adr),
-                                snr=device.snr, snr_average=device.snr_average,
-                                gw_addr=gateway.host)
+        # Check frame counter
+        if not device.checkFrameCount(message.fcnt, self.band.max_fcnt_gap,
+                                     self.config.fcrelaxed):
+            log.info("Message from {devaddr} failed frame count check.",
+                    devaddr=devaddrString(message.devaddr))
+            log.debug("Received frame count {fcnt}, device frame count {dfcnt}",
+                      fcnt=message.fcnt, dfcnt=device.fcntup)
+            self.devices.update(device, fcntup=device.fcntup,
+                                fcntdown=device.fcntdown,
+                                fcnterror=device.fcnterror)
+            returnValue(False)
+
+        # Perform message integrity check.
+        if not message.checkMIC(device.nwkskey):
+            log.info("Message from {devaddr} failed message "
+                    "integrity check.",
+                    devaddr=devaddrString(message.devaddr))
+            returnValue(False)
+
+        # Record the uplink arrival time for the downlink deadlines
+        device.arrival = request.arrival
+        
+        # Update SNR reading and device. SNR readings are saved
+        # by the ADR engine snapshot task.
+        if self.config.adrenable:
+            self.adr.updateSNR(device, rxpk.lsnr)
+        self.devices.update(device, tx_chan=rxpk.chan, tx_datr=rxpk.datr,
+                            fcntup=device.fcntup, fcntdown=device.fcntdown,
+                            fcnterror=device.fcnterror,
+                            time=rxpk.time, tmst=rxpk.tmst,
+                            adr=bool(message.payload.fhdr.adr),
+                            gw_addr=gateway.host)
+        
+        # Set the device rx window parameters
+        device.rx = self.band.rxparams((device.tx_chan, device.tx_datr), join=False)
+        
+        # Process MAC Commands
+        commands = []
+        # Standalone MAC command
+        if message.isMACCommand():
+            message.decrypt(device.nwkskey)
+            commands = MACCommand.decodeAll(message.payload.frmpayload)
+        # Contains piggybacked MAC command(s)
+        elif message.hasMACCommands():
+            commands = message.commands
             
-            # Set the device rx window parameters
-            device.rx = self.band.rxparams((device.tx_chan, device.tx_datr), join=False)
+        for command in commands:
+            if command.isLinkCheckReq():
+                self._processLinkCheckReq(device, command, rxpk.lsnr,
+                                          len(receptions))
+            elif command.isLinkADRAns():
+                self._processLinkADRAns(device, command)
+            else:
+                self._processMACCommandAns(device, command)
             
-            # Process MAC Commands
-            commands = []
-            # Standalone MAC command
-            if message.isMACCommand():
-                message.decrypt(device.nwkskey)
-                commands = [MACCommand.decode(message.payload.frmpayload)]
-            # Contains piggybacked MAC command(s)
-            elif message.hasMACCommands():
-                commands = message.commands
-                
-            for command in commands:
-                if command.isLinkCheckReq():
-                    self._processLinkCheckReq(device, command, request, rxpk.lsnr)
-                elif command.isLinkADRAns():
-                    self._processLinkADRAns(device, command)
-                # TODO: add other MAC commands
-                
-            # Process application data message
-            if message.isUnconfirmedDataUp() or message.isConfirmedDataUp():
-                # Find the app
-                app = yield Application.find(where=['appeui = ?', device.appeui], limit=1)
-                if app is None:
-                    log.info("Message from {devaddr} - AppEUI {appeui} "
-                        "does not match any configured applications.",
-                        devaddr=euiString(device.devaddr), appeui=device.appeui)
-                    returnValue(False)
-                    
-                # Decrypt frmpayload
-                message.decrypt(device.appskey)
-                appdata = str(message.payload.frmpayload)
-                port = message.payload.fport
-                                    
-                # Route the data to an application server via the configured interface
-                log.info("Outbound message from devaddr {devaddr}",
-                         devaddr=devaddrString(device.devaddr))
-                interface = interfaceManager.getInterface(app.appinterface_id)
-                if interface is None:
-                    log.error("No outbound interface found for application "
-                              "{app}", app=app.name)
-                elif not interface.started:
-                    log.error("Outbound interface for application "
-                              "{app} is not started", app=app.name)
-                else:
-                    self._outboundAppMessage(interface, device, app, port, appdata)
+        # Process application data message
+        if message.isUnconfirmedDataUp() or message.isConfirmedDataUp():
+            # Find the app
+            app = yield applicationCache.get(device.appeui)
+            if app is None:
+                log.info("Message from {devaddr} - AppEUI {appeui} "
+                    "does not match any configured applications.",
+                    devaddr=euiString(device.devaddr), appeui=device.appeui)
+                returnValue(False)
                 
-                # Send an ACK if required
-                if message.isConfirmedDataUp():
-                    yield self.inboundAppMessage(device.devaddr, '', acknowledge=True)
-    
+            # Decrypt frmpayload
+            message.decrypt(device.appskey)
+            appdata = str(message.payload.frmpayload)
+            port = message.payload.fport
+                                
+            # Route the data to an application server via the configured interface
+            log.info("Outbound message from devaddr {devaddr}",
+                     devaddr=devaddrString(device.devaddr))
+            interface = interfaceManager.getAppInterface(app)
+            if interface is None:
+                log.error("No outbound interface found for application "
+                          "{app}", app=app.name)
+            elif not interface.started:
+                log.error("Outbound interface for application "
+                          "{app} is not started", app=app.name)
+            else:
+                self._outboundAppMessage(interface, device, app, port, appdata)
+            
+            # Send an ACK if required
+            if message.isConfirmedDataUp():
+                yield self.inboundAppMessage(device.devaddr, '', acknowledge=True)
+        
+        returnValue(True)
+
     def _outboundAppMessage(self, interface, device, app, port, appdata):
         """Sends application data to the application interface"""
         interface.netServerReceived(device, app, port, appdata)
@@ -617,7 +806,7 @@ class NetServer(object):
                  devaddr=devaddrString(devaddr))
 
         # Retrieve the active device
-        device = yield self._getActiveDevice(devaddr)
+        device = self._getActiveDevice(devaddr)
         if device is None:
             log.error("Cannot send to unregistered device address {devaddr}",
                      devaddr=devaddrString(devaddr))
@@ -630,7 +819,7 @@ class NetServer(object):
             returnValue(None)
             
         # Get the associated application
-        app = yield Application.find(where=['appeui = ?', device.appeui], limit=1)
+        app = yield applicationCache.get(device.appeui)
         if app is None:
             log.error("Inbound application message for {deveui} - "
                 "AppEUI {appeui} does not match any configured applications.",
@@ -644,20 +833,27 @@ class NetServer(object):
                      "{devaddr}.", devaddr=devaddrString(device.devaddr))
             returnValue(None)
 
-        # Increment fcntdown
-        fcntdown = device.fcntdown + 1
-                
-        # Piggyback any queued MAC messages in fopts 
-        fopts = ''
+        # Check a receive window can still be reached
         device.rx = self.band.rxparams((device.tx_chan, device.tx_datr), join=False)
+        windows = self.budget.windows(gateway.host,
+                                      getattr(device, 'arrival', None),
+                                      device.rx)
+        if not windows:
+            log.info("Inbound message to {devaddr} missed the receive "
+                     "windows.", devaddr=devaddrString(device.devaddr))
+            returnValue(None)
+
+        # Piggyback any queued MAC messages in fopts. Commands are
+        # removed from the queue once the downlink is scheduled.
+        fopts = ''
+        sent = 0
         if self.config.macqueueing:
-            # Get all of this device's queued commands: this returns a list of tuples (index, command)
-            commands = [(i,c[2]) for i,c in enumerate(self.commands) if device.deveui == c[1]]
-            for (index, command) in commands:
-                # Check if we can accommodate the command. If so, encode and remove from the queue
+            # Get this device's queued commands, oldest first
+            for command in self.commands.commands(device.deveui):
+                # Check if we can accommodate the command. If so, encode it
                 if self.band.checkAppPayloadLen(device.rx[1]['datr'], len(fopts) + len(appdata)):
                     fopts += command.encode()
-                    del self.commands[index]
+                    sent += 1
                 else:
                     break
         
@@ -677,15 +873,22 @@ class NetServer(object):
         request = GatewayMessage(gatewayEUI=gateway.eui, remote=(gateway.host,
                                          gateway.port))
         
-        # Save the frame count down
-        device.update(fcntdown=fcntdown)
-
-        # Send RX1 window message
-        self.lora.sendPullResponse(request, txpk[1])
-        # If Class A, send the RX2 window message
-        self.lora.sendPullResponse(request, txpk[2])
+        # Select the first receive window that is free
+        window = self.lora.scheduler.select(gateway.host, txpk, windows)
+        if window is None:
+            log.info("Inbound message to {devaddr} collides with scheduled "
+                     "downlinks.", devaddr=devaddrString(device.devaddr))
+            returnValue(None)
+        
+        # Remove the piggybacked commands from the queue, and save the
+        # frame count down
+        if sent:
+            self.commands.popleft(device.deveui, sent)
+        self.devices.update(device, fcntdown=device.fcntdown + 1)
+        
+        self.lora.scheduler.commit(request, txpk[window], window,
+                                   getattr(device, 'arrival', None), device.rx)
     
-    @inlineCallbacks
     def _processJoinRequest(self, message, app, device):
         """Process an OTA Join Request message from a LoraWAN device
         
@@ -706,24 +909,27 @@ class NetServer(object):
         if not device.checkDevNonce(message):
             log.info("Join request message from {deveui} failed message "
                     "devnonce check.", deveui=euiString(message.deveui))
-            returnValue(False)
+            return False
             
         # Perform message integrity check.
         if not message.checkMIC(app.appkey):
             log.info("Message from {deveui} failed message "
                     "integrity check.", deveui=euiString(message.deveui))
-            returnValue(False)
+            return False
         
-        # Assign DevEUI, NwkSkey and AppSKey.
+        # Assign DevEUI, NwkSkey and AppSKey. Evict the previous
+        # session's ciphers.
+        cipherCache.evict(device.nwkskey, device.appskey)
         device.appeui = app.appeui
         device.nwkskey = self._createSessionKey(1, app, message)
         device.appskey = self._createSessionKey(2, app, message)
         
         # If required, obtain a OTA devaddr for the device
         if device.devaddr is None:
-            device.devaddr = yield self._getFreeOTAAddress()
+            device.devaddr = self._getFreeOTAAddress()
+        self.unknownaddrs.discard(device.devaddr)
             
-        returnValue(device.devaddr is not None)
+        return device.devaddr is not None
     
     def _sendJoinResponse(self, request, rxpk, gateway, app, device):
         """Send a join response message
@@ -749,25 +955,33 @@ class NetServer(object):
         data = response.encode()
         
         txpk = self._txpkResponse(device, data, gateway, rxpk.tmst)
-        # Send the RX1 window messages
-        self.lora.sendPullResponse(request, txpk[1])
-        # Send the RX2 window message
-        self.lora.sendPullResponse(request, txpk[2])
+        # Schedule the first receive window that can be received
+        windows = self.budget.windows(gateway.host, request.arrival, device.rx)
+        if not windows:
+            log.info("Join response for devaddr {devaddr} missed the "
+                     "receive windows.", devaddr=devaddrString(device.devaddr))
+        elif self.lora.scheduler.schedule(request, txpk, windows,
+                request.arrival, device.rx) is None:
+            log.info("Join response for devaddr {devaddr} collides with "
+                     "scheduled downlinks.",
+                     devaddr=devaddrString(device.devaddr))
         
-    def _processLinkCheckReq(self, device, command, request, lsnr):
+    def _processLinkCheckReq(self, device, command, lsnr, gwcnt=1):
         """Process a link check request
         
+        The LinkCheckAns is queued, or scheduled in a receive window of
+        the uplink that carried the request.
+        
         Args:
             device (Device): Sending device
             command (LinkCheckReq): LinkCheckReq object
+            lsnr (float): Best reception SNR
+            gwcnt (int): Number of gateways that received the request
         """
         # We assume 'margin' corresponds to the
         # absolute value of LNSR, as an integer.
         # Set to zero if negative.
         margin = max (0, round(lsnr))
-        # If we are processing the first request,
-        # gateway count must be one, we guess.
-        gwcnt = 1
 
         # Create the LinkCheckAns response and encode. Set fcntdown
         command = LinkCheckAns(margin=margin, gwcnt=gwcnt)
@@ -798,16 +1012,31 @@ class NetServer(object):
                      devaddr=devaddrString(device.devaddr))
             return
         
-        # Create GatewayMessage and Txpk objects, send immediately
+        # Check a receive window can still be reached
+        device.rx = self.band.rxparams((device.tx_chan, device.tx_datr), join=False)
+        arrival = getattr(device, 'arrival', None)
+        windows = self.budget.windows(gateway.host, arrival, device.rx)
+        if not windows:
+            log.info("Link check answer to {devaddr} missed the receive "
+                     "windows.", devaddr=devaddrString(device.devaddr))
+            return
+        
+        # Create GatewayMessage and Txpk objects, and select a free window
         request = GatewayMessage(version=1, token=0, remote=(gateway.host, gateway.port))
-        device.rx = self.band.rxparams((device.tx_chan, device.tx_datr))
-        txpk = self._txpkResponse(device, data, gateway, immediate=True)
+        txpk = self._txpkResponse(device, data, gateway, itmst=int(device.tmst),
+                                  immediate=False)
+        window = self.lora.scheduler.select(gateway.host, txpk, windows)
+        if window is None:
+            log.info("Link check answer to {devaddr} collides with "
+                     "scheduled downlinks.",
+                     devaddr=devaddrString(device.devaddr))
+            return
         
         # Update the device fcntdown
-        device.update(fcntdown=fcntdown)
+        self.devices.update(device, fcntdown=fcntdown)
         
-        # Send the RX2 window message
-        self.lora.sendPullResponse(request, txpk[2])
+        self.lora.scheduler.commit(request, txpk[window], window, arrival,
+                                   device.rx)
     
     def _createLinkADRRequest(self, device):
         """Create a Link ADR Request message
@@ -824,7 +1053,6 @@ class NetServer(object):
         command = LinkADRReq(datarate, 0, chmask, 6, 0)
         return command
     
-    @inlineCallbacks
     def _sendLinkADRRequest(self, device, command):
         """Send a Link ADR Request message
         
@@ -854,7 +1082,7 @@ class NetServer(object):
             log.info("Could not find gateway for gateway {gw_addr} for device "
                      "{devaddr}", gw_addr=device.gw_addr,
                      devaddr=devaddrString(device.devaddr))
-            returnValue(None)
+            return
         
         # Create GatewayMessage and Txpk objects, send immediately
         request = GatewayMessage(version=1, token=0, remote=(gateway.host, gateway.port))
@@ -862,10 +1090,11 @@ class NetServer(object):
         txpk = self._txpkResponse(device, data, gateway, immediate=True)
         
         # Update the device fcntdown
-        device.update(fcntdown=fcntdown)
+        self.devices.update(device, fcntdown=fcntdown)
         
-        # Send the RX2 window message
-        self.lora.sendPullResponse(request, txpk[2])
+        # Send the RX2 window message, committing its airtime to the
+        # gateway's timeline
+        self.lora.scheduler.sendImmediate(request, txpk[2])
         
     def _processLinkADRAns(self, device, command):
         """Process a link ADR answer
@@ -881,3 +1110,20 @@ class NetServer(object):
         log.info("Received LinkADRAns from device {devaddr}",
                  devaddr=devaddrString(device.devaddr))
 
+    def _processMACCommandAns(self, device, command):
+        """Process a MAC command answer that requires no action
+        
+        Args:
+            device (Device): Sending device
+            command (MACCommand): MAC command answer object
+        """
+        if isinstance(command, DevStatusAns):
+            log.info("Received DevStatusAns from device {devaddr}: "
+                     "battery {battery}, margin {margin}",
+                     devaddr=devaddrString(device.devaddr),
+                     battery=command.battery, margin=command.margin)
+            return
+        log.info("Received {command} from device {devaddr}",
+                 command=command.__class__.__name__,
+                 devaddr=devaddrString(device.devaddr))
+
@@ -0,0 +1,6 @@
+#TODO: add some useful description
+"""Placeholder
+"""
+pass
+
+
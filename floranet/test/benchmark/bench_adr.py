@@ -0,0 +1,47 @@
+"""ADR SNR store benchmarks.
+
+Run with the project directory in PYTHONPATH:
+    python -m floranet.test.benchmark.bench_adr
+"""
+import sys
+import time
+import random
+
+import floranet.adr as adr
+from floranet.adr import SNRStore, targetIndices
+
+def listBytes(width=11):
+    """Size of one device's SNR list of width floats, and its average"""
+    readings = [random.uniform(-20.0, 10.0) for i in range(width)]
+    return sys.getsizeof(readings) + sum(sys.getsizeof(r) for r in readings) \
+           + sys.getsizeof(sum(readings) / width)
+
+def benchMemory(devices=1000000):
+    """Compare SNR memory for devices"""
+    store = SNRStore(capacity=devices)
+    for deveui in xrange(devices):
+        store.add(deveui, 0.0)
+    print "SNR memory, {} devices, {} backend".format(
+        devices, 'numpy' if adr.numpy is not None else 'array')
+    print "  Lists            {:.1f} MB".format(listBytes() * devices / 1e6)
+    print "  SNRStore arrays  {:.1f} MB".format(store.nbytes() / 1e6)
+    print "  SNRStore slots   {:.1f} MB".format(sys.getsizeof(store.slots) / 1e6)
+    return store
+
+def benchTargets(store, margin=0.0):
+    """Measure a batch target calculation for every device"""
+    deveuis = list(store.slots)
+    for deveui in deveuis[:100000]:
+        for i in range(6):
+            store.add(deveui, random.uniform(-20.0, 10.0))
+    start = time.time()
+    (valid, averages) = store.averages(deveuis)
+    indices = targetIndices(averages, margin)
+    elapsed = time.time() - start
+    print "ADR targets, {} devices, {} with averages".format(len(deveuis),
+                                                            len(valid))
+    print "  {:.3f} s".format(elapsed)
+
+if __name__ == '__main__':
+    store = benchMemory()
+    benchTargets(store)
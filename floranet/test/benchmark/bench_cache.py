@@ -0,0 +1,51 @@
+"""Uplink de-duplication cache benchmarks.
+
+Run with the project directory in PYTHONPATH:
+    python -m floranet.test.benchmark.bench_cache
+"""
+import time
+
+from floranet.cache import DuplicateCache
+
+def legacyCheck(cache, period, mic, mark):
+    """List scan de-duplication check"""
+    duplicate = next((True for e in cache if e[0] == mic and
+                      e[1] + period > mark), False)
+    if not duplicate:
+        cache.append((mic, mark))
+    return duplicate
+
+def benchDuplicateCache(rate=10000, period=60, seconds=120):
+    """Simulate rate uplinks/s for seconds, with one duplicate per uplink
+    
+    The cache reaches its steady state size of rate * period entries
+    after period seconds.
+    """
+    cache = DuplicateCache(period)
+    start = time.time()
+    for n in xrange(rate * seconds):
+        mark = n / float(rate)
+        key = (n & 0xFFFFFFFF, n & 0xFFFF, n)
+        cache.check(key, mark)
+        cache.check(key, mark)
+    elapsed = time.time() - start
+    print "DuplicateCache, {} uplinks/s, {} s window".format(rate, period)
+    print "  {:.0f} checks/s, {} entries".format(rate * seconds * 2 / elapsed,
+                                                   len(cache))
+    print "  {}".format(cache.stats())
+
+def benchLegacy(rate=10000, period=60, number=200):
+    """Measure the list scan check at the steady state size"""
+    size = rate * period
+    cache = [(n, n / float(rate)) for n in xrange(size)]
+    mark = size / float(rate)
+    start = time.time()
+    for n in xrange(number):
+        legacyCheck(cache, period, size + n, mark)
+    elapsed = time.time() - start
+    print "List scan, {} entries".format(size)
+    print "  {:.0f} checks/s".format(number / elapsed)
+
+if __name__ == '__main__':
+    benchDuplicateCache()
+    benchLegacy()
@@ -0,0 +1,43 @@
+"""Application interface lookup benchmarks.
+
+Run with the project directory in PYTHONPATH:
+    python -m floranet.test.benchmark.bench_imanager
+"""
+import timeit
+
+from twistar.registry import Registry
+
+from floranet.imanager import InterfaceManager
+from floranet.models.appinterface import AppInterface
+from floranet.models.application import Application
+from floranet.appserver.reflector import Reflector
+
+def legacyGetInterface(interfaces, appinterface_id):
+    """Interface list scan"""
+    return next((i for i in interfaces if
+                 i.appinterface.id == int(appinterface_id)), None)
+
+def benchInterfaceLookup(count=500, number=20000):
+    """Compare uplink interface lookup for count interfaces"""
+    Registry.getConfig = staticmethod(lambda: None)
+    interfaces = []
+    for n in xrange(count):
+        interface = Reflector(id=n, name='Reflector {}'.format(n))
+        interface.appinterface = AppInterface(id=n)
+        interfaces.append(interface)
+    manager = InterfaceManager()
+    manager.interfaces = interfaces
+    # The last interface is the worst case for the list scan
+    app = Application(appeui=1, appinterface_id=count - 1)
+
+    print "Interface lookup, {} interfaces".format(count)
+    for (name, f) in (
+            ('List scan', lambda: legacyGetInterface(interfaces,
+                                                     app.appinterface_id)),
+            ('getInterface', lambda: manager.getInterface(app.appinterface_id)),
+            ('getAppInterface', lambda: manager.getAppInterface(app))):
+        elapsed = timeit.timeit(f, number=number)
+        print "  {:16s} {:.2f} us".format(name, elapsed / number * 1e6)
+
+if __name__ == '__main__':
+    benchInterfaceLookup()
@@ -0,0 +1,64 @@
+"""LoRa MAC message benchmarks.
+
+Run with the project directory in PYTHONPATH:
+    python -m floranet.test.benchmark.bench_mac
+"""
+import struct
+import timeit
+
+import floranet.lora.mac as lora_mac
+from floranet.lora.crypto import aesEncrypt
+from floranet.util import intPackBytes
+
+APPSKEY = int('0x7987A96F267F0A86B739EED480FC2B3C', 16)
+DEVADDR = int('0x06100000', 16)
+
+def legacyEncrypt(message, key, dir):
+    """Per-block FRMPayload encryption, as implemented prior to
+    MACDataMessage.encrypt building the keystream in a single call.
+    """
+    plen = len(message.payload.frmpayload)
+    k = (plen + 15) // 16
+    S = ''
+    for i in range(k):
+        Ai = struct.pack('<BLBLLBB', 1, 0, dir, message.payload.fhdr.devaddr,
+                         message.payload.fhdr.fcnt, 0, i+1)
+        S += aesEncrypt(intPackBytes(key, 16), Ai)
+    padlen = k * 16 - plen
+    padded = message.payload.frmpayload + intPackBytes(0, padlen)
+    ufmt = '{}Q'.format(k*2)
+    s = struct.unpack(ufmt, S)
+    p = struct.unpack(ufmt, padded)
+    pld = ''
+    for i in range (len(s)):
+        pld += struct.pack('Q', s[i] ^ p[i])
+    message.payload.frmpayload = pld[:plen]
+
+def downlink(size):
+    """Create a downlink message with a frmpayload of size bytes"""
+    return lora_mac.MACDataDownlinkMessage(DEVADDR, APPSKEY, 1, False, '',
+                                           15, 'x' * size)
+
+def benchEncrypt(number=2000):
+    """Compare legacy and current FRMPayload encryption"""
+    print "FRMPayload encryption, {} iterations (usec per call)".format(number)
+    print "{:>6} {:>10} {:>10} {:>8}".format('size', 'legacy', 'current',
+                                             'speedup')
+    for size in (16, 51, 115, 242):
+        m = downlink(size)
+        # Check the implementations agree
+        legacyEncrypt(m, APPSKEY, 1)
+        expected = m.payload.frmpayload
+        m = downlink(size)
+        m.encrypt(APPSKEY)
+        assert m.payload.frmpayload == expected
+        
+        legacy = timeit.timeit(lambda: legacyEncrypt(m, APPSKEY, 1),
+                               number=number) / number * 1e6
+        current = timeit.timeit(lambda: m.encrypt(APPSKEY),
+                                number=number) / number * 1e6
+        print "{:>6} {:>10.1f} {:>10.1f} {:>7.1f}x".format(size, legacy,
+                                                  current, legacy / current)
+
+if __name__ == '__main__':
+    benchEncrypt()
@@ -0,0 +1,123 @@
+"""Gateway message decode, encode and gateway lookup benchmarks.
+
+Run with the project directory in PYTHONPATH:
+    python -m floranet.test.benchmark.bench_wan
+"""
+import base64
+import json
+import sys
+import timeit
+from collections import OrderedDict
+
+import floranet.lora.wan as lora_wan
+import floranet.lora.mac as lora_mac
+from twistar.registry import Registry
+from floranet.models.gateway import Gateway
+
+GATEWAY = ('192.168.1.125', 56035)
+HEADER = '\x01\xb2\xc4\x00\x00\x80\x00\x00\x00\x00\xa3\xf9'
+FRAME = base64.b64decode('QAAAEAaCAgADBw9dMFcf9Q==')
+
+def pushData(count):
+    """Create a PUSH_DATA datagram carrying count rxpk objects"""
+    rxpk = {"tmst": 2072854188, "time": "2016-09-06T21:02:05.128290Z",
+            "chan": 0, "rfch": 0, "freq": 915.2, "stat": 1, "modu": "LORA",
+            "datr": "SF10BW125", "codr": "4/5", "lsnr": 8.5, "rssi": -24,
+            "size": len(FRAME), "data": base64.b64encode(FRAME)}
+    return HEADER + json.dumps({'rxpk': [rxpk] * count})
+
+def footprint(obj, seen=None):
+    """Sum the size of obj and the gateway and MAC objects it references.
+    
+    Counts each object, its __dict__ if it has one, and the values held
+    in its attributes.
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple)):
+        return size + sum(footprint(o, seen) for o in obj)
+    if not type(obj).__module__.startswith('floranet'):
+        return size
+    names = set()
+    for cls in type(obj).__mro__:
+        names.update(getattr(cls, '__slots__', ()))
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+        names.update(obj.__dict__.keys())
+    for name in names:
+        try:
+            value = object.__getattribute__(obj, name)
+        except AttributeError:
+            continue
+        size += footprint(value, seen)
+    return size
+
+def decode(data):
+    """Decode a PUSH_DATA datagram and its MAC frames"""
+    m = lora_wan.GatewayMessage.decode(data, GATEWAY)
+    return (m, [lora_mac.MACMessage.decode(r.data) for r in m.rxpk])
+
+def benchDecode(number=5000):
+    """Measure per-packet memory and decode throughput"""
+    print "PUSH_DATA decode, best of 5 x {} iterations".format(number)
+    print "{:>6} {:>14} {:>14} {:>12}".format('rxpk', 'bytes/datagram',
+                                              'bytes/frame', 'frames/s')
+    for count in (1, 8):
+        data = pushData(count)
+        (m, frames) = decode(data)
+        mem = footprint(m) + footprint(frames)
+        frame = footprint(frames[0]) + footprint(m.rxpk[0])
+        elapsed = min(timeit.repeat(lambda: decode(data), repeat=5,
+                                    number=number))
+        print "{:>6} {:>14} {:>14} {:>12.0f}".format(count, mem, frame,
+                                                      number * count / elapsed)
+
+def legacyEncode(txpk):
+    """Txpk encode using an OrderedDict and json.dumps"""
+    jd = {'txpk': OrderedDict()}
+    for key in txpk.__slots__:
+        val = getattr(txpk, key)
+        if val is not None:
+            jd['txpk'][key] = val
+    return json.dumps(jd, separators=(',', ':'))
+
+def benchEncode(number=20000):
+    """Compare the template Txpk encode with the legacy encode"""
+    txpk = lora_wan.Txpk(tmst=44995444, freq=927.5, rfch=0, powe=26,
+                         modu='LORA', datr='SF10BW500', codr='4/5',
+                         ipol=True, data=FRAME, ncrc=False)
+    assert txpk.encode() == legacyEncode(txpk)
+    print "Txpk encode, best of 5 x {} iterations".format(number)
+    for (name, f) in (('legacy', legacyEncode), ('template', lora_wan.Txpk.encode)):
+        elapsed = min(timeit.repeat(lambda: f(txpk), repeat=5, number=number))
+        print "{:>10} {:>12.0f} txpk/s".format(name, number / elapsed)
+
+def benchGatewayLookup(count=5000, number=20000):
+    """Compare the indexed gateway lookup with a linear scan"""
+    # Gateway objects are created without a database connection
+    Registry.getConfig = staticmethod(lambda: None)
+    lora = lora_wan.LoraWAN(None)
+    gateways = []
+    for i in range(count):
+        g = Gateway(host='10.{}.{}.{}'.format(i >> 16, (i >> 8) & 0xFF, i & 0xFF),
+                    name='Bench', eui=i, enabled=True, power=26)
+        gateways.append(g)
+        lora.addGateway(g)
+    # Worst case for the scan is the last gateway added
+    host = gateways[-1].host
+    scan = lambda: next((g for g in gateways if g.host == host), None)
+    print "Gateway lookup, {} gateways, best of 5 x {} iterations".format(
+        count, number)
+    for (name, f) in (('scan', scan), ('host', lambda: lora.gateway(host)),
+                      ('eui', lambda: lora.gatewayByEUI(count - 1))):
+        elapsed = min(timeit.repeat(f, repeat=5, number=number))
+        print "{:>10} {:>12.3f} us/lookup".format(name, elapsed / number * 1e6)
+
+if __name__ == '__main__':
+    print "JSON backend: {}".format(lora_wan.jsonBackend)
+    benchDecode()
+    benchEncode()
+    benchGatewayLookup()
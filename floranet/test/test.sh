@@ -16,3 +16,10 @@ done
 
 # Run the integration tests
 # (cd /tmp; trial -x floranet.test.integration)
+
+# Run the benchmarks
+# (cd /tmp; python -m floranet.test.benchmark.bench_mac)
+# (cd /tmp; python -m floranet.test.benchmark.bench_wan)
+# (cd /tmp; python -m floranet.test.benchmark.bench_cache)
+# (cd /tmp; python -m floranet.test.benchmark.bench_imanager)
+# (cd /tmp; python -m floranet.test.benchmark.bench_adr)
@@ -0,0 +1,177 @@
+from twisted.trial import unittest
+from mock import patch, MagicMock
+
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import Clock
+
+from twistar.registry import Registry
+
+import floranet.adr as adr
+from floranet.adr import SNRStore, ADREngine, targetIndices
+from floranet.netserver import NetServer
+from floranet.models.model import Model, updateBuffer
+from floranet.models.config import Config
+from floranet.models.device import Device
+from floranet.models.gateway import Gateway
+from floranet.lora.wan import LoraWAN
+from floranet.lora.bands import US915
+
+class SNRStoreTest(unittest.TestCase):
+    """Test SNRStore class, with and without numpy"""
+
+    def _backends(self):
+        """Yield for each available array backend"""
+        yield
+        with patch.object(adr, 'numpy', None):
+            yield
+
+    def test_add(self):
+        """Test running averages over the ring buffer"""
+        expected = [[None] * 5 + [3.5, 4.5, 5.5, 6.5, 7.5, 8.5, 9.5, 10.5],
+                    [3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 9.0, 10.0, 11.0,
+                     12.0, 13.0]]
+
+        for i in self._backends():
+            store = SNRStore(capacity=1)
+            result = [store.add(1, v) for v in range(1, 14)]
+            result = [result, store.readings(1)]
+
+            self.assertEqual(expected, result)
+
+    def test_averages(self):
+        """Test averages method and slot reuse"""
+        expected = [[2, 3], [2.0, 2.1], 0.0, True]
+
+        for i in self._backends():
+            store = SNRStore(capacity=1)
+            for (deveui, v) in ((1, 1.0), (2, 2.0), (3, 2.1)):
+                for n in range(6 if deveui > 1 else 5):
+                    store.add(deveui, v)
+            (deveuis, averages) = store.averages([1, 2, 3, 4])
+            result = [deveuis, list(averages)]
+            slot = store.slots[1]
+            store.remove(1)
+            store.load(4, [0.0] * 6)
+            result += [store.average(4), store.slots[4] == slot]
+
+            self.assertEqual(expected, result)
+
+class ADREngineTest(unittest.TestCase):
+
+    @inlineCallbacks
+    def setUp(self):
+        """Test setup. Creates a NetServer with ADR requests sent
+        directly, using a fake reactor clock."""
+        Registry.getConfig = MagicMock(return_value=None)
+        with patch.object(Model, 'save', MagicMock()):
+            config = yield Config.loadFactoryDefaults()
+        config.macqueueing = False
+        self.server = NetServer(config)
+        self.server._sendLinkADRRequest = MagicMock()
+        self.clock = Clock()
+        self.patcher = patch.object(adr, 'reactor', self.clock)
+        self.patcher.start()
+
+    def tearDown(self):
+        """Test teardown"""
+        self.patcher.stop()
+        updateBuffer.pending.clear()
+
+    def _test_device(self, n, gw_addr='192.168.1.125'):
+        """Create a test device"""
+        device = Device(deveui=n, devaddr=0x06000000 + n, adr=True,
+                        tx_datr='SF10BW125', adr_datr=None,
+                        gw_addr=gw_addr, enabled=True)
+        self.server.devices.add(device)
+        return device
+
+    def _updateSNR(self, device, lsnr):
+        """Add six SNR readings for device"""
+        for i in range(6):
+            self.server.adr.updateSNR(device, lsnr)
+
+    def test_targetIndices(self):
+        """Test targetIndices function"""
+        expected = [0, 0, 1, 1, 3]
+        averages = [-5.0, 0.0, 3.0, 5.9, 20.0]
+
+        result = targetIndices(averages, 0.0)
+        self.assertEqual(expected, result)
+
+        with patch.object(adr, 'numpy', None):
+            result = targetIndices(averages, 0.0)
+        self.assertEqual(expected, result)
+
+    def test_targetIndices_datarates(self):
+        """Test target indices map to the band data rates"""
+        band = US915()
+        expected = ['SF10BW125', 'SF9BW125', 'SF8BW125', 'SF7BW125', 'SF7BW125']
+
+        result = [band.datarate[i] for i in
+                  targetIndices([t * 3 + 0.1 for t in range(5)], 0.0)]
+
+        self.assertEqual(expected, result)
+
+    def test_process(self):
+        """Test process method handles only dirty devices"""
+        devices = [self._test_device(n) for n in range(3)]
+        # Device 2 is already at its target
+        devices[2].tx_datr = 'SF9BW125'
+        expected = [2, ['SF9BW125', 'SF9BW125', 'SF9BW125', None], 0]
+
+        for d in devices:
+            self._updateSNR(d, 3.5)
+        unmarked = self._test_device(3)
+        result = [self.server.adr.process(),
+                  [d.adr_datr for d in devices + [unmarked]],
+                  self.server.adr.process()]
+
+        self.assertEqual(expected, result)
+
+    def test_pacing(self):
+        """Test requests are paced per gateway"""
+        self.server.config.adrmessagetime = 10
+        devices = [self._test_device(n, gw) for (n, gw) in
+                   ((0, 'a'), (1, 'a'), (2, 'b'))]
+        send = self.server._sendLinkADRRequest
+        expected = [2, 3, 3, {'dirty': 0, 'queued': 0, 'gateways': 0,
+                              'sent': 3}]
+
+        for d in devices:
+            self._updateSNR(d, 3.5)
+        self.server.adr.process()
+        self.clock.advance(0)
+        result = [send.call_count]
+        self.clock.advance(10)
+        result.append(send.call_count)
+        # No further sends are required
+        self.clock.advance(10)
+        result += [send.call_count, self.server.adr.stats()]
+
+        self.assertEqual(expected, result)
+
+    def test_send(self):
+        """Test queued requests are sent by the network server"""
+        self.server.config.adrmessagetime = 10
+        del self.server._sendLinkADRRequest
+        self.server.lora = LoraWAN(self.server)
+        self.server.lora.addGateway(Gateway(host='192.168.1.125', eui=1,
+                                            port=1700, power=26, enabled=True))
+        devices = [self._test_device(n) for n in range(2)]
+        expected = [1, 1, 2, 2, {'dirty': 0, 'queued': 0, 'gateways': 0,
+                                 'sent': 2}]
+
+        with patch.object(self.server.lora, 'sendPullResponse') as send:
+            for d in devices:
+                d.nwkskey = 0xAEB48D4C6E9EA5C48C37E4F132AA8516
+                d.fcntdown = 0
+                d.tx_chan = 3
+                self._updateSNR(d, 3.5)
+            self.server.adr.process()
+            self.clock.advance(0)
+            result = [send.call_count, devices[0].fcntdown]
+            self.clock.advance(10)
+            result += [send.call_count, devices[0].fcntdown + devices[1].fcntdown,
+                       self.server.adr.stats()]
+
+        self.assertEqual(expected, result)
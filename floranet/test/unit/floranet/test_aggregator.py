@@ -0,0 +1,85 @@
+from twisted.trial import unittest
+from twisted.internet.task import Clock
+from mock import patch, MagicMock
+
+from twistar.registry import Registry
+
+from floranet.lora.wan import Rxpk
+from floranet.models.gateway import Gateway
+import floranet.aggregator as aggregator
+
+class ReceptionAggregatorTest(unittest.TestCase):
+    """Test ReceptionAggregator class"""
+
+    def setUp(self):
+        """Test setup. Creates an aggregator using a fake reactor clock"""
+        Registry.getConfig = MagicMock(return_value=None)
+        self.clock = Clock()
+        self.patcher = patch.object(aggregator, 'reactor', self.clock)
+        self.patcher.start()
+        self.callback = MagicMock()
+        self.aggregator = aggregator.ReceptionAggregator(0.2, self.callback)
+
+    def tearDown(self):
+        """Test teardown"""
+        self.patcher.stop()
+
+    def _reception(self, host, lsnr, rssi):
+        """Create a (request, gateway, rxpk) reception"""
+        return (None, Gateway(host=host), Rxpk(lsnr=lsnr, rssi=rssi))
+
+    def test_aggregation(self):
+        """Test receptions are collected and ranked"""
+        key = (0x06000001, 1, 1111)
+        expected = [[False, True, True, False], ['gw2', 'gw3', 'gw1']]
+
+        collected = [self.aggregator.collect(key, self._reception('gw1', 1.0, -90))]
+        self.aggregator.open(key, 'message', self._reception('gw1', 1.0, -90))
+        self.clock.advance(0.1)
+        collected.append(self.aggregator.collect(key, self._reception('gw2', 7.5, -100)))
+        collected.append(self.aggregator.collect(key, self._reception('gw3', 7.5, -110)))
+        self.clock.advance(0.1)
+        collected.append(self.aggregator.collect(key, self._reception('gw4', 9.0, -80)))
+        (message, receptions) = self.callback.call_args[0]
+        result = [collected, [r[1].host for r in receptions]]
+
+        self.assertEqual(expected, result)
+        self.assertEqual(1, self.callback.call_count)
+
+    def test_collect_gateway(self):
+        """Test a gateway contributes one reception per frame"""
+        key = (0x06000001, 1, 1111)
+        expected = [('gw2', 6.0), ('gw1', 2.0)]
+
+        self.aggregator.open(key, 'message', self._reception('gw1', 1.0, -90))
+        for (host, lsnr) in (('gw2', 6.0), ('gw1', 2.0), ('gw2', 4.0)):
+            self.aggregator.collect(key, self._reception(host, lsnr, -90))
+        self.clock.advance(0.2)
+        (message, receptions) = self.callback.call_args[0]
+        result = [(r[1].host, r[2].lsnr) for r in receptions]
+
+        self.assertEqual(expected, result)
+
+    def test_stats(self):
+        """Test aggregation statistics"""
+        expected = {'open': 1, 'closed': 2, 'receptions': 3,
+                    'maxgateways': 2, 'meangateways': 1.5}
+
+        for n in (1, 2):
+            self.aggregator.open(n, 'message', self._reception('gw1', 0, 0))
+            if n == 2:
+                self.aggregator.collect(n, self._reception('gw2', 0, 0))
+            self.clock.advance(0.2)
+        self.aggregator.open(3, 'message', self._reception('gw1', 0, 0))
+        result = self.aggregator.stats()
+
+        self.assertEqual(expected, result)
+
+    def test_stop(self):
+        """Test stop discards the open frames"""
+        self.aggregator.open(1, 'message', self._reception('gw1', 0, 0))
+        self.aggregator.stop()
+        self.clock.advance(1)
+
+        self.assertEqual(0, len(self.aggregator))
+        self.assertFalse(self.callback.called)
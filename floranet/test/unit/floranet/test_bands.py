@@ -0,0 +1,46 @@
+from twisted.trial import unittest
+
+from floranet.lora.bands import US915, AU915, EU868
+
+class LoraBandTest(unittest.TestCase):
+    """Test LoraBand receive window tables"""
+
+    def test_rxparams(self):
+        """Test table lookups match the calculated parameters"""
+        for band in (US915(), AU915(), EU868()):
+            for txch in range(len(band.upstream)):
+                for txdr in band.datarate_rev:
+                    for join in (False, True):
+                        expected = band._rxparams(txch, txdr, join)
+                        result = band.rxparams((txch, txdr), join)
+                        self.assertEqual(expected, result)
+
+    def test_rxparams_interned(self):
+        """Test the same parameters are returned for repeated lookups"""
+        band = US915()
+
+        result = band.rxparams((3, 'SF7BW125'))
+
+        self.assertIs(band.rxparams((3, 'SF7BW125'), join=False), result)
+
+    def test_rx1droffset(self):
+        """Test setting rx1droffset rebuilds the tables"""
+        band = US915()
+        expected = [13, 12]
+
+        result = [band.rxparams((3, 'SF7BW125'))[1]['index']]
+        band.rx1droffset = 1
+        result.append(band.rxparams((3, 'SF7BW125'))[1]['index'])
+
+        self.assertEqual(expected, result)
+
+    def test_checkAppPayloadLen(self):
+        """Test checkAppPayloadLen method"""
+        band = EU868()
+        expected = [True, False, True]
+
+        result = [band.checkAppPayloadLen('SF12BW125', 51),
+                  band.checkAppPayloadLen('SF12BW125', 52),
+                  band.checkAppPayloadLen('SF7BW125', 242)]
+
+        self.assertEqual(expected, result)
@@ -0,0 +1,262 @@
+from twisted.trial import unittest
+from mock import patch, MagicMock
+
+from twisted.internet.defer import inlineCallbacks
+
+from twistar.registry import Registry
+
+import time
+
+from floranet.cache import DuplicateCache, NegativeCache, AddressPool, \
+     DeviceCache, FindCache
+from floranet.models.application import Application
+from floranet.models.device import Device
+from floranet.models.model import updateBuffer
+
+class DuplicateCacheTest(unittest.TestCase):
+    """Test DuplicateCache class"""
+
+    def test_check(self):
+        """Test check method within and after the period"""
+        cache = DuplicateCache(10)
+        key = (0x06100000, 33, 1111)
+        expected = [False, True, False, True, False]
+
+        result = [cache.check(key, 100.0), cache.check(key, 105.0),
+                  cache.check((0x06100000, 34, 1111), 105.0),
+                  cache.check(key, 109.9), cache.check(key, 110.0)]
+
+        self.assertEqual(expected, result)
+
+    def test_expire(self):
+        """Test expire method removes entries oldest first"""
+        cache = DuplicateCache(10)
+        expected = [10, 5, 0]
+        result = []
+
+        for i in range(10):
+            cache.check((None, None, i), 100.0 + i)
+        result.append(len(cache))
+        cache.expire(114.5)
+        result.append(len(cache))
+        cache.expire(120.0)
+        result.append(len(cache.queue))
+
+        self.assertEqual(expected, result)
+
+    def test_maxsize(self):
+        """Test the oldest entry is evicted at maxsize"""
+        cache = DuplicateCache(60, maxsize=3)
+        expected = [3, 1, False]
+
+        for i in range(4):
+            cache.check((None, None, i), 100.0)
+        result = [len(cache), cache.evictions,
+                  cache.check((None, None, 0), 100.0)]
+
+        self.assertEqual(expected, result)
+
+    def test_stats(self):
+        """Test stats method"""
+        cache = DuplicateCache(10)
+        expected = {'size': 1, 'hits': 3, 'misses': 1, 'evictions': 0,
+                    'hitrate': 0.75}
+
+        for i in range(4):
+            cache.check((None, None, 1), 100.0)
+        result = cache.stats()
+
+        self.assertEqual(expected, result)
+
+class NegativeCacheTest(unittest.TestCase):
+    """Test NegativeCache class"""
+
+    def test_contains(self):
+        """Test lookups within and after the TTL, and discard"""
+        cache = NegativeCache(10)
+        now = time.time()
+        expected = [True, False, False, False, 1]
+
+        cache.add(1, now - 5)
+        cache.add(2, now - 11)
+        cache.add(3, now)
+        cache.discard(3)
+        result = [1 in cache, 2 in cache, 3 in cache, 4 in cache, cache.hits]
+
+        self.assertEqual(expected, result)
+
+    def test_expire(self):
+        """Test expire method removes expired entries"""
+        cache = NegativeCache(10)
+        expected = [10, 5, 0]
+
+        for i in range(10):
+            cache.add(i, 100.0 + i)
+        result = [len(cache)]
+        cache.expire(114.5)
+        result.append(len(cache))
+        cache.expire(120.0)
+        result.append(len(cache.queue))
+
+        self.assertEqual(expected, result)
+
+class AddressPoolTest(unittest.TestCase):
+    """Test AddressPool class"""
+
+    def test_allocate(self):
+        """Test allocate method skips reserved addresses"""
+        pool = AddressPool(10, 14)
+        expected = [10, 12, 14, None, 0]
+
+        pool.reserve(11)
+        pool.reserve(13)
+        pool.reserve(20)
+        result = [pool.allocate() for n in range(4)] + [len(pool)]
+
+        self.assertEqual(expected, result)
+
+    def test_release(self):
+        """Test released addresses are reused"""
+        pool = AddressPool(10, 12)
+        expected = [11, 10, 12, None]
+
+        for n in range(3):
+            pool.allocate()
+        pool.release(11)
+        pool.release(10)
+        pool.reserve(10)
+        pool.release(10)
+        result = [pool.allocate() for n in range(2)]
+        pool.release(12)
+        result += [pool.allocate(), pool.allocate()]
+
+        self.assertEqual(expected, result)
+
+    def test_reset(self):
+        """Test reset method with a new range"""
+        pool = AddressPool(10, 12)
+        expected = [2, 21, 23]
+
+        pool.reset(20, 24, [10, 20, 22, 24])
+        result = [len(pool), pool.allocate(), pool.allocate()]
+
+        self.assertEqual(expected, result)
+
+class DeviceCacheTest(unittest.TestCase):
+    """Test DeviceCache class"""
+
+    def setUp(self):
+        """Test setup. Creates a DeviceCache with one device"""
+        Registry.getConfig = MagicMock(return_value=None)
+        self.device = Device(deveui=int('0x0F0E0E0D00010209', 16),
+                             devaddr=int('0x06000001', 16),
+                             fcntup=0, fcntdown=0)
+        self.cache = DeviceCache()
+        self.cache.add(self.device)
+        updateBuffer.pending.clear()
+
+    def tearDown(self):
+        """Test teardown. Removes queued updates"""
+        updateBuffer.pending.clear()
+
+    def test_get(self):
+        """Test get and getByEUI methods"""
+        expected = [self.device, self.device, None]
+
+        result = [self.cache.get(self.device.devaddr),
+                  self.cache.getByEUI(self.device.deveui),
+                  self.cache.get(self.device.devaddr + 1)]
+
+        self.assertEqual(expected, result)
+
+    def test_update(self):
+        """Test update method sets attributes and reindexes DevAddr"""
+        devaddr = self.device.devaddr
+        expected = [None, self.device, 5,
+                    {'devaddr': devaddr + 1, 'fcntup': 5}]
+
+        self.cache.update(self.device, fcntup=4)
+        self.cache.update(self.device, devaddr=devaddr + 1, fcntup=5)
+        result = [self.cache.get(devaddr), self.cache.get(devaddr + 1),
+                  self.device.fcntup,
+                  updateBuffer.pending[('devices', self.device.id)][1]]
+
+        self.assertEqual(expected, result)
+
+    def test_refresh(self):
+        """Test refresh method applies attributes to the cached device,
+        and discards the queued values they replace"""
+        devaddr = self.device.devaddr
+        expected = [None, self.device, {'fcntup': 1}]
+
+        self.cache.update(self.device, devaddr=devaddr + 2, fcntup=1)
+        self.cache.refresh(self.device.deveui, devaddr=devaddr + 1)
+        result = [self.cache.get(devaddr), self.cache.get(devaddr + 1),
+                  updateBuffer.pending[('devices', self.device.id)][1]]
+
+        self.assertEqual(expected, result)
+
+    def test_remove(self):
+        """Test remove method discards queued updates"""
+        expected = [0, None, 0]
+
+        self.cache.update(self.device, fcntup=1)
+        self.cache.remove(self.device.deveui)
+        result = [len(self.cache), self.cache.get(self.device.devaddr),
+                  len(updateBuffer)]
+
+        self.assertEqual(expected, result)
+
+    def test_pool(self):
+        """Test device addresses are reserved in the address pool"""
+        pool = AddressPool(self.device.devaddr, self.device.devaddr + 1)
+        cache = DeviceCache(pool)
+        expected = [self.device.devaddr + 1, None, self.device.devaddr]
+
+        cache.add(self.device)
+        result = [pool.allocate(), pool.allocate()]
+        cache.remove(self.device.deveui)
+        result.append(pool.allocate())
+
+        self.assertEqual(expected, result)
+
+class FindCacheTest(unittest.TestCase):
+    """Test FindCache class"""
+
+    def setUp(self):
+        """Test setup. Creates an Application FindCache"""
+        Registry.getConfig = MagicMock(return_value=None)
+        self.app = Application(appeui=int('0x0A0B0C0D0A0B0C0D', 16))
+        self.cache = FindCache(Application, 'appeui = ?')
+
+    @inlineCallbacks
+    def test_get(self):
+        """Test get method reads through once per key"""
+        appeui = self.app.appeui
+        expected = [self.app, self.app, None, 1, 2]
+
+        with patch.object(Application, 'find',
+                          MagicMock(side_effect=[self.app, None])) as find:
+            result = [(yield self.cache.get(appeui)),
+                      (yield self.cache.get(appeui)),
+                      (yield self.cache.get(appeui + 1))]
+        find.assert_any_call(where=['appeui = ?', appeui], limit=1)
+        result += [self.cache.hits, self.cache.misses]
+
+        self.assertEqual(expected, result)
+
+    @inlineCallbacks
+    def test_invalidate(self):
+        """Test invalidate method forces a new query"""
+        appeui = self.app.appeui
+        expected = [0, 2]
+
+        with patch.object(Application, 'find',
+                          MagicMock(return_value=self.app)) as find:
+            yield self.cache.get(appeui)
+            self.cache.invalidate(appeui)
+            result = [len(self.cache)]
+            yield self.cache.get(appeui)
+        result.append(find.call_count)
+
+        self.assertEqual(expected, result)
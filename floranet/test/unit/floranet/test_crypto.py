@@ -0,0 +1,133 @@
+from twisted.trial import unittest
+
+import struct
+import base64
+
+import floranet.lora.crypto as lora_crypto
+from floranet.util import intPackBytes
+
+# RFC 4493 AES-CMAC test key and message
+CMAC_KEY = '2b7e151628aed2a6abf7158809cf4f3c'.decode('hex')
+CMAC_MSG = ('6bc1bee22e409f96e93d7e117393172a'
+            'ae2d8a571e03ac9c9eb76fac45af8e51'
+            '30c81c46a35ce411e5fbc1191a0a52ef'
+            'f69f2445df4f9b17ad2b417be66c3710').decode('hex')
+
+class CryptoBackendTest(unittest.TestCase):
+    """Test the AES crypto backends"""
+
+    def setUp(self):
+        """Test setup"""
+        self.backends = lora_crypto.availableBackends()
+
+    def test_backend(self):
+        """Test the preferred backend is selected"""
+        expected = self.backends[0].name
+
+        result = lora_crypto.backend.name
+
+        self.assertEqual(expected, result)
+
+    def test_encrypt(self):
+        """Test AES-128 ECB encryption (FIPS-197 Appendix C.1)"""
+        key = '000102030405060708090a0b0c0d0e0f'.decode('hex')
+        data = '00112233445566778899aabbccddeeff'.decode('hex')
+        expected = '69c4e0d86a7b0430d8cdb78070b4c55a'.decode('hex')
+
+        for backend in self.backends:
+            result = backend.encrypt(key, data)
+            self.assertEqual(expected, result)
+            self.assertEqual(data, backend.decrypt(key, result))
+
+    def test_cmac(self):
+        """Test AES-CMAC (RFC 4493 Section 4)"""
+        expected = ['bb1d6929e95937287fa37d129b756746',
+                    '070a16b46b4d4144f79bdd9dd04a287c',
+                    'dfa66747de9ae63030ca32611497c827',
+                    '51f0bebf7e3b9d92fc49741779363cfe']
+
+        for backend in self.backends:
+            result = [backend.encrypt(CMAC_KEY, CMAC_MSG[:n],
+                                      mode='CMAC').encode('hex')
+                      for n in (0, 16, 40, 64)]
+            self.assertEqual(expected, result)
+
+    def test_lorawan(self):
+        """Test all backends agree on LoRaWAN join and data messages"""
+        if len(self.backends) < 2:
+            raise unittest.SkipTest("Only one crypto backend is installed")
+
+        # Join request MIC calculated with AppKey
+        appkey = intPackBytes(int('0x017E151638AEC2A6ABF7258809CF4F3C', 16), 16)
+        join = '\x00\r\x0c\x0b\n\r\x0c\x0b\n\x03\x02\x01\x00\x0d\x0e\x0e\x0f'
+        # Data uplink B0 | msg calculated with NwkSKey
+        nwkskey = intPackBytes(int('0xAEB48D4C6E9EA5C48C37E4F132AA8516', 16), 16)
+        msg = base64.b64decode('QAAAEAaAIQAPh2LgreY=')[:-4]
+        B0 = struct.pack('<BLBLLBB', 0x49, 0, 0, int('0x06100000', 16), 33,
+                         0, len(msg))
+        # FRMPayload keystream block A1 calculated with AppSKey
+        appskey = intPackBytes(int('0x7987A96F267F0A86B739EED480FC2B3C', 16), 16)
+        A1 = struct.pack('<BLBLLBB', 1, 0, 0, int('0x06100000', 16), 33, 0, 1)
+
+        results = []
+        for backend in self.backends:
+            results.append((backend.encrypt(appkey, join, mode='CMAC'),
+                            backend.encrypt(nwkskey, B0 + msg, mode='CMAC'),
+                            backend.encrypt(appskey, A1),
+                            backend.decrypt(appkey, A1)))
+
+        for result in results[1:]:
+            self.assertEqual(results[0], result)
+
+class SessionCipherTest(unittest.TestCase):
+    """Test SessionCipher class"""
+
+    def test_subkeys(self):
+        """Test CMAC subkey generation (RFC 4493 Section 4)"""
+        expected = ('fbeed618357133667c85e08f7236a8de',
+                    'f7ddac306ae266ccf90bc11ee46d513b')
+
+        for backend in lora_crypto.availableBackends():
+            c = lora_crypto.SessionCipher(CMAC_KEY, backend)
+            result = (c.k1.encode('hex'), c.k2.encode('hex'))
+            self.assertEqual(expected, result)
+
+    def test_cmac(self):
+        """Test cmac method agrees with the backend CMAC"""
+        for backend in lora_crypto.availableBackends():
+            c = lora_crypto.SessionCipher(CMAC_KEY, backend)
+            for n in range(0, 65):
+                expected = backend.encrypt(CMAC_KEY, CMAC_MSG[:n], mode='CMAC')
+                result = c.cmac(CMAC_MSG[:n])
+                self.assertEqual(expected, result)
+
+class CipherCacheTest(unittest.TestCase):
+    """Test CipherCache class"""
+
+    def test_get(self):
+        """Test get method hit and miss counters"""
+        cache = lora_crypto.CipherCache(maxsize=2)
+        key = int('0x2B7E151628AED2A6ABF7158809CF4F3C', 16)
+        expected = [1, 1, CMAC_KEY]
+
+        c1 = cache.get(key)
+        c2 = cache.get(key)
+        result = [cache.misses, cache.hits, c2.key]
+
+        self.assertEqual(expected, result)
+        self.assertIs(c1, c2)
+
+    def test_evict(self):
+        """Test least recently used and explicit eviction"""
+        cache = lora_crypto.CipherCache(maxsize=2)
+        expected = [[1, 3], [3]]
+        result = []
+
+        # Key 2 is least recently used when key 3 is added
+        for key in (1, 2, 1, 3):
+            cache.get(key)
+        result.append(sorted(cache.ciphers.keys()))
+        cache.evict(1, None)
+        result.append(sorted(cache.ciphers.keys()))
+
+        self.assertEqual(expected, result)
@@ -0,0 +1,33 @@
+from twisted.trial import unittest
+
+from floranet.deadline import DownlinkBudget
+
+class DownlinkBudgetTest(unittest.TestCase):
+    """Test DownlinkBudget class"""
+
+    def setUp(self):
+        """Test setup. Receive delays of 1 and 2 seconds"""
+        self.budget = DownlinkBudget(guard=0.1, bins=(0.0, 0.5))
+        self.rx = {1: {'delay': 1}, 2: {'delay': 2}}
+
+    def test_windows(self):
+        """Test reachable windows for increasing processing time"""
+        expected = [[1, 2], [2], [], [1, 2]]
+
+        result = [self.budget.windows('gw', 100.0, self.rx, now)
+                  for now in (100.2, 101.2, 102.2)]
+        result.append(self.budget.windows('gw', None, self.rx, 103.0))
+
+        self.assertEqual(expected, result)
+
+    def test_stats(self):
+        """Test counters and slack histograms"""
+        expected = {'sent': 2, 'rx2only': 1, 'missed': 1,
+                    'rx1': [(None, 2), (0.0, 0), (0.5, 1)],
+                    'rx2': [(None, 1), (0.0, 0), (0.5, 2)]}
+
+        for now in (100.2, 101.2, 102.2):
+            self.budget.windows('gw', 100.0, self.rx, now)
+        result = self.budget.stats('gw')
+
+        self.assertEqual(expected, result)
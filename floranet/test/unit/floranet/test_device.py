@@ -31,45 +31,15 @@ class DeviceTest(unittest.TestCase):
                 gw_addr='192.168.1.125',
                 snr=None)
 
-    def test_updateSNR(self):
-        """Test updating a SNR measure """
+    def test_checkFrameCount(self):
+        """Test checkFrameCount method"""
         device = self._test_device()
-        # Expected - pointer, measure
-        expected = [2.0, 4.0]
-        
-        device.updateSNR(2.0)
-        device.updateSNR(4.0)
-        result = device.snr
+        device.fcntup = 10
+        device.fcntdown = 5
+        expected = [True, False, True, 0]
 
-        self.assertEqual(expected, result)
-        
-        expected = 3.0
-        
-        for i in range(0,2):
-            device.updateSNR(2.0)
-            device.updateSNR(4.0)
-        result = device.snr_average
-        
-        self.assertEqual(expected, result)
-        
-    def test_getADRDatarate(self):
-        """Test getADRDatarate method"""
-        device = self._test_device()
-        band = US915()
-        margin = 0
-        
-        expected = ['SF10BW125', 'SF9BW125', 'SF8BW125', 'SF7BW125', 'SF7BW125']
-        results = []
+        result = [device.checkFrameCount(11, 16384, False),
+                  device.checkFrameCount(20000, 16384, False),
+                  device.checkFrameCount(1, 16384, True), device.fcntdown]
 
-        for t in range(0,5):
-            device.snr_average = t*3 + 0.1 
-            result = device.getADRDatarate(band, margin)
-            results.append(result)
-        
-        self.assertEqual(expected, results)
-        
-            
-        
-
-        
-    
\ No newline at end of file
+        self.assertEqual(expected, result)
@@ -0,0 +1,69 @@
+from twisted.trial import unittest
+from mock import patch, MagicMock
+
+from twisted.internet.defer import inlineCallbacks
+
+from twistar.registry import Registry
+
+from floranet.imanager import InterfaceManager
+from floranet.models.appinterface import AppInterface
+from floranet.models.application import Application
+from floranet.appserver.reflector import Reflector
+
+class InterfaceManagerTest(unittest.TestCase):
+    """Test InterfaceManager class"""
+
+    def setUp(self):
+        """Test setup. Creates an InterfaceManager with two interfaces"""
+        Registry.getConfig = MagicMock(return_value=None)
+        self.manager = InterfaceManager()
+        self.reflectors = [self._test_reflector(n) for n in (0, 1)]
+        self.manager.interfaces = self.reflectors
+
+    def _test_reflector(self, id):
+        """Create a test Reflector with application interface id"""
+        interface = Reflector(id=id, name='Test Reflector {}'.format(id))
+        interface.appinterface = AppInterface(id=id)
+        return interface
+
+    def test_getInterface(self):
+        """Test getInterface method"""
+        expected = [self.reflectors[0], self.reflectors[1], None, None]
+
+        result = [self.manager.getInterface(0),
+                  self.manager.getInterface('1'),
+                  self.manager.getInterface(2),
+                  self.manager.getInterface(None)]
+
+        self.assertEqual(expected, result)
+
+    def test_getAppInterface(self):
+        """Test getAppInterface method resolves and caches routes"""
+        app = Application(appeui=1, appinterface_id=1)
+        expected = [self.reflectors[1], self.reflectors[1],
+                    self.reflectors[0], None]
+
+        result = [self.manager.getAppInterface(app)]
+        app.appinterface_id = 0
+        result.append(self.manager.getAppInterface(app))
+        self.manager.removeRoute(app.appeui)
+        result.append(self.manager.getAppInterface(app))
+        self.manager.removeRoute(app.appeui)
+        app.appinterface_id = 2
+        result.append(self.manager.getAppInterface(app))
+
+        self.assertEqual(expected, result)
+
+    @inlineCallbacks
+    def test_deleteInterface(self):
+        """Test deleteInterface method removes the first interface"""
+        interface = self.reflectors[0]
+        app = Application(appeui=1, appinterface_id=0)
+        self.manager.getAppInterface(app)
+        expected = [[self.reflectors[1]], None]
+
+        with patch.object(Reflector, 'exists', MagicMock(return_value=False)):
+            yield self.manager.deleteInterface(interface)
+        result = [self.manager.interfaces, self.manager.getAppInterface(app)]
+
+        self.assertEqual(expected, result)
@@ -0,0 +1,65 @@
+from twisted.trial import unittest
+from twisted.logger import LogLevel
+from mock import patch, MagicMock
+
+from floranet.log import Log
+
+class LogTest(unittest.TestCase):
+    """Test Log class"""
+
+    def setUp(self):
+        """Test setup. Creates a Log with emit mocked"""
+        self.log = Log()
+        self.log.emit = MagicMock()
+
+    def _emitted(self):
+        """Get the emitted (format, suppressed) pairs"""
+        return [(c[0][1], c[1].get('suppressed'))
+                for c in self.log.emit.call_args_list]
+
+    def test_limited(self):
+        """Test events are suppressed within the interval and summarised"""
+        expected = [('Message {n}', None), ('Message {n}', None),
+                    ('Message {n} ({suppressed} similar messages '
+                     'suppressed)', 2),
+                    ('Message {n}', None)]
+
+        with patch('floranet.log.time.time') as now:
+            for (t, key) in ((100.0, 1), (101.0, 1), (102.0, 2),
+                             (159.0, 1), (160.0, 1)):
+                now.return_value = t
+                self.log.limited(LogLevel.info, key, 'Message {n}', n=key)
+
+        self.assertEqual(expected, self._emitted())
+
+    def test_flush(self):
+        """Test flush reports the suppressed count of a quiet key"""
+        expected = [('Message', None),
+                    ('Message ({suppressed} similar messages suppressed)', 1)]
+
+        with patch('floranet.log.time.time') as now:
+            now.return_value = 100.0
+            self.log.limited(LogLevel.info, 1, 'Message')
+            self.log.limited(LogLevel.info, 1, 'Message')
+        self.log.flush(159.0)
+        result = [len(self.log.limits)]
+        self.log.flush(160.0)
+        result.append(len(self.log.limits))
+
+        self.assertEqual(expected, self._emitted())
+        self.assertEqual([1, 0], result)
+
+    def test_limited_maxkeys(self):
+        """Test the oldest key is flushed at maxkeys"""
+        self.log.maxkeys = 3
+        expected = [3, [2, 3, 4]]
+
+        with patch('floranet.log.time.time') as now:
+            now.return_value = 100.0
+            for key in (1, 2, 3):
+                self.log.limited(LogLevel.info, key, 'Message')
+            result = [len(self.log.limits)]
+            self.log.limited(LogLevel.info, 4, 'Message')
+        result.append(list(self.log.limits))
+
+        self.assertEqual(expected, result)
@@ -6,6 +6,8 @@ import base64
 
 import floranet.lora.mac as lora_mac
 import floranet.error as error
+from floranet.lora.crypto import aesEncrypt
+from floranet.util import intPackBytes
 
 class MACHeaderTest(unittest.TestCase):
     """Test MACHeader class"""
@@ -263,6 +265,33 @@ class MACDataUplinkMessageTest(unittest.TestCase):
         
         self.assertEqual(expected, result)
     
+    def test_decode_lazy(self):
+        """Test lazy decode"""
+        def decoded(m):
+            # Read the payload slot directly, bypassing __getattr__
+            try:
+                lora_mac.MACDataMessage.payload.__get__(m)
+                return True
+            except AttributeError:
+                return False
+        
+        data = base64.b64decode('QAAAEAaCAgADBw9dMFcf9Q==')
+        mhdr = lora_mac.MACHeader.decode(data[0])
+        m = lora_mac.MACDataUplinkMessage.decode(mhdr, data)
+        expected = [m.devaddr, m.fcnt, m.mic, False, m.payload.fport,
+                    m.payload.frmpayload, m.commands[0].cid, True]
+        
+        lazy = lora_mac.MACMessage.decode(data, lazy=True)
+        result = [lazy.devaddr, lazy.fcnt, lazy.mic, decoded(lazy)]
+        result += [lazy.payload.fport, lazy.payload.frmpayload,
+                   lazy.commands[0].cid, decoded(lazy)]
+        
+        self.assertEqual(expected, result)
+        
+        # Test a short message raises DecodeError on the first pass
+        self.assertRaises(error.DecodeError, lora_mac.MACMessage.decode,
+                          data[:12], lazy=True)
+    
     def test_decrypt(self):
         """Test decrypt method"""
         # Message data derived from LoraMac-node payloads:
@@ -293,6 +322,29 @@ class MACDataUplinkMessageTest(unittest.TestCase):
         
         self.assertTrue(result)
     
+    def test_calculateMIC(self):
+        """Test MICs calculated from the received and encoded messages agree"""
+        devaddr = int('0x06100000', 16)
+        for foptslen in range(16):
+            # Use LinkCheckReq commands as fopts
+            fopts = '\x02' * foptslen
+            for fport in [None] + range(256):
+                # MACPayload requires at least one byte after the fhdr
+                if fport is None and foptslen == 0:
+                    continue
+                data = struct.pack('<BLBH', 0x40, devaddr, foptslen, 1234) + fopts
+                if fport is not None:
+                    data += struct.pack('B', fport) + 'helloworld'
+                data += '\x00\x00\x00\x00'
+                mhdr = lora_mac.MACHeader.decode(data[0])
+                m = lora_mac.MACDataUplinkMessage.decode(mhdr, data)
+                expected = m.calculateMIC(self.nwkskey)
+                
+                m.raw = None
+                result = m.calculateMIC(self.nwkskey)
+                
+                self.assertEqual(expected, result)
+    
 class MACDataDownlinkMessageTest(unittest.TestCase):
     """Test MACDataDownlinkMessage class"""
     
@@ -306,6 +358,27 @@ class MACDataDownlinkMessageTest(unittest.TestCase):
         
         self.assertEqual(expected, result)
 
+    def test_encrypt(self):
+        """Test encrypt method over multiple blocks"""
+        key = int('0x7987A96F267F0A86B739EED480FC2B3C', 16)
+        devaddr = int('0x06100000', 16)
+        frmpayload = ''.join(chr(i) for i in range(48))
+        
+        for plen in range(1, 49):
+            # Reference XOR with each keystream block Si = aes128_encrypt(K, Ai)
+            S = ''.join(aesEncrypt(intPackBytes(key, 16),
+                        struct.pack('<BLBLLBB', 1, 0, 1, devaddr, 372, 0, i+1))
+                        for i in range((plen + 15) // 16))
+            expected = ''.join(chr(ord(a) ^ ord(b)) for a,b in
+                               zip(frmpayload[:plen], S))
+            
+            m = lora_mac.MACDataDownlinkMessage(devaddr, key, 372, False, '',
+                                                15, frmpayload[:plen])
+            m.encrypt(key)
+            result = m.payload.frmpayload
+            
+            self.assertEqual(expected, result)
+
 class MACCommandTest(unittest.TestCase):
     """Test MACCommand class"""
     
@@ -331,6 +404,30 @@ class MACCommandTest(unittest.TestCase):
         
         self.assertEqual(expected, result)
     
+    def test_decode_unknown(self):
+        """Test decode method with unknown and truncated commands"""
+        expected = [None, None, None]
+        
+        # Unknown CID, truncated LinkADRAns, offset beyond data
+        result = [lora_mac.MACCommand.decode('\x80'),
+                  lora_mac.MACCommand.decode('\x03'),
+                  lora_mac.MACCommand.decode('\x02', 1)]
+        
+        self.assertEqual(expected, result)
+    
+    def test_decodeAll(self):
+        """Test decodeAll method"""
+        expected = [lora_mac.LINKCHECKREQ, lora_mac.LINKADRANS,
+                    lora_mac.DUTYCYCLEANS, lora_mac.RXPARAMSETUPANS,
+                    lora_mac.DEVSTATUSANS, lora_mac.NEWCHANNELANS,
+                    lora_mac.RXTIMINGSETUPANS]
+        
+        # Decoding stops at the unknown CID 0x80
+        data = '\x02\x03\x07\x04\x05\x07\x06\xfe\x05\x07\x03\x08\x80\x02'
+        result = [c.cid for c in lora_mac.MACCommand.decodeAll(data)]
+        
+        self.assertEqual(expected, result)
+    
     def test_isLinkCheckReq(self):
         """Test isLinkCheckReq method"""
         self.assertTrue(self.linkcr.isLinkCheckReq())
@@ -402,3 +499,45 @@ class LinkADRAnsTest(unittest.TestCase):
 
 
     
+
+class RxParamSetupAnsTest(unittest.TestCase):
+    """Test RxParamSetupAns class"""
+    
+    def test_decode(self):
+        """Test decode method"""
+        expected = [1, 0, 1, False, True]
+        
+        m = lora_mac.MACCommand.decode('\x05\x05')
+        passing = lora_mac.MACCommand.decode('\x05\x07')
+        result = [m.rx1droffset_ack, m.rx2datarate_ack, m.channel_ack,
+                  m.successful(), passing.successful()]
+        
+        self.assertEqual(expected, result)
+
+class DevStatusAnsTest(unittest.TestCase):
+    """Test DevStatusAns class"""
+    
+    def test_decode(self):
+        """Test decode method"""
+        expected = [(254, 10), (0, -32), (255, -1)]
+        
+        result = []
+        for data in ('\x06\xfe\x0a', '\x06\x00\x20', '\x06\xff\x3f'):
+            m = lora_mac.MACCommand.decode(data)
+            result.append((m.battery, m.margin))
+        
+        self.assertEqual(expected, result)
+
+class NewChannelAnsTest(unittest.TestCase):
+    """Test NewChannelAns class"""
+    
+    def test_decode(self):
+        """Test decode method"""
+        expected = [1, 0, False, True]
+        
+        m = lora_mac.MACCommand.decode('\x07\x02')
+        passing = lora_mac.MACCommand.decode('\x07\x03')
+        result = [m.datarate_ok, m.channelfreq_ok, m.successful(),
+                  passing.successful()]
+        
+        self.assertEqual(expected, result)
@@ -0,0 +1,58 @@
+from twisted.trial import unittest
+
+import floranet.lora.mac as lora_mac
+from floranet.macqueue import MACCommandQueue
+
+class MACCommandQueueTest(unittest.TestCase):
+    """Test MACCommandQueue class"""
+
+    def setUp(self):
+        """Test setup. Creates a queue with a 10 second limit"""
+        self.queue = MACCommandQueue(10)
+
+    def _createCommands(self):
+        """Create a LinkCheckAns and a LinkADRReq"""
+        return [lora_mac.LinkCheckAns(),
+                lora_mac.LinkADRReq('SF7BW125', 0, 0xFF, 6, 0)]
+
+    def test_remove(self):
+        """Test remove method removes every matching command"""
+        (check, adr) = self._createCommands()
+        expected = [2, [check], 0, 1]
+
+        for command in (adr, check, adr):
+            self.queue.append(1, command)
+        self.queue.append(2, adr)
+        result = [self.queue.remove(1, lora_mac.LINKADRREQ),
+                  self.queue.commands(1),
+                  self.queue.remove(3, lora_mac.LINKADRREQ),
+                  self.queue.depth(2)]
+
+        self.assertEqual(expected, result)
+
+    def test_popleft(self):
+        """Test popleft method removes the oldest commands"""
+        (check, adr) = self._createCommands()
+        expected = [[adr], 1, 0, {}]
+
+        self.queue.append(1, check)
+        self.queue.append(1, adr)
+        self.queue.popleft(1)
+        result = [self.queue.commands(1), len(self.queue)]
+        self.queue.popleft(1, 5)
+        result += [len(self.queue), self.queue.queues]
+
+        self.assertEqual(expected, result)
+
+    def test_expire(self):
+        """Test expire method and statistics"""
+        (check, adr) = self._createCommands()
+        expected = [4, {'size': 2, 'devices': 1, 'maxdepth': 2,
+                        'meandepth': 2.0, 'expired': 4}]
+
+        for i in range(3):
+            self.queue.append(1, check, 100.0 + i)
+            self.queue.append(2, adr, 100.0 + i * 5)
+        result = [self.queue.expire(112.5), self.queue.stats()]
+
+        self.assertEqual(expected, result)
@@ -0,0 +1,126 @@
+from twisted.trial import unittest
+from twisted.internet.defer import inlineCallbacks, succeed, fail, Deferred, \
+    maybeDeferred
+from mock import MagicMock
+
+from twistar.registry import Registry
+from twistar.dbconfig.postgres import PostgreSQLDBConfig
+
+from floranet.models.model import UpdateBuffer
+from floranet.models.device import Device
+from floranet.models.gateway import Gateway
+
+class UpdateBufferTest(unittest.TestCase):
+    """Test UpdateBuffer class"""
+
+    def setUp(self):
+        """Test setup. Creates two devices using a mocked transaction"""
+        self.txn = MagicMock()
+        config = PostgreSQLDBConfig()
+        config.runInteraction = lambda f: succeed(f(self.txn))
+        Registry.getConfig = MagicMock(return_value=config)
+        self.devices = [Device(id=i, fcntup=0) for i in (1, 2)]
+        self.buffer = UpdateBuffer(batchsize=10)
+
+    def test_add(self):
+        """Test add method merges updates per row"""
+        expected = [2, {'fcntup': 2, 'tmst': 100}]
+
+        self.buffer.add(self.devices[0], fcntup=1, tmst=100)
+        self.buffer.add(self.devices[0], fcntup=2)
+        self.buffer.add(self.devices[1], fcntup=1)
+        result = [len(self.buffer), self.buffer.pending[('devices', 1)][1]]
+
+        self.assertEqual(expected, result)
+
+    @inlineCallbacks
+    def test_flush(self):
+        """Test flush method issues one executemany per column set"""
+        expected = [3, 0, 3]
+
+        self.buffer.add(self.devices[0], fcntup=5, tmst=100)
+        self.buffer.add(self.devices[1], fcntup=6, tmst=200)
+        self.buffer.add(Gateway(id=1), power=26)
+        saved = yield self.buffer.flush()
+        result = [saved, len(self.buffer), self.buffer.stats()['rows']]
+
+        self.assertEqual(expected, result)
+        self.assertEqual(2, self.txn.executemany.call_count)
+        (query, rows) = self.txn.executemany.call_args_list[0][0]
+        self.assertEqual('UPDATE devices SET "fcntup" = %s,"tmst" = %s '
+                         'WHERE id = %s', query)
+        self.assertEqual([[5, 100, 1], [6, 200, 2]], rows)
+
+    def test_batchsize(self):
+        """Test reaching batchsize triggers a flush"""
+        expected = [0, 1, 2]
+
+        self.buffer.batchsize = 2
+        self.buffer.add(self.devices[0], fcntup=1)
+        self.buffer.add(self.devices[1], fcntup=1)
+        stats = self.buffer.stats()
+        result = [stats['pending'], stats['flushes'], stats['maxbatch']]
+
+        self.assertEqual(expected, result)
+
+    @inlineCallbacks
+    def test_flush_error(self):
+        """Test failed rows are requeued behind newer values"""
+        expected = [0, {'fcntup': 2, 'tmst': 100}, 1, {('devices', 1): 1}]
+
+        d = Deferred()
+        Registry.getConfig().runInteraction = MagicMock(
+            side_effect=[d, fail(RuntimeError('connection lost'))])
+        self.buffer.add(self.devices[0], fcntup=1, tmst=100)
+        flushed = self.buffer.flush()
+        self.buffer.add(self.devices[0], fcntup=2)
+        d.errback(RuntimeError('connection lost'))
+        saved = yield flushed
+        result = [saved, self.buffer.pending[('devices', 1)][1],
+                  self.buffer.stats()['errors'], self.buffer.failures]
+
+        self.assertEqual(expected, result)
+        self.flushLoggedErrors()
+
+    @inlineCallbacks
+    def test_flush_retry(self):
+        """Test rows of a failed flush are saved individually, and a
+        failing row is dropped after maxretries"""
+        expected = [[1, 0, 1, 1], [0, 1, 0, 0]]
+
+        def executemany(query, rows):
+            if ['bad', 2] in rows:
+                raise ValueError('invalid value')
+        self.txn.executemany.side_effect = executemany
+        Registry.getConfig().runInteraction = \
+            lambda f: maybeDeferred(f, self.txn)
+        self.buffer.maxretries = 2
+        self.buffer.add(self.devices[0], fcntup=1)
+        self.buffer.add(self.devices[1], fcntup='bad')
+        result = []
+        for i in range(2):
+            saved = yield self.buffer.flush()
+            result.append([saved, self.buffer.stats()['dropped'],
+                           len(self.buffer), len(self.buffer.failures)])
+
+        self.assertEqual(expected, result)
+        self.flushLoggedErrors()
+
+    @inlineCallbacks
+    def test_stop(self):
+        """Test stop method saves rows queued during a flush"""
+        expected = [0, 2]
+
+        d = Deferred()
+        config = Registry.getConfig()
+        config.runInteraction = lambda f: d
+        self.buffer.add(self.devices[0], fcntup=1)
+        self.buffer.flush()
+        self.buffer.add(self.devices[1], fcntup=1)
+        stopped = self.buffer.stop()
+        config.runInteraction = lambda f: succeed(f(self.txn))
+        d.callback(None)
+        yield stopped
+        result = [len(self.buffer), self.buffer.flushes]
+
+        self.assertEqual(expected, result)
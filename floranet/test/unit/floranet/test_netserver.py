@@ -6,16 +6,18 @@ from random import randrange
 from mock import patch, MagicMock
 
 from twisted.trial import unittest
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import inlineCallbacks, returnValue, succeed, fail
 from twisted.internet import reactor, protocol
+from twisted.internet.task import Clock
 from twisted.internet.udp import Port
 
 from twistar.registry import Registry
 
-from floranet.lora.wan import LoraWAN, Rxpk
+from floranet.lora.wan import LoraWAN, Rxpk, GatewayMessage
+import floranet.aggregator
 from floranet.netserver import NetServer
 import floranet.lora.mac as lora_mac
-from floranet.models.model import Model
+from floranet.models.model import Model, updateBuffer
 from floranet.models.config import Config
 from floranet.models.gateway import Gateway
 from floranet.models.device import Device
@@ -68,79 +70,70 @@ class NetServerTest(unittest.TestCase):
         result = self.server.checkDevaddr(devaddr)
         self.assertFalse(result)
         
-    @inlineCallbacks
     def test_getOTAADevAddrs(self):
         """Test getOTAADevAddrs method"""
         device = self._test_device()
-        mockDBObject.return_value = device
-        expected = [[], [device.devaddr]]
+        expected = [[], [self.server.config.otaastart]]
         
         results = []
-        # Test when no devices are found
-        with patch.object(Device, 'find', classmethod(mockDBObject.findFail)):
-            result = yield self.server._getOTAADevAddrs()
-            results.append(result)
+        # Test when no OTAA devices are found
+        device.devaddr = self.server.config.otaaend + 1
+        self.server.devices.add(device)
+        results.append(self.server._getOTAADevAddrs())
             
-        # Test when one device is found
-        with patch.object(Device, 'find', classmethod(mockDBObject.findOne)):
-            result = yield self.server._getOTAADevAddrs()
-            results.append(result)
+        # Test when one OTAA device is found
+        device.devaddr = self.server.config.otaastart
+        self.server.devices.add(device)
+        results.append(self.server._getOTAADevAddrs())
         
         self.assertEqual(expected, results)
     
-    @inlineCallbacks
     def test_getFreeOTAAddress(self):
-        expected = [self.server.config.otaastart,
-                    self.server.config.otaastart+1,
-                    self.server.config.otaaend, None]
+        """Test getFreeOTAAddress method"""
+        config = self.server.config
+        device = self._test_device()
+        expected = [config.otaastart + 1, config.otaastart + 2,
+                    config.otaastart, None, config.otaaend]
         results = []
         
-        # Test with empty OTA device list
-        # Mock the server method to return the devaddr list
-        with patch.object(self.server, '_getOTAADevAddrs',
-                          MagicMock(return_value=[])):
-            result = yield self.server._getFreeOTAAddress()
-            results.append(result)
-
-        # Test with one OTA device
-        with patch.object(self.server, '_getOTAADevAddrs', MagicMock(
-                return_value=[self.server.config.otaastart])):
-            result = yield self.server._getFreeOTAAddress()
-            results.append(result)
+        # Test with the first address assigned to a device
+        device.devaddr = config.otaastart
+        self.server.devices.add(device)
+        results.append(self.server._getFreeOTAAddress())
+        results.append(self.server._getFreeOTAAddress())
+        
+        # Test a released address is reused
+        self.server.devices.remove(device.deveui)
+        results.append(self.server._getFreeOTAAddress())
         
-        # Test with last address only available
-        with patch.object(self.server, '_getOTAADevAddrs',MagicMock(
-            return_value=xrange(self.server.config.otaastart,
-                                self.server.config.otaaend))):
-            result = yield self.server._getFreeOTAAddress()
-            results.append(result)
-
         # Test with no address available
-        with patch.object(self.server, '_getOTAADevAddrs',MagicMock(
-            return_value=xrange(self.server.config.otaastart,
-                                self.server.config.otaaend + 1))):
-            result = yield self.server._getFreeOTAAddress()
-            results.append(result)
+        self.server.otaapool.reset(config.otaaend, config.otaaend,
+                                   [config.otaaend])
+        results.append(self.server._getFreeOTAAddress())
+        
+        # Test with last address only available
+        self.server.otaapool.reset(config.otaaend - 1, config.otaaend,
+                                   [config.otaaend - 1])
+        results.append(self.server._getFreeOTAAddress())
         
         self.assertEqual(expected, results)
         
-    @inlineCallbacks
     def test_getActiveDevice(self):
-        # Include for coverage. We are essentially testing a returnValue() call.
         device = self._test_device()
-        mockDBObject.return_value = device
+        self.server.devices.add(device)
         
-        expected = device.deveui
+        expected = [device.deveui, None]
         
-        with patch.object(Device, 'find', classmethod(mockDBObject.findSuccess)):
-            result = yield self.server._getActiveDevice(device.devaddr)
+        result = [self.server._getActiveDevice(device.devaddr).deveui,
+                  self.server._getActiveDevice(device.devaddr + 1)]
         
-        self.assertEqual(expected, result.deveui)
+        self.assertEqual(expected, result)
     
     def test_checkDuplicateMessage(self):
         m = lora_mac.MACDataMessage()
         m.mic = 1111
         self.server.config.duplicateperiod = 10
+        self.server.message_cache.period = 10
         
         expected = [True, False]
         result = []
@@ -149,28 +142,29 @@ class NetServerTest(unittest.TestCase):
         
         # Test a successful find of the duplicate
         for i in (1,10):
-            self.server.message_cache.append((randrange(1,1000), now - i))
-        self.server.message_cache.append(
-            (m.mic, now - self.server.config.duplicateperiod + 1))        
+            self.server.message_cache.check((None, None, randrange(1,1000)),
+                                            now - i)
+        self.server.message_cache.check((None, None, m.mic),
+            now - self.server.config.duplicateperiod + 1)
         result.append(self.server._checkDuplicateMessage(m))
         
         # Test an unsuccessful find of the duplicate - the message's
         # cache period has expired.
-        self.server.message_cache.remove(
-            (m.mic, now - self.server.config.duplicateperiod + 1))
-        self.server.message_cache.append(
-            (m.mic, now - self.server.config.duplicateperiod - 1))
+        self.server.message_cache.clear()
+        self.server.message_cache.check((None, None, m.mic),
+            now - self.server.config.duplicateperiod - 1)
         result.append(self.server._checkDuplicateMessage(m))
 
         self.assertEqual(expected, result)
 
     def test_cleanMessageCache(self):
         self.server.config.duplicateperiod = 10
+        self.server.message_cache.period = 10
         
         # Create 10 cache entries, remove 5
         now = time.time()
-        for i in range(1,21,2):
-            self.server.message_cache.append((i, now - i))
+        for i in range(19,0,-2):
+            self.server.message_cache.check((None, None, i), now - i)
         
         expected = 5
         self.server._cleanMessageCache()
@@ -179,12 +173,12 @@ class NetServerTest(unittest.TestCase):
         self.assertEqual(expected, result)
 
     def test_manageMACCommandQueue(self):
-        self.server.config.macqueuelimit = 10
+        self.server.commands.limit = 10
         
         # Create 10 cache entries, remove 5
         now = time.time()
         for i in range(1,21,2):
-            self.server.commands.append((int(now - i), i, lora_mac.LinkCheckAns()))
+            self.server.commands.append(i, lora_mac.LinkCheckAns(), now - i)
         
         expected = 5
         self.server._manageMACCommandQueue()
@@ -192,27 +186,207 @@ class NetServerTest(unittest.TestCase):
         
         self.assertEqual(expected, result)
         
+    def test_processPushDataMessage_aggregation(self):
+        """Test receptions of a frame from several gateways are
+        processed once, best first"""
+        self.server.receptions.callback = MagicMock()
+        data = '\x40\x01\x00\x00\x06\x00\x05\x00\x01abcd\x01\x02\x03\x04'
+        expected = (1, ['192.168.1.126', '192.168.1.125', '192.168.1.127'])
+
+        clock = Clock()
+        with patch.object(floranet.aggregator, 'reactor', clock):
+            for (n, lsnr) in ((125, 2.0), (126, 8.5), (127, -3.0)):
+                gateway = Gateway(host='192.168.1.%d' % n, enabled=True)
+                request = GatewayMessage()
+                request.rxpk = [Rxpk(data=data, lsnr=lsnr)]
+                self.server.processPushDataMessage(request, gateway)
+            clock.advance(self.server.receptions.period)
+        (message, receptions) = self.server.receptions.callback.call_args[0]
+        result = (self.server.receptions.callback.call_count,
+                  [r[1].host for r in receptions])
+
+        self.assertEqual(expected, result)
+
+    @inlineCallbacks
+    def test_processPushDataMessage(self):
+        """Test each rxpk is processed and the results summarised"""
+        self.server.config.aggregationperiod = 0
+        frames = ['\x40\x01\x00\x00\x06\x00\x05\x00\x01abcd\x01\x02\x03\x04',
+                  '\x40\x01\x00\x00\x06\x00\x05\x00\x01abcd\x01\x02\x03\x04',
+                  '\xe0',
+                  '\x40\x02\x00\x00\x06\x00\x05\x00\x01abcd\x01\x02\x03\x04',
+                  '\x40\x03\x00\x00\x06\x00\x05\x00\x01abcd\x01\x02\x03\x04']
+        expected = ({'accepted': 1, 'duplicate': 1, 'rejected': 3,
+                     'pending': 0},
+                    {'datagrams': 1, 'accepted': 1, 'duplicate': 1,
+                     'rejected': 3})
+
+        request = GatewayMessage()
+        request.rxpk = [Rxpk(data=data) for data in frames]
+        gateway = Gateway(host='192.168.1.125', enabled=True)
+        results = [succeed(True), succeed(False), fail(ValueError())]
+        with patch.object(self.server, '_processUplink',
+                          MagicMock(side_effect=results)):
+            summary = yield self.server.processPushDataMessage(request, gateway)
+        result = (summary, self.server.rxpkstats)
+
+        self.assertEqual(expected, result)
+
+    @inlineCallbacks
+    def test_processPushDataMessage_filter(self):
+        """Test frames are dropped before processing"""
+        self.server.config.aggregationperiod = 0
+        self.server.unknownaddrs.add(0x06000002)
+        # CRC error, foreign NwkID, unknown DevAddr and a join request
+        frames = [('\x40\x01\x00\x00\x06\x00\x05\x00\x01abcd\x01\x02\x03\x04', -1),
+                  ('\x40\x01\x00\x00\x26\x00\x05\x00\x01abcd\x01\x02\x03\x04', 1),
+                  ('\x40\x02\x00\x00\x06\x00\x05\x00\x01abcd\x01\x02\x03\x04', 1),
+                  (base64.b64decode("AA0MCwoNDAsKAwIBAA0ODg9IklIgzCM="), 1)]
+        expected = ({'crc': 1, 'netid': 1, 'unknown': 1}, 1)
+
+        request = GatewayMessage()
+        request.rxpk = [Rxpk(data=data, stat=stat) for (data, stat) in frames]
+        gateway = Gateway(host='192.168.1.125', enabled=True)
+        with patch.object(self.server, '_processUplink',
+                          MagicMock(return_value=succeed(True))) as process:
+            yield self.server.processPushDataMessage(request, gateway)
+        result = (self.server.dropped, process.call_count)
+
+        self.assertEqual(expected, result)
+
+    @inlineCallbacks
+    def test_processPushDataMessage_unknowneui(self):
+        """Test join requests from unregistered devices are dropped"""
+        self.server.config.aggregationperiod = 0
+        self.server.config.duplicateperiod = 0
+        data = base64.b64decode("AA0MCwoNDAsKAwIBAA0ODg9IklIgzCM=")
+        expected = (1, 1, 2)
+
+        request = GatewayMessage()
+        request.rxpk = [Rxpk(data=data)]
+        gateway = Gateway(host='192.168.1.125', enabled=True)
+        with patch('floranet.netserver.applicationCache') as cache:
+            cache.get.return_value = succeed(None)
+            yield self.server.processPushDataMessage(request, gateway)
+            yield self.server.processPushDataMessage(request, gateway)
+        result = (cache.get.call_count, self.server.dropped['unknown'],
+                  self.server.rxpkstats['rejected'])
+
+        self.assertEqual(expected, result)
+
+    def _inboundAppMessage_setup(self):
+        """Create a cached device with a queued command, and a gateway"""
+        device = self._test_device()
+        device.fcntdown = 5
+        device.tmst = 1000
+        self.server.devices.add(device)
+        self.server.commands.append(device.deveui,
+                                    lora_mac.LinkCheckAns(margin=1, gwcnt=1))
+        self.server.lora = LoraWAN(self.server)
+        self.server.lora.addGateway(Gateway(host='192.168.1.125', eui=1,
+                                            port=1700, power=26, enabled=True))
+        return device
+
     @inlineCallbacks
+    def test_inboundAppMessage(self):
+        """Test a scheduled downlink removes the piggybacked commands
+        and increments fcntdown"""
+        device = self._inboundAppMessage_setup()
+        app = Application(appeui=device.appeui, fport=15)
+        expected = (6, 0, 1)
+
+        with patch('floranet.netserver.applicationCache') as cache, \
+                patch.object(self.server.lora, 'sendPullResponse') as send:
+            cache.get.return_value = succeed(app)
+            yield self.server.inboundAppMessage(device.devaddr, 'hello')
+        result = (device.fcntdown, self.server.commands.depth(device.deveui),
+                  send.call_count)
+        updateBuffer.pending.clear()
+
+        self.assertEqual(expected, result)
+
+    @inlineCallbacks
+    def test_inboundAppMessage_collision(self):
+        """Test a downlink that collides in both windows leaves the
+        commands queued and fcntdown unchanged"""
+        device = self._inboundAppMessage_setup()
+        app = Application(appeui=device.appeui, fport=15)
+        # Occupy both receive windows
+        self.server.lora.scheduler.timelines['192.168.1.125'] = [(0, 4000000)]
+        expected = (5, 1, 0)
+
+        with patch('floranet.netserver.applicationCache') as cache, \
+                patch.object(self.server.lora, 'sendPullResponse') as send:
+            cache.get.return_value = succeed(app)
+            yield self.server.inboundAppMessage(device.devaddr, 'hello')
+        result = (device.fcntdown, self.server.commands.depth(device.deveui),
+                  send.call_count)
+
+        self.assertEqual(expected, result)
+
+    @inlineCallbacks
+    def test_processFrame(self):
+        """Test aggregated frames are counted when the period closes"""
+        gateway = Gateway(host='192.168.1.125', enabled=True)
+        receptions = [(None, gateway, None)]
+        expected = (['accepted', 'rejected', 'rejected'],
+                    {'datagrams': 0, 'accepted': 1, 'duplicate': 0,
+                     'rejected': 2})
+
+        outcomes = [succeed(True), succeed(False), fail(ValueError())]
+        result = []
+        with patch.object(self.server, '_processUplink',
+                          MagicMock(side_effect=outcomes)):
+            for i in range(3):
+                r = yield self.server._processFrame('message', receptions)
+                result.append(r)
+        result = (result, self.server.rxpkstats)
+
+        self.assertEqual(expected, result)
+
+    def test_processLinkCheckReq_scheduled(self):
+        """Test LinkCheckAns is scheduled in a receive window"""
+        self.server.config.macqueueing = False
+        device = self._inboundAppMessage_setup()
+        expected = (6, 1, 1)
+
+        with patch.object(self.server.lora, 'sendPullResponse') as send:
+            self.server._processLinkCheckReq(device, lora_mac.LinkCheckReq(),
+                                             7.6, 3)
+        stats = self.server.lora.scheduler.stats('192.168.1.125')
+        result = (device.fcntdown, stats['rx1'], send.call_count)
+        updateBuffer.pending.clear()
+
+        self.assertEqual(expected, result)
+
+    def test_processLinkCheckReq(self):
+        """Test LinkCheckAns reports the gateway count"""
+        device = self._test_device()
+        expected = (8, 3)
+
+        self.server._processLinkCheckReq(device, lora_mac.LinkCheckReq(),
+                                         7.6, 3)
+        command = self.server.commands.commands(device.deveui)[0]
+        result = (command.margin, command.gwcnt)
+
+        self.assertEqual(expected, result)
+
     def test_processADRRequests(self):
         device = self._test_device()
-        device.snr_average = 3.5
         device.adr_datr = None
 
         # Test we set adr_datr device attribute properly
-        expected = ['SF9BW125', False]
+        expected = ['SF9BW125', 0]
         results = []
         
-        mockDBObject.return_value = [device]
-        mockModel.mock_object = device
-        with patch.object(Device, 'all', classmethod(mockDBObject.all)), \
-                patch.object(device, 'update', mockModel.update), \
-                patch.object(self.server, '_sendLinkADRRequest', MagicMock()):
-            # Remove any delays
-            self.server.config.adrmessagetime = 0
-            yield self.server._processADRRequests()
+        self.server.devices.add(device)
+        for i in range(6):
+            self.server.adr.updateSNR(device, 3.5)
+        self.server.config.macqueueing = True
+        self.server._processADRRequests()
             
         results.append(device.adr_datr)
-        results.append(self.server.adrprocessing)
+        results.append(len(self.server.adr.dirty))
         self.assertEqual(expected, results)
     
     def _createCommands(self):
@@ -228,8 +402,8 @@ class NetServerTest(unittest.TestCase):
         
         for c in commands:
             self.server._queueMACCommand(device.deveui, c)
-        result = [len(self.server.commands), self.server.commands[0][2].cid,
-                      self.server.commands[1][2].cid]
+        queued = self.server.commands.commands(device.deveui)
+        result = [len(self.server.commands), queued[0].cid, queued[1].cid]
         
         self.assertEqual(expected, result)
     
@@ -243,7 +417,8 @@ class NetServerTest(unittest.TestCase):
 
         expected = [1, lora_mac.LINKCHECKANS]
         
-        result = [len(self.server.commands), self.server.commands[0][2].cid]
+        result = [len(self.server.commands),
+                  self.server.commands.commands(device.deveui)[0].cid]
         
         self.assertEqual(expected, result)
         
@@ -284,25 +459,33 @@ class NetServerTest(unittest.TestCase):
         
         self.assertEqual(expected, result)
 
-    def _processJoinRequest(self, request):
-        """Called by test_processJoinRequest_pass and
-        test_processJoinRequest_fail"""
+    @inlineCallbacks
+    def test_processJoinRequest(self):
+        """Test processJoinRequest method"""
         device = self._test_device()
-        app = self.server.config.apps[0]
-
-        # Passing join request
+        device.devaddr = None
+        device.devnonce = None
+        app = Application(appeui=device.appeui, appkey=int(
+            '0x017E151638AEC2A6ABF7258809CF4F3C', 16), appnonce=1)
         request = base64.b64decode("AA0MCwoNDAsKAwIBAA0ODg9IklIgzCM=")
         msg = lora_mac.MACMessage.decode(request)
-        result = yield self.server._processJoinRequest(msg, app, device)
-        
-        self.assertTrue(result)
-        
-        # Failing join request
-        request = base64.b64decode("AA0MCwoNDAsKAwIBAA0ODg9IklIgzCX=")
-        msg = lora_mac.MACMessage.decode(request)
-        result = yield self.server._processJoinRequest(msg, app, device)
-        
-        self.assertFalse(result)
+        expected = [False, True, self.server.config.otaastart, False]
+
+        result = []
+        # Failing integrity check
+        with patch.object(msg, 'checkMIC', MagicMock(return_value=False)):
+            result.append((yield self.server._processJoinRequest(msg, app, device)))
+
+        # Passing join request assigns an OTAA address
+        device.devnonce = []
+        with patch.object(msg, 'checkMIC', MagicMock(return_value=True)):
+            result.append((yield self.server._processJoinRequest(msg, app, device)))
+            result.append(device.devaddr)
+
+            # Repeated devnonce fails
+            result.append((yield self.server._processJoinRequest(msg, app, device)))
+
+        self.assertEqual(expected, result)
 
         
         
@@ -3,6 +3,7 @@ import json
 
 from twisted.trial import unittest
 from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import Clock
 from mock import patch, MagicMock
 
 from twistar.registry import Registry
@@ -79,6 +80,140 @@ class TxpkTest(unittest.TestCase):
         
         self.assertEqual(expected, result)
     
+    def test_encode_imme(self):
+        """Test encode method with immediate transmit and no data"""
+        expected = {'txpk': {'imme': True, 'freq': 923.3, 'size': 0,
+                             'time': '2016-09-06T21:02:05.128290Z'}}
+        
+        txpk = lora_wan.Txpk(imme=True, time='2016-09-06T21:02:05.128290Z',
+                             freq=923.3)
+        result = json.loads(txpk.encode())
+        
+        self.assertEqual(expected, result)
+    
+class AirtimeTest(unittest.TestCase):
+    """Test airtime function"""
+
+    def test_airtime(self):
+        """Test airtime function"""
+        expected = [46336, 1155072, 288768, 92672]
+
+        result = [lora_wan.airtime('SF7BW125', 13),
+                  lora_wan.airtime('SF12BW125', 13),
+                  lora_wan.airtime('SF12BW500', 13),
+                  lora_wan.airtime('SF10BW500', 20)]
+
+        self.assertEqual(expected, result)
+
+    def test_tmstDiff(self):
+        """Test tmstDiff function across the counter wrap"""
+        expected = [100, -100, 10]
+
+        result = [lora_wan.tmstDiff(200, 100), lora_wan.tmstDiff(100, 200),
+                  lora_wan.tmstDiff(5, 4294967291)]
+
+        self.assertEqual(expected, result)
+
+class DownlinkSchedulerTest(unittest.TestCase):
+    """Test DownlinkScheduler class"""
+
+    def setUp(self):
+        """Test setup. Creates a scheduler using a fake reactor clock"""
+        self.clock = Clock()
+        self.clock.advance(1000.0)
+        self.patcher = patch.object(lora_wan, 'reactor', self.clock)
+        self.patcher.start()
+        self.lora = MagicMock()
+        self.scheduler = lora_wan.DownlinkScheduler(self.lora)
+        self.request = lora_wan.GatewayMessage(remote=('192.168.1.125', 1700))
+        self.rx = {1: {'delay': 1}, 2: {'delay': 2}}
+
+    def tearDown(self):
+        """Test teardown"""
+        self.patcher.stop()
+
+    def _txpk(self, tmst):
+        """Create RX1 and RX2 Txpk objects for an uplink at tmst"""
+        return {1: lora_wan.Txpk(tmst=tmst + 1000000, datr='SF10BW500',
+                                 codr='4/5', size=20, ncrc=False),
+                2: lora_wan.Txpk(tmst=tmst + 2000000, datr='SF12BW500',
+                                 codr='4/5', size=20, ncrc=False)}
+
+    def test_schedule(self):
+        """Test schedule method selects a free window"""
+        expected = [1, 2, None, 1]
+
+        result = []
+        # The second uplink RX1 overlaps the first, and its RX2
+        # window is free. The third repeats the second.
+        for tmst in (0, 50000, 50000, 5000000):
+            result.append(self.scheduler.schedule(self.request,
+                          self._txpk(tmst), [1, 2]))
+        stats = self.scheduler.stats('192.168.1.125')
+
+        self.assertEqual(expected, result)
+        self.assertEqual((2, 1, 1), (stats['rx1'], stats['rx2'],
+                                     stats['collisions']))
+        self.assertEqual(3, self.lora.sendPullResponse.call_count)
+
+    def test_select(self):
+        """Test select method does not commit the window"""
+        expected = [1, 1, 2]
+
+        txpk = self._txpk(0)
+        result = [self.scheduler.select('192.168.1.125', txpk, [1, 2]),
+                  self.scheduler.select('192.168.1.125', txpk, [1, 2])]
+        self.scheduler.commit(self.request, txpk[1], 1)
+        result.append(self.scheduler.select('192.168.1.125', txpk, [1, 2]))
+
+        self.assertEqual(expected, result)
+
+    def test_sendImmediate(self):
+        """Test immediate downlinks are placed on the timeline"""
+        txpk = lora_wan.Txpk(imme=True, datr='SF12BW500', codr='4/5',
+                             ncrc=False)
+        expected = [[], [(1500000, 165888)], None]
+
+        self.scheduler.sendImmediate(self.request, txpk)
+        result = [self.scheduler.timelines.get('192.168.1.125', [])]
+        self.scheduler.observe('192.168.1.125', 1000000, self.clock.seconds())
+        self.clock.advance(0.5)
+        self.scheduler.sendImmediate(self.request, txpk)
+        result.append(self.scheduler.timelines['192.168.1.125'])
+        # An RX1 downlink at the same time collides
+        result.append(self.scheduler.select('192.168.1.125',
+                      self._txpk(500000), [1]))
+
+        self.assertEqual(expected, result)
+        self.assertEqual(2, self.lora.sendPullResponse.call_count)
+        self.assertEqual(2, self.scheduler.stats('192.168.1.125')['imme'])
+
+    def test_schedule_dispatch(self):
+        """Test PULL_RESP dispatch ahead of the receive window"""
+        expected = [0, 0, 1]
+
+        arrival = self.clock.seconds()
+        self.scheduler.schedule(self.request, self._txpk(0), [2],
+                                arrival, self.rx)
+        result = [self.lora.sendPullResponse.call_count]
+        self.clock.advance(1.7)
+        result.append(self.lora.sendPullResponse.call_count)
+        self.clock.advance(0.1)
+        result.append(self.lora.sendPullResponse.call_count)
+
+        self.assertEqual(expected, result)
+        self.assertEqual(0, len(self.scheduler.calls))
+
+    def test_stop(self):
+        """Test stop method cancels pending dispatches"""
+        arrival = self.clock.seconds()
+        self.scheduler.schedule(self.request, self._txpk(0), [1, 2],
+                                arrival, self.rx)
+        self.scheduler.stop()
+        self.clock.advance(3)
+
+        self.assertFalse(self.lora.sendPullResponse.called)
+
 class GatewayMessageTest(unittest.TestCase):
     """Test GatewayMessage class"""
     
@@ -151,7 +286,7 @@ class LoraWANTest(unittest.TestCase):
         
         self.lora = lora_wan.LoraWAN(server)
         g = Gateway(host='192.168.1.125', name='Test', enabled=True, power=26)
-        self.lora.gateways.append(g)
+        self.lora.addGateway(g)
         
     def test_addGateway(self):
         """ Test addGateway method"""
@@ -160,7 +295,7 @@ class LoraWANTest(unittest.TestCase):
         
         g = Gateway(host=address, name='Test Add', enabled=True, power=26)
         self.lora.addGateway(g)        
-        result = self.lora.gateways[1].host
+        result = self.lora.gateways[address].host
         
         self.assertEqual(expected, result)
         
@@ -169,18 +304,19 @@ class LoraWANTest(unittest.TestCase):
         address = '192.168.1.199'
         expected = address
 
-        host = self.lora.gateways[0].host
+        host = '192.168.1.125'
         gateway = Gateway(host=address, name='Test Update', enabled=True, power=26)
         self.lora.updateGateway(host, gateway)      
-        result = self.lora.gateways[0].host
+        result = self.lora.gateway(address).host
         
         self.assertEqual(expected, result)
+        self.assertIsNone(self.lora.gateway(host))
 
     def test_deleteGateway(self):
         """Test updateGateway method"""
         expected = 0
         
-        gateway = self.lora.gateways[0]
+        gateway = self.lora.gateway('192.168.1.125')
         self.lora.deleteGateway(gateway)      
         result = len(self.lora.gateways)
         
@@ -195,3 +331,19 @@ class LoraWANTest(unittest.TestCase):
         result = gateway.host
         
         self.assertEqual(expected, result)
+
+    def test_gatewayByEUI(self):
+        """Test gatewayByEUI method"""
+        eui = 17988221336647925760L
+        expected = [None, '192.168.1.125', None]
+        
+        # The EUI is indexed on receipt of the first PULL_DATA
+        data = '\x01O\x8f\x02\x00\x80\x00\x00\x00\x00\xa3\xf9'
+        result = [self.lora.gatewayByEUI(eui)]
+        with patch.object(self.lora, '_acknowledgePullData', MagicMock()):
+            self.lora.datagramReceived(data, ('192.168.1.125', 55369))
+        result.append(self.lora.gatewayByEUI(eui).host)
+        self.lora.deleteGateway(self.lora.gateway('192.168.1.125'))
+        result.append(self.lora.gatewayByEUI(eui))
+        
+        self.assertEqual(expected, result)
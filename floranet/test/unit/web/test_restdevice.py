@@ -79,6 +79,14 @@ class RestDeviceTest(unittest.TestCase):
             with patch.object(Device, 'find', classmethod(mockDBObject.findSuccess)):
                 result = yield resource.get(device.deveui)
                 self.assertEqual(device.deveui, result['deveui'])
+            
+            # A cached device is read from the session table
+            cached = self._test_device()
+            cached.name = 'cached'
+            self.server.devices.add(cached)
+            with patch.object(Device, 'find', classmethod(mockDBObject.findFail)):
+                result = yield resource.get(device.deveui)
+                self.assertEqual('cached', result['name'])
                 
     @inlineCallbacks
     def test_put(self):
@@ -105,6 +113,27 @@ class RestDeviceTest(unittest.TestCase):
                 device.update = MagicMock()
                 result = yield resource.put(device.deveui)
                 self.assertEqual(expected, result)
+            
+            # A cached device is compared against its session state, and
+            # is not changed when validation fails
+            cached = self._test_device()
+            cached.devaddr = int('0x06000002', 16)
+            self.server.devices.add(cached)
+            args = {'devaddr': int('0x06000003', 16), 'name': None}
+            with patch.object(reqparse.RequestParser, 'parse_args',
+                              MagicMock(return_value=args)), \
+                    patch.object(Device, 'find', classmethod(mockDBObject.findSuccess)):
+                resource = RestDevice(restapi=self.restapi, server=self.server)
+                device.valid = MagicMock(return_value=(False, {}))
+                yield self.assertFailure(resource.put(device.deveui), e.BadRequest)
+                self.assertEqual(int('0x06000002', 16), cached.devaddr)
+                
+                device.valid = MagicMock(return_value=(True, {}))
+                device.update = MagicMock()
+                result = yield resource.put(device.deveui)
+                device.update.assert_called_once_with(devaddr=args['devaddr'])
+                self.assertEqual(args['devaddr'], cached.devaddr)
+                self.assertIs(cached, self.server.devices.get(args['devaddr']))
 
     @inlineCallbacks
     def test_delete(self):
@@ -223,11 +252,13 @@ class RestDevicesTest(unittest.TestCase):
             yield self.assertFailure(resource.post(), e.BadRequest)
             
         # Valid device - returns 201 with location
+        mockDBObject.return_value = device
         with patch.object(reqparse.RequestParser, 'parse_args',
                           MagicMock(return_value=args)), \
                 patch.object(Device, 'exists', MagicMock(return_value=False)), \
                 patch.object(Device, 'valid', MagicMock(return_value=(True, {}))), \
-                patch.object(Device, 'save',  MagicMock(return_value=device)):
+                patch.object(Device, 'save',  MagicMock(return_value=device)), \
+                patch.object(Device, 'find', classmethod(mockDBObject.findSuccess)):
             resource = RestDevices(restapi=self.restapi, server=self.server)
             expected = ({}, 201, {'Location':
                 self.restapi.api.prefix + '/device/' + str(device.deveui)})
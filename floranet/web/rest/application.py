@@ -8,6 +8,8 @@ from crochet import wait_for, TimeoutError
 from floranet.models.application import Application
 from floranet.imanager import interfaceManager
 from floranet.models.device import Device
+from floranet.lora.crypto import cipherCache
+from floranet.cache import applicationCache, propertyCache
 from floranet.util import euiString, intHexString
 from floranet.log import log
 
@@ -123,6 +125,7 @@ class RestApplication(ApplicationResource):
             
             self.args['appinterface_id'] = self.args.pop('interface')
             current_appif = app.appinterface_id
+            current_appkey = app.appkey
             
             kwargs = {}
             for a,v in self.args.items():
@@ -136,6 +139,12 @@ class RestApplication(ApplicationResource):
             # Update the model
             if kwargs:
                 app.update(**kwargs)
+                applicationCache.invalidate(appeui)
+                applicationCache.invalidate(app.appeui)
+                interfaceManager.removeRoute(appeui, app.appeui)
+                self.server.unknowneuis.clear()
+                if 'appkey' in kwargs:
+                    cipherCache.evict(current_appkey)
             
             # Check the interface being removed.
             if current_appif != app.appinterface_id:
@@ -169,6 +178,10 @@ class RestApplication(ApplicationResource):
                 abort(404, message={'error': "Application {} doesn't exist."
                                     .format(euiString(appeui))})
             yield app.delete()
+            applicationCache.invalidate(appeui)
+            propertyCache.clear()
+            interfaceManager.removeRoute(appeui)
+            cipherCache.evict(app.appkey)
             returnValue(({}, 200))
 
         except TimeoutError:
@@ -253,6 +266,8 @@ class RestApplications(ApplicationResource):
             a = yield app.save()
             if a is None:
                 abort(500, message={'error': "Error saving the application."})
+            # Joins from this application's devices may have been cached
+            self.server.unknowneuis.clear()
             location = self.restapi.api.prefix + '/app/' + str(appeui)
             returnValue(({}, 201, {'Location': location}))
             
@@ -7,6 +7,7 @@ from crochet import wait_for, TimeoutError
 
 from floranet.models.application import Application
 from floranet.models.appproperty import AppProperty
+from floranet.cache import propertyCache
 from floranet.util import euiString, intHexString
 from floranet.log import log
 
@@ -118,6 +119,8 @@ class RestAppProperty(AppPropertyResource):
             # Update the model
             if kwargs:
                 p.update(**kwargs)
+                propertyCache.invalidate(app.id, port)
+                propertyCache.invalidate(app.id, p.port)
             returnValue(({}, 200))
 
         except TimeoutError:
@@ -149,6 +152,7 @@ class RestAppProperty(AppPropertyResource):
                  abort(404, message={'error': "Application property doesn't exist."})
             
             yield p.delete()
+            propertyCache.invalidate(app.id, port)
             returnValue(({}, 200))
 
         except TimeoutError:
@@ -4,6 +4,7 @@ from twisted.internet.defer import inlineCallbacks, returnValue
 from crochet import wait_for, TimeoutError
 
 from floranet.models.device import Device
+from floranet.lora.crypto import cipherCache
 from floranet.util import euiString
 from ...log import log
 
@@ -75,7 +76,10 @@ class RestDevice(DeviceResource):
             deveui (int): Device deveui
         """
         try:
-            d = yield Device.find(where=['deveui = ?', deveui], limit=1)
+            # A cached device holds the current session state
+            d = self.server.devices.getByEUI(deveui)
+            if d is None:
+                d = yield Device.find(where=['deveui = ?', deveui], limit=1)
             # Return a 404 if not found.
             if d is None:
                abort(404, message={'error': "Device {} doesn't exist".
@@ -101,18 +105,35 @@ class RestDevice(DeviceResource):
                 abort(404, message={'error': "Device {} doesn't exist".
                                     format(euiString(deveui))})
             
+            # Compare against the session state of a cached device, and
+            # validate the row with it, leaving the cached device untouched
+            # until the update is accepted.
+            current = self.server.devices.getByEUI(deveui)
+            if current is None:
+                current = device
             kwargs = {}
+            keys = (current.nwkskey, current.appskey)
             for a,v in self.args.items():
-                if v is not None and v != getattr(device, a):
+                if v is not None and v != getattr(current, a):
                     kwargs [a] = v
-                    setattr(device, a, v)
+                else:
+                    v = getattr(current, a)
+                setattr(device, a, v)
             (valid, message) = yield device.valid(self.server)
             if not valid:
                 abort(400, message=message)
             
-            # Update the device with the new attributes
+            # Update the device and the server session table with the
+            # new attributes
             if kwargs:
                 device.update(**kwargs)
+                self.server.devices.refresh(deveui, **kwargs)
+                if 'devaddr' in kwargs:
+                    self.server.unknownaddrs.discard(device.devaddr)
+                self.server.unknowneuis.discard(deveui)
+                # Evict ciphers for replaced session keys
+                if 'nwkskey' in kwargs or 'appskey' in kwargs:
+                    cipherCache.evict(*keys)
             returnValue(({}, 200))
 
         except TimeoutError:
@@ -128,12 +149,18 @@ class RestDevice(DeviceResource):
             deveui (int): Device deveui
         """
         try:
-            d = yield Device.find(where=['deveui = ?', deveui], limit=1)
+            # A cached device holds the current session state
+            d = self.server.devices.getByEUI(deveui)
+            if d is None:
+                d = yield Device.find(where=['deveui = ?', deveui], limit=1)
             # Return a 404 if not found.
             if d is None:
                 abort(404, message={'error': "Device {} doesn't exist".
                                     format(euiString(deveui))})
             deleted = yield d.delete()
+            self.server.devices.remove(deveui)
+            self.server.adr.remove(deveui)
+            cipherCache.evict(d.nwkskey, d.appskey)
             returnValue(({}, 200))
 
         except TimeoutError:
@@ -218,6 +245,10 @@ class RestDevices(DeviceResource):
             d = yield device.save()
             if d is None:
                 abort(500, message={'error': "Error saving device"})
+            yield self.server.devices.reload(device.deveui)
+            if devaddr is not None:
+                self.server.unknownaddrs.discard(devaddr)
+            self.server.unknowneuis.discard(deveui)
             location = self.restapi.api.prefix + '/device/' + str(device.deveui)
             returnValue(({}, 201, {'Location': location}))
         except TimeoutError:
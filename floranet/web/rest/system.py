@@ -35,6 +35,7 @@ class RestSystem(Resource):
             'freqband': fields.String,
             'netid': fields.Integer,
             'duplicateperiod': fields.Integer,
+            'aggregationperiod': fields.Integer,
             'fcrelaxed': fields.Boolean,
             'otaastart': fields.Integer,
             'otaaend':  fields.Integer,
@@ -44,6 +45,7 @@ class RestSystem(Resource):
             'adrmargin': fields.Float,
             'adrcycletime': fields.Integer,
             'adrmessagetime': fields.Integer,
+            'adrsnapshottime': fields.Integer,
         }
         self.parser = reqparse.RequestParser(bundle_errors=True)
         self.parser.add_argument('name', type=str)
@@ -54,6 +56,7 @@ class RestSystem(Resource):
         self.parser.add_argument('freqband', type=str)
         self.parser.add_argument('netid', type=int)
         self.parser.add_argument('duplicateperiod', type=int)
+        self.parser.add_argument('aggregationperiod', type=int)
         self.parser.add_argument('fcrelaxed', type=bool)
         self.parser.add_argument('otaastart', type=int)
         self.parser.add_argument('otaaend', type=int)
@@ -63,6 +66,7 @@ class RestSystem(Resource):
         self.parser.add_argument('adrmargin', type=float)
         self.parser.add_argument('adrcycletime', type=int)
         self.parser.add_argument('adrmessagetime', type=int)
+        self.parser.add_argument('adrsnapshottime', type=int)
         self.args = self.parser.parse_args()
                             
     @login_required